@@ -1,40 +1,140 @@
-import time, json, requests
+import os, sys, time, json, socket
+
+# The schema and wire format are shared with the server and live two levels up.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from common import wire
+from common.metrics import REGISTRY
+from common.profiler import SamplingProfiler
+from common.schema import normalize_payload
 from modules import (
     identity_session, process_activity, file_operations,
     network_monitor, registry_changes, usb_monitor,
     email_cloud_apps, av_alerts, clipboard_screen
 )
+from delta import DeltaEncoder
+from scheduler import Collector, Scheduler
+from transport import Transport
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+TICK_INTERVAL = 0.5
+
+def load_config(path=CONFIG_FILE):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print("[-] Using default config:", e)
+        return {}
+
+CONFIG = load_config()
+SERVER_URL = CONFIG.get("server_url", "http://localhost:5000/agent")
+SEND_INTERVAL = CONFIG.get("send_interval", 10)
+SPOOL_DIR = CONFIG.get("spool_dir", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_MAX_BYTES = CONFIG.get("spool_max_bytes", 100 * 1024 * 1024)
+WIRE_FORMAT = {"msgpack": wire.MSGPACK, "json": wire.JSON}.get(CONFIG.get("wire_format", "msgpack"), wire.JSON)
+STATS_FILE = CONFIG.get("stats_file", os.path.join(os.path.dirname(os.path.abspath(__file__)), "stats.json"))
+# Creating this file starts the sampling profiler for the number of seconds it
+# contains (default 30); the collapsed stacks are written to PROFILE_FILE.
+PROFILE_TRIGGER = CONFIG.get("profile_trigger", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profile.request"))
+PROFILE_FILE = CONFIG.get("profile_file", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profile.txt"))
+AGENT_ID = socket.gethostname()
+
+COLLECTORS = [
+    ("identity", identity_session.collect, []),
+    ("processes", process_activity.collect, []),
+    ("files", file_operations.collect, []),
+    ("network", network_monitor.collect, []),
+    ("registry", registry_changes.collect, []),
+    ("usb", usb_monitor.collect, []),
+    ("email_cloud", email_cloud_apps.collect, []),
+    ("av_alerts", av_alerts.collect, []),
+    ("clipboard_screen", clipboard_screen.collect, []),
+]
 
-SERVER_URL = "http://localhost:5000/agent"
+def build_scheduler(config=CONFIG):
+    settings = config.get("collectors", {})
+    return Scheduler([
+        Collector(section, fn, default=default, **settings.get(section, {}))
+        for section, fn, default in COLLECTORS
+    ])
 
 def collect_all():
-    return {
-        "identity": identity_session.collect() or {},
-        "processes": process_activity.collect() or [],
-        "files": file_operations.collect() or [],
-        "network": network_monitor.collect() or [],
-        "registry": registry_changes.collect() or [],
-        "usb": usb_monitor.collect() or [],
-        "email_cloud": email_cloud_apps.collect() or [],
-        "av_alerts": av_alerts.collect() or [],
-        "clipboard_screen": clipboard_screen.collect() or []
-    }
+    return {section: fn() or default for section, fn, default in COLLECTORS}
+
+def write_stats(scheduler, path=STATS_FILE):
+    stats = {"time": time.time(), "collectors": scheduler.stats(), "metrics": REGISTRY.snapshot()}
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(stats, f, indent=2, default=str)
+        os.replace(tmp, path)
+    except OSError as e:
+        print("[-] Failed to write stats:", e)
+
+def check_profiler(profiler, until):
+    # Returns when the running profile should be written, or None.
+    now = time.monotonic()
+    if until is not None and now >= until:
+        try:
+            with open(PROFILE_FILE, "w") as f:
+                f.write(profiler.stop())
+            print(f"[+] Profile written to {PROFILE_FILE}")
+        except OSError as e:
+            print("[-] Failed to write profile:", e)
+        return None
+    if until is None and os.path.exists(PROFILE_TRIGGER):
+        try:
+            with open(PROFILE_TRIGGER) as f:
+                seconds = float(f.read().strip() or 30)
+            os.remove(PROFILE_TRIGGER)
+        except (OSError, ValueError) as e:
+            print("[-] Ignoring profile request:", e)
+            return None
+        if profiler.start(seconds):
+            print(f"[+] Profiling for {seconds:g}s")
+            return now + seconds
+    return until
 
 def main():
+    email_cloud_apps.configure(**CONFIG.get("onedrive", {}))
+    transport = Transport(SERVER_URL, AGENT_ID, SPOOL_DIR, spool_max_bytes=SPOOL_MAX_BYTES,
+                          wire_format=WIRE_FORMAT, encoder=DeltaEncoder(AGENT_ID))
+    scheduler = build_scheduler()
+    REGISTRY.gauge("insider_agent_spool_bytes", "Bytes waiting in the spool.", transport.spool.total_bytes)
+    REGISTRY.gauge("insider_agent_spool_dropped", "Spooled payloads dropped at the size cap.",
+                   lambda: transport.spool.dropped)
+    REGISTRY.gauge("insider_agent_network_flows", "Connections in the flow table.",
+                   lambda: network_monitor.stats()["flows"])
+    REGISTRY.gauge("insider_agent_hash_lookups", "Executable hash cache lookups, by result.",
+                   lambda: {(k,): v for k, v in process_activity.stats().items() if k in ("hits", "misses", "errors")},
+                   ("result",))
+    REGISTRY.gauge("insider_agent_hash_pending", "Executables queued for background hashing.",
+                   lambda: process_activity.stats()["pending"])
+    REGISTRY.gauge("insider_agent_hash_cache_entries", "Entries in the executable hash cache.",
+                   lambda: process_activity.stats()["entries"])
+    REGISTRY.gauge("insider_agent_file_events", "File events by fate: buffered, dropped at the cap, coalesced.",
+                   lambda: {(k,): v for k, v in file_operations.stats().items() if k in ("buffered", "dropped", "coalesced")},
+                   ("state",))
+    REGISTRY.gauge("insider_agent_file_enrich", "File enrichment queue depth and submissions dropped when full.",
+                   lambda: {("pending",): file_operations.stats()["enrich_pending"],
+                            ("dropped",): file_operations.stats()["enrich_dropped"]},
+                   ("state",))
+    profiler = SamplingProfiler()
+    profile_until = None
+    next_send = time.monotonic() + SEND_INTERVAL
     while True:
-        payload = collect_all()
-        try:
-            print("\n[+] Sending data to server...")
-            response = requests.post(
-                SERVER_URL,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
-            print("[+] Server response:", response.status_code, response.text)
-        except Exception as e:
-            print("[-] Error sending data:", e)
-        time.sleep(10)
+        scheduler.tick()
+        profile_until = check_profiler(profiler, profile_until)
+        if time.monotonic() < next_send:
+            time.sleep(TICK_INTERVAL)
+            continue
+        next_send += SEND_INTERVAL
+        snapshot = normalize_payload(scheduler.snapshot())
+        snapshot["collectors"] = scheduler.stats()
+        print("\n[+] Sending data to server...")
+        transport.send(snapshot)
+        write_stats(scheduler)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+import hashlib
+import json
+
+# Sends only what changed since the last payload handed to the transport.
+# List sections are diffed record by record; records are matched on the key
+# fields below, or on their content when a section has no natural key. A
+# section missing from a payload has not been refreshed and is unchanged; its
+# last value is kept so that keyframes still carry it.
+KEY_FIELDS = {
+    "processes": ("PID", "ProcessPath"),
+    "network": ("Protocol", "SourceIP", "SourcePort", "DestIP", "DestPort"),
+    "usb": ("MountPoint",),
+}
+
+KEYFRAME_EVERY = 30
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+
+
+def _digest(text):
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def _index(section, records):
+    fields = KEY_FIELDS.get(section)
+    index = {}
+    for record in records:
+        text = _canonical(record)
+        if fields:
+            key = _canonical([record.get(f) for f in fields])
+        else:
+            key = _digest(text)
+        # Identical records in unkeyed sections stay distinct entries.
+        base, n = key, 1
+        while key in index:
+            key = f"{base}#{n}"
+            n += 1
+        index[key] = (_digest(text), record)
+    return index
+
+
+class DeltaEncoder:
+    def __init__(self, agent_id, keyframe_every=KEYFRAME_EVERY):
+        self.agent_id = agent_id
+        self.keyframe_every = keyframe_every
+        self.seq = 0
+        self.since_keyframe = None
+        self.last = {}
+        self.latest = {}
+
+    def reset(self):
+        # Called when a payload may not have reached the server; the next
+        # message is a full keyframe the server can rebuild from scratch.
+        self.since_keyframe = None
+        self.last = {}
+
+    def encode(self, payload):
+        # A keyframe is simply a diff against empty state, so the server
+        # rebuilds both kinds of message the same way.
+        self.seq += 1
+        keyframe = self.since_keyframe is None or self.since_keyframe + 1 >= self.keyframe_every
+        last = {} if keyframe else self.last
+        self.latest.update(payload)
+        current = {}
+        changes = {}
+        for section, value in self.latest.items():
+            if section not in payload and section in last:
+                current[section] = last[section]
+            elif isinstance(value, list):
+                index = _index(section, value)
+                current[section] = {key: digest for key, (digest, _) in index.items()}
+                diff = self._diff(last.get(section, {}), index)
+                if diff or keyframe:
+                    changes[section] = diff
+            else:
+                current[section] = _digest(_canonical(value))
+                if current[section] != last.get(section):
+                    changes[section] = {"set": value}
+
+        self.last = current
+        self.since_keyframe = 0 if keyframe else self.since_keyframe + 1
+        return {
+            "agent_id": self.agent_id,
+            "delta": {"seq": self.seq, "keyframe": keyframe},
+            "changes": changes,
+        }
+
+    @staticmethod
+    def _diff(old, new):
+        added = []
+        changed = []
+        for key, (digest, record) in new.items():
+            previous = old.get(key)
+            if previous is None:
+                added.append([key, record])
+            elif previous != digest:
+                changed.append([key, record])
+        removed = [key for key in old if key not in new]
+        diff = {}
+        if added:
+            diff["added"] = added
+        if changed:
+            diff["changed"] = changed
+        if removed:
+            diff["removed"] = removed
+        return diff
@@ -1,28 +1,184 @@
-import subprocess
-import json
-from datetime import datetime
+import json, os, queue, subprocess, threading, uuid
 
-def get_defender_alerts():
-    try:
-        ps_script = "Get-MpThreatDetection | ConvertTo-Json"
-        output = subprocess.check_output(["powershell", "-Command", ps_script], text=True)
-        data = json.loads(output)
-        if isinstance(data, dict):
-            data = [data]
+# Reports Defender detections newer than a persisted high-water mark (the
+# InitialDetectionTime of the last detection reported, plus the DetectionIDs
+# seen at exactly that time), so each detection is sent once. Queries run in
+# one long-lived PowerShell host instead of a new process per cycle; the
+# filter and sort run on the PowerShell side, and each detection comes back as
+# one compressed JSON line that is parsed as it arrives.
+BOOKMARK_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "defender_bookmark.json")
+MAX_EVENTS = 200  # Per cycle; the rest are picked up on the next one
+COMMAND_TIMEOUT = 30
+POWERSHELL = ["powershell", "-NoLogo", "-NoProfile", "-NonInteractive", "-Command", "-"]
+
+SEVERITY = {0: "unknown", 1: "low", 2: "moderate", 4: "high", 5: "severe"}
+
+# One line, because the host runs each line of stdin as it arrives.
+QUERY = (
+    "try {{ "
+    "$since = [DateTime]::Parse('{since}', [Globalization.CultureInfo]::InvariantCulture, "
+    "[Globalization.DateTimeStyles]::AdjustToUniversal); "
+    "$d = @(Get-MpThreatDetection | Where-Object {{ $_.InitialDetectionTime.ToUniversalTime() -ge $since }} "
+    "| Sort-Object InitialDetectionTime | Select-Object -First {limit}); "
+    "$t = @{{}}; if ($d.Count) {{ Get-MpThreat | ForEach-Object {{ $t[$_.ThreatID] = $_ }} }}; "
+    "foreach ($x in $d) {{ [pscustomobject]@{{ "
+    "DetectionID = $x.DetectionID; ThreatID = $x.ThreatID; "
+    "ThreatName = $t[$x.ThreatID].ThreatName; SeverityID = $t[$x.ThreatID].SeverityID; "
+    "Resources = @($x.Resources); ProcessName = $x.ProcessName; ActionSuccess = $x.ActionSuccess; "
+    "InitialDetectionTime = $x.InitialDetectionTime.ToUniversalTime().ToString('o') "
+    "}} | ConvertTo-Json -Compress }} "
+    "}} catch {{ @{{ error = $_.Exception.Message }} | ConvertTo-Json -Compress }}"
+)
+EPOCH = "1970-01-01T00:00:00.0000000Z"
+
+class PowerShellHost:
+    # A persistent command host. run() writes one line to its stdin, followed
+    # by a Write-Output of a per-command sentinel, and yields output lines
+    # until the sentinel comes back. argv is pluggable, so tests can drive the
+    # same protocol with a stub process. A command that is not read to the end
+    # kills the host, so stale output never leaks into the next command.
+    def __init__(self, argv=POWERSHELL, timeout=COMMAND_TIMEOUT):
+        self.argv = argv
+        self.timeout = timeout
+        self.process = None
+        self.lines = None
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, encoding="utf-8", errors="replace", bufsize=1,
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+        )
+        # Reads happen on a thread so a hung host can be timed out and killed.
+        self.lines = queue.Queue()
+        threading.Thread(target=self._pump, args=(self.process, self.lines), daemon=True).start()
+
+    @staticmethod
+    def _pump(process, lines):
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def run(self, script):
+        if self.process is None or self.process.poll() is not None:
+            self._start()
+        sentinel = f"__end_{uuid.uuid4().hex}__"
+        done = False
+        try:
+            self.process.stdin.write(f"{script}; Write-Output '{sentinel}'\n")
+            self.process.stdin.flush()
+            while True:
+                try:
+                    line = self.lines.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"no output from {self.argv[0]} for {self.timeout}s")
+                if line is None:
+                    raise RuntimeError(f"{self.argv[0]} exited")
+                line = line.rstrip("\r\n")
+                if line == sentinel:
+                    done = True
+                    return
+                yield line
+        finally:
+            if not done:
+                self.close()
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+            self.process = None
+
+class DefenderSource:
+    def __init__(self, host=None):
+        self.host = host or PowerShellHost()
 
+    def read_after(self, since, limit):
+        # Yields detections with InitialDetectionTime >= since, oldest first.
+        script = QUERY.format(since=since or EPOCH, limit=int(limit))
+        for line in self.host.run(script):
+            if not line.startswith("{"):
+                continue  # Banners and blank lines from the host
+            detection = json.loads(line)
+            if "error" in detection:
+                raise RuntimeError(detection["error"])
+            yield detection
+
+class FileDefenderSource:
+    # Test stand-in: one detection per line, as JSON with the fields QUERY emits.
+    def __init__(self, path):
+        self.path = path
+
+    def read_after(self, since, limit):
+        with open(self.path, "r") as f:
+            detections = [json.loads(line) for line in f if line.strip()]
+        detections = sorted(
+            (d for d in detections if since is None or d["InitialDetectionTime"] >= since),
+            key=lambda d: d["InitialDetectionTime"],
+        )
+        yield from detections[:limit]
+
+class DefenderReader:
+    def __init__(self, source, bookmark_file=BOOKMARK_FILE, limit=MAX_EVENTS):
+        self.source = source
+        self.bookmark_file = bookmark_file
+        self.limit = limit
+        self.since, self.seen = self._load()
+
+    def _load(self):
+        try:
+            with open(self.bookmark_file, "r") as f:
+                data = json.load(f)
+            return data["InitialDetectionTime"], set(data["DetectionIDs"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, set()
+
+    def _save(self):
+        tmp = self.bookmark_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"InitialDetectionTime": self.since, "DetectionIDs": sorted(self.seen)}, f)
+        os.replace(tmp, self.bookmark_file)
+
+    def read(self):
         alerts = []
-        for d in data:
+        since, seen = self.since, set(self.seen)
+        # Detections at the mark itself were reported already, so the window
+        # is widened by their number to still return `limit` new ones.
+        for d in self.source.read_after(self.since, self.limit + len(self.seen)):
+            detected, detection_id = d.get("InitialDetectionTime"), d.get("DetectionID")
+            if detected == self.since and detection_id in self.seen:
+                continue
+            if detected != since:
+                since, seen = detected, set()
+            seen.add(detection_id)
+            resources = d.get("Resources") or []
+            severity = d.get("SeverityID")
             alerts.append({
-                "alert_id": d.get("ThreatID"),
-                "signature": d.get("ThreatName"),
-                "severity": d.get("SeverityID"),
-                "involved_file": d.get("InitialDetectionSource"),
-                "action_taken": d.get("ActionSuccess"),
-                "timestamp": datetime.utcnow().isoformat() + "Z"
+                "AlertID": detection_id or d.get("ThreatID"),
+                "Signature": d.get("ThreatName"),
+                "Severity": SEVERITY.get(severity, severity),
+                "InvolvedFile": resources[0] if resources else None,
+                "InvolvedProcess": d.get("ProcessName"),
+                "ActionTaken": {True: "success", False: "failed"}.get(d.get("ActionSuccess")),
+                "Timestamp": detected,
             })
+        if since != self.since or seen != self.seen:
+            self.since, self.seen = since, seen
+            self._save()
         return alerts
+
+_reader = None
+
+def get_defender_alerts():
+    global _reader
+    try:
+        if _reader is None:
+            _reader = DefenderReader(DefenderSource())
+        return _reader.read()
     except Exception as e:
-        return [{"error": str(e)}]
+        return [{"Error": str(e)}]
 
 def collect():
     return get_defender_alerts()
@@ -1,33 +1,164 @@
-import win32clipboard
+import json
 from datetime import datetime
-from PIL import ImageGrab
-import os
 
-def get_clipboard_event():
-    try:
+try:
+    import ctypes, psutil, win32api, win32clipboard, win32process
+except ImportError:  # Non-Windows hosts can still run the monitor with FakeClipboardBackend
+    win32clipboard = None
+
+# Reports clipboard changes and screen captures as they happen, not a sample
+# of the current state. The clipboard sequence number (which Windows bumps on
+# every change) is read each cycle without opening the clipboard; only when it
+# moved is the clipboard opened, and then just to list its formats and the
+# size of each one, never to copy the data. An image arriving from a known
+# capture tool, or after the PrintScreen key, is a screen capture; a
+# PrintScreen press that left the clipboard alone is reported on its own.
+# Nothing is emitted when nothing changed.
+VK_SNAPSHOT = 0x2C
+
+STANDARD_FORMATS = {
+    1: "CF_TEXT", 2: "CF_BITMAP", 3: "CF_METAFILEPICT", 7: "CF_OEMTEXT", 8: "CF_DIB",
+    13: "CF_UNICODETEXT", 14: "CF_ENHMETAFILE", 15: "CF_HDROP", 16: "CF_LOCALE", 17: "CF_DIBV5",
+}
+
+# Content type by format, most specific first; the first present decides.
+CONTENT_TYPES = [
+    ("CF_HDROP", "files"), ("CF_DIBV5", "image"), ("CF_DIB", "image"), ("CF_BITMAP", "image"),
+    ("PNG", "image"), ("CF_UNICODETEXT", "text"), ("CF_TEXT", "text"), ("HTML Format", "text"),
+]
+
+CAPTURE_TOOLS = {
+    "snippingtool.exe", "screenclippinghost.exe", "screensketch.exe", "sharex.exe",
+    "greenshot.exe", "lightshot.exe", "snagit32.exe", "snagiteditor.exe",
+}
+
+class WinClipboardBackend:
+    def __init__(self):
+        self.global_size = ctypes.windll.kernel32.GlobalSize
+        self.global_size.argtypes = [ctypes.c_void_p]
+        self.global_size.restype = ctypes.c_size_t
+
+    def sequence(self):
+        return win32clipboard.GetClipboardSequenceNumber()
+
+    def formats(self):
+        # {format name: size in bytes, or None for GDI handles (bitmaps,
+        # metafiles) that have no memory size}.
+        formats = {}
         win32clipboard.OpenClipboard()
-        data = win32clipboard.GetClipboardData()
-        size = len(data.encode()) if isinstance(data, str) else len(data)
-        win32clipboard.CloseClipboard()
-        return {
-            "event": "copy",
-            "content_meta": {"size": size, "type": type(data).__name__},
-            "timestamp": datetime.utcnow().isoformat() + "Z"
-        }
-    except Exception:
-        return {}
-
-def get_screen_capture_event():
-    try:
-        img = ImageGrab.grab()
-        width, height = img.size
-        return {
-            "event": "PrintScreen",
-            "dimensions": {"width": width, "height": height},
-            "timestamp": datetime.utcnow().isoformat() + "Z"
-        }
-    except Exception:
-        return {}
+        try:
+            fmt = win32clipboard.EnumClipboardFormats(0)
+            while fmt:
+                name = STANDARD_FORMATS.get(fmt)
+                if name is None:
+                    try:
+                        name = win32clipboard.GetClipboardFormatName(fmt)
+                    except win32clipboard.error:
+                        name = str(fmt)
+                try:
+                    formats[name] = self.global_size(win32clipboard.GetClipboardDataHandle(fmt)) or None
+                except win32clipboard.error:
+                    formats[name] = None
+                fmt = win32clipboard.EnumClipboardFormats(fmt)
+        finally:
+            win32clipboard.CloseClipboard()
+        return formats
+
+    def owner(self):
+        hwnd = win32clipboard.GetClipboardOwner()
+        if not hwnd:
+            return None
+        try:
+            _, pid = win32process.GetWindowThreadProcessId(hwnd)
+            return psutil.Process(pid).name()
+        except (psutil.Error, OSError):
+            return None
+
+    def printscreen_pressed(self):
+        # Low bit: pressed since the previous call.
+        return bool(win32api.GetAsyncKeyState(VK_SNAPSHOT) & 1)
+
+class FakeClipboardBackend:
+    # Stands in for the clipboard in tests: set() a new content, press() the
+    # PrintScreen key.
+    def __init__(self):
+        self.seq = 0
+        self.content = {}
+        self.owner_name = None
+        self.pressed = False
+
+    def set(self, formats, owner=None):
+        self.seq += 1
+        self.content = dict(formats)
+        self.owner_name = owner
+
+    def press(self):
+        self.pressed = True
+
+    def sequence(self):
+        return self.seq
+
+    def formats(self):
+        return dict(self.content)
+
+    def owner(self):
+        return self.owner_name
+
+    def printscreen_pressed(self):
+        pressed, self.pressed = self.pressed, False
+        return pressed
+
+def content_type(formats):
+    for name, kind in CONTENT_TYPES:
+        if name in formats:
+            return name, kind
+    return None, "other" if formats else None
+
+class ClipboardMonitor:
+    def __init__(self, backend):
+        self.backend = backend
+        self.sequence = None
+
+    def poll(self, timestamp=None):
+        timestamp = timestamp or datetime.utcnow().isoformat() + "Z"
+        events = []
+        printscreen = self.backend.printscreen_pressed()
+        sequence = self.backend.sequence()
+        # The first cycle only records where the sequence stands.
+        if self.sequence is not None and sequence != self.sequence:
+            formats = self.backend.formats()
+            owner = self.backend.owner()
+            primary, kind = content_type(formats)
+            trigger = ""
+            if kind == "image":
+                if owner and owner.lower() in CAPTURE_TOOLS:
+                    trigger = owner
+                elif printscreen:
+                    trigger = "PrintScreen"
+                    printscreen = False
+            events.append({
+                "ClipboardEvent": "copy" if formats else "clear",
+                "ClipboardContentMeta": json.dumps({
+                    "type": kind,
+                    "size": formats.get(primary),
+                    "formats": formats,
+                    "owner": owner,
+                    "changes": sequence - self.sequence if sequence > self.sequence else 1,
+                }),
+                "ScreenCaptureTrigger": trigger,
+                "Timestamp": timestamp,
+            })
+        self.sequence = sequence
+        if printscreen:
+            events.append({"ScreenCaptureTrigger": "PrintScreen", "Timestamp": timestamp})
+        return events
+
+_monitor = None
 
 def collect():
-    return [get_clipboard_event(), get_screen_capture_event()]
+    global _monitor
+    if win32clipboard is None:
+        return []
+    if _monitor is None:
+        _monitor = ClipboardMonitor(WinClipboardBackend())
+    return _monitor.poll()
@@ -1,9 +1,19 @@
-import os, time
+import os, json, threading, time
 from datetime import datetime
-import win32com.client
+
+# OneDrive changes come from a persistent path -> (mtime, size) index. Each
+# scan re-lists only directories whose mtime moved, so an unchanged subtree
+# costs one stat per directory rather than one per file. In-place edits do
+# not touch a directory's mtime; they are picked up by a full rescan every
+# FULL_SCAN_EVERY cycles, or immediately in watchdog mode.
+ONEDRIVE_ROOT = os.environ.get("OneDrive") or os.path.expanduser("~/OneDrive")
+INDEX_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "onedrive_index.json")
+FULL_SCAN_EVERY = 30
+MAX_WATCH_PATHS = 10000
 
 def get_recent_emails(limit=5):
     try:
+        import win32com.client
         outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
         sent_items = outlook.GetDefaultFolder(5)
         messages = sent_items.Items
@@ -24,22 +34,201 @@ def get_recent_emails(limit=5):
         return [{"error": f"Outlook not available: {str(e)}"}]
 
 
+class ChangeIndex:
+    def __init__(self, root, index_file=INDEX_FILE, full_scan_every=FULL_SCAN_EVERY):
+        self.root = os.path.abspath(root)
+        self.index_file = index_file
+        self.full_scan_every = full_scan_every
+        self.scans = 0
+        self.files = {}
+        self.dirs = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("root") == self.root:
+            self.files = data.get("files", {})
+            self.dirs = data.get("dirs", {})
+
+    def save(self):
+        tmp = self.index_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"root": self.root, "files": self.files, "dirs": self.dirs}, f)
+        os.replace(tmp, self.index_file)
+
+    def scan(self):
+        # The very first scan only builds the baseline; it reports nothing.
+        baseline = not self.dirs
+        full = baseline or self.scans % self.full_scan_every == 0
+        self.scans += 1
+        changes = []
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self._forget_dir(path, changes)
+                continue
+            known = self.dirs.get(path)
+            if known is not None and known["mtime"] == mtime and not full:
+                stack.extend(os.path.join(path, d) for d in known["subdirs"])
+                continue
+            self._rescan_dir(path, mtime, changes, stack)
+        if changes or baseline or full:
+            self.save()
+        return [] if baseline else changes
+
+    def _rescan_dir(self, path, mtime, changes, stack):
+        known = self.dirs.get(path, {"files": [], "subdirs": []})
+        files = []
+        subdirs = []
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            entries = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                    stack.append(entry.path)
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            files.append(entry.name)
+            self._update_file(entry.path, st.st_mtime_ns, st.st_size, changes)
+        present = set(files)
+        for name in known["files"]:
+            if name not in present:
+                self._remove_file(os.path.join(path, name), changes)
+        present = set(subdirs)
+        for name in known["subdirs"]:
+            if name not in present:
+                self._forget_dir(os.path.join(path, name), changes)
+        self.dirs[path] = {"mtime": mtime, "files": files, "subdirs": subdirs}
+
+    def _update_file(self, path, mtime_ns, size, changes):
+        previous = self.files.get(path)
+        if previous is None:
+            changes.append(("created", path, mtime_ns))
+        elif previous != [mtime_ns, size]:
+            changes.append(("modified", path, mtime_ns))
+        else:
+            return
+        self.files[path] = [mtime_ns, size]
+
+    def _remove_file(self, path, changes):
+        if self.files.pop(path, None) is not None:
+            changes.append(("deleted", path, time.time_ns()))
+
+    def _forget_dir(self, path, changes):
+        known = self.dirs.pop(path, None)
+        if known is None:
+            return
+        for name in known["files"]:
+            self._remove_file(os.path.join(path, name), changes)
+        for name in known["subdirs"]:
+            self._forget_dir(os.path.join(path, name), changes)
+
+    def refresh(self, paths):
+        # Re-checks only the given paths (from watchdog events). A path that
+        # is gone may be a whole directory; everything indexed under it goes.
+        changes = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                parent = self.dirs.get(os.path.dirname(path))
+                if path in self.dirs:
+                    self._forget_dir(path, changes)
+                    if parent is not None and os.path.basename(path) in parent["subdirs"]:
+                        parent["subdirs"].remove(os.path.basename(path))
+                else:
+                    self._remove_file(path, changes)
+                    if parent is not None and os.path.basename(path) in parent["files"]:
+                        parent["files"].remove(os.path.basename(path))
+                continue
+            if os.path.isdir(path):
+                continue
+            parent = self.dirs.get(os.path.dirname(path))
+            if parent is not None and os.path.basename(path) not in parent["files"]:
+                parent["files"].append(os.path.basename(path))
+            self._update_file(path, st.st_mtime_ns, st.st_size, changes)
+        if changes:
+            self.save()
+        return changes
+
+class ChangeWatcher:
+    # Optional watchdog-driven mode: events only mark paths dirty, and
+    # collect() re-checks just those paths against the index.
+    def __init__(self, index, max_paths=MAX_WATCH_PATHS):
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, e):
+                watcher.mark(e.src_path)
+                if getattr(e, "dest_path", None):
+                    watcher.mark(e.dest_path)
+
+        self.index = index
+        self.max_paths = max_paths
+        self.lock = threading.Lock()
+        self.dirty = set()
+        self.overflowed = False
+        self.observer = Observer()
+        self.observer.schedule(Handler(), path=index.root, recursive=True)
+        self.observer.daemon = True
+        self.observer.start()
+
+    def mark(self, path):
+        with self.lock:
+            if len(self.dirty) >= self.max_paths:
+                self.overflowed = True
+            else:
+                self.dirty.add(path)
+
+    def changes(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            overflowed, self.overflowed = self.overflowed, False
+        if overflowed or not self.index.dirs:
+            return self.index.scan()
+        changes = self.index.refresh(dirty)
+        if any(os.path.isdir(path) for path in dirty):
+            # Directory events (e.g. a folder moved in) can hide the files
+            # inside them; the pruned scan picks those up cheaply.
+            changes += self.index.scan()
+        return changes
+
+_index = None
+_watcher = None
+
+def configure(root=None, index_file=INDEX_FILE, watch=False, full_scan_every=FULL_SCAN_EVERY):
+    global _index, _watcher
+    _index = ChangeIndex(root or ONEDRIVE_ROOT, index_file=index_file, full_scan_every=full_scan_every)
+    _watcher = ChangeWatcher(_index) if watch and os.path.isdir(_index.root) else None
+
 def get_onedrive_changes():
-    onedrive_path = os.path.expanduser("~/OneDrive")
-    actions = []
-    if os.path.exists(onedrive_path):
-        for root, dirs, files in os.walk(onedrive_path):
-            for file in files:
-                filepath = os.path.join(root, file)
-                modified = os.path.getmtime(filepath)
-                if time.time() - modified < 60:
-                    actions.append({
-                        "application": "OneDrive",
-                        "filename": file,
-                        "cloud_action": "modified",
-                        "timestamp": datetime.utcfromtimestamp(modified).isoformat() + "Z"
-                    })
-    return actions
+    if _index is None:
+        configure()
+    if not os.path.isdir(_index.root):
+        return []
+    changes = _watcher.changes() if _watcher is not None else _index.scan()
+    return [{
+        "application": "OneDrive",
+        "filename": os.path.basename(path),
+        "path": path,
+        "cloud_action": action,
+        "timestamp": datetime.utcfromtimestamp(mtime_ns / 1e9).isoformat() + "Z"
+    } for action, path, mtime_ns in changes]
 
 def collect():
     return get_recent_emails() + get_onedrive_changes()
@@ -1,22 +1,120 @@
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import time, os, hashlib
+import time, os, hashlib, queue, threading
+from collections import deque
 
-_events = []
+# Watchdog callbacks only record the event; collect() drains the buffer.
+# Repeats of the same event on the same path within DEBOUNCE_SECONDS are
+# folded into one entry with a count, the buffer is capped at MAX_EVENTS
+# (oldest dropped first), and size/hash enrichment runs on a worker thread.
+MAX_EVENTS = 5000
+DEBOUNCE_SECONDS = 2.0
+ENRICH_QUEUE_SIZE = 1000
+ENRICH_HASH = False
+ENRICH_HASH_MAX_BYTES = 50 * 1024 * 1024
+
+class EventBuffer:
+    def __init__(self, max_events=MAX_EVENTS, debounce=DEBOUNCE_SECONDS):
+        self.max_events = max_events
+        self.debounce = debounce
+        self.lock = threading.Lock()
+        self.events = deque()
+        self.latest = {}
+        self.dropped = 0
+        self.coalesced = 0
+
+    def add(self, path, event_type, now=None):
+        # Returns the new record, or None when the event was folded into an
+        # existing one.
+        now = time.time() if now is None else now
+        key = (path, event_type)
+        with self.lock:
+            record = self.latest.get(key)
+            if record is not None and now - record["last_timestamp"] <= self.debounce:
+                record["count"] += 1
+                record["last_timestamp"] = now
+                self.coalesced += 1
+                return None
+            if len(self.events) >= self.max_events:
+                old = self.events.popleft()
+                old_key = (old["path"], old["event"])
+                if self.latest.get(old_key) is old:
+                    del self.latest[old_key]
+                self.dropped += 1
+            record = {
+                "path": path,
+                "event": event_type,
+                "timestamp": now,
+                "last_timestamp": now,
+                "count": 1,
+                "size_before": None,
+                "size_after": None,
+                "hash": None,
+            }
+            self.events.append(record)
+            self.latest[key] = record
+            return record
+
+    def drain(self):
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+            self.latest.clear()
+            return events
+
+class Enricher:
+    def __init__(self, size=ENRICH_QUEUE_SIZE, with_hash=ENRICH_HASH):
+        self.with_hash = with_hash
+        self.pending = queue.Queue(maxsize=size)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="file-enrich", daemon=True)
+        self.thread.start()
+
+    def submit(self, record):
+        try:
+            self.pending.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            record = self.pending.get()
+            path = record["path"]
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            record["size_after"] = size
+            if self.with_hash and size <= ENRICH_HASH_MAX_BYTES:
+                try:
+                    h = hashlib.sha256()
+                    with open(path, "rb") as f:
+                        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                            h.update(chunk)
+                    record["hash"] = h.hexdigest()
+                except OSError:
+                    pass
+
+_buffer = EventBuffer()
+_enricher = Enricher()
 
 class Handler(FileSystemEventHandler):
     def on_any_event(self, e):
-        _events.append({
-            "path": e.src_path,
-            "event": e.event_type,
-            "timestamp": time.time(),
-            "size_before": None,
-            "size_after": os.path.getsize(e.src_path) if os.path.exists(e.src_path) else None,
-            "hash": None  # add SHA‑256 if needed
-        })
+        record = _buffer.add(e.src_path, e.event_type)
+        if record is not None and not e.is_directory:
+            _enricher.submit(record)
+
+def stats():
+    return {
+        "buffered": len(_buffer.events),
+        "dropped": _buffer.dropped,
+        "coalesced": _buffer.coalesced,
+        "enrich_pending": _enricher.pending.qsize(),
+        "enrich_dropped": _enricher.dropped,
+    }
 
 def collect():
-    return _events.copy()
+    return _buffer.drain()
 
 def start_monitor(path="."):
     obs = Observer()
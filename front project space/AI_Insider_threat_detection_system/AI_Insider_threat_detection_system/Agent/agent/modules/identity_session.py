@@ -1,10 +1,21 @@
-import win32evtlog
-import win32con
-from datetime import datetime
+import json, os
 
+try:
+    import win32evtlog
+except ImportError:  # Non-Windows hosts can still run the reader with FileEventSource
+    win32evtlog = None
+
+# Reads the Security log forward from a persisted bookmark (the last
+# RecordNumber seen), so every logon since the previous cycle is reported
+# once and the cost of a cycle depends only on how many records are new.
+# Clearing the log restarts record numbers below the bookmark; the sources
+# then read the new log from its start.
 LOG_TYPE = 'Security'
 EVENT_ID_LOGON_SUCCESS = 4624
-MAX_EVENTS = 1  # Return only the most recent logon
+EVENT_ID_LOGON_FAILURE = 4625
+BOOKMARK_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logon_bookmark.json")
+MAX_EVENTS = 500  # Per cycle; the rest are picked up on the next one
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"  # ISO 8601, local time
 
 LOGON_TYPE_MAP = {
     '2': 'interactive',
@@ -16,42 +27,125 @@ LOGON_TYPE_MAP = {
     '11': 'cached interactive'
 }
 
-def get_latest_logon_event():
-    server = 'localhost'
-    handle = win32evtlog.OpenEventLog(server, LOG_TYPE)
-    flags = win32evtlog.EVENTLOG_BACKWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ
-
-    while True:
-        records = win32evtlog.ReadEventLog(handle, flags, 0)
-        if not records:
-            break
-
-        for event in records:
-            if event.EventID == EVENT_ID_LOGON_SUCCESS and event.EventType == win32con.EVENTLOG_AUDIT_SUCCESS:
-                try:
-                    inserts = event.StringInserts
-                    if inserts is None or len(inserts) < 12:
-                        continue
-
-                    logon_type_code = inserts[8]
-
-                    win32evtlog.CloseEventLog(handle)
-                    return {
-                        "Timestamp": event.TimeGenerated.Format(),
-                        "UserID": inserts[5],
-                        "SessionID": str(event.RecordNumber),
-                        "MachineName": inserts[11],
-                        "LogonType": LOGON_TYPE_MAP.get(logon_type_code, logon_type_code),
-                        "AuthResult": "success",
-                        "MFAUsed": "no",  # Placeholder
-                        "LogonSource": inserts[10]
-                    }
-
-                except Exception:
-                    continue
-
-    win32evtlog.CloseEventLog(handle)
-    return {}  # Return empty if no valid event found
+# StringInserts positions differ between the success and failure events.
+INSERT_FIELDS = {
+    EVENT_ID_LOGON_SUCCESS: {"user": 5, "logon_type": 8, "source": 10, "machine": 11, "result": "success"},
+    EVENT_ID_LOGON_FAILURE: {"user": 5, "logon_type": 10, "source": 12, "machine": 13, "result": "failure"},
+}
+
+class Win32EventSource:
+    def __init__(self, server='localhost', log_type=LOG_TYPE):
+        self.server = server
+        self.log_type = log_type
+
+    def read_after(self, record_number, limit):
+        # Yields (record_number, event_id, time_generated, inserts) for records
+        # newer than record_number. With no bookmark yet, starts at the end.
+        handle = win32evtlog.OpenEventLog(self.server, self.log_type)
+        try:
+            oldest = win32evtlog.GetOldestEventLogRecord(handle)
+            newest = oldest + win32evtlog.GetNumberOfEventLogRecords(handle) - 1
+            if record_number is None:
+                yield newest, None, None, None
+                return
+            if newest < record_number:
+                # The log was cleared: read the new one from its start. An
+                # empty log still moves the bookmark back.
+                if newest < oldest:
+                    yield newest, None, None, None
+                    return
+                record_number = oldest - 1
+            start = max(record_number + 1, oldest)
+            if start > newest:
+                return
+            flags = win32evtlog.EVENTLOG_SEEK_READ | win32evtlog.EVENTLOG_FORWARDS_READ
+            count = 0
+            while count < limit:
+                records = win32evtlog.ReadEventLog(handle, flags, start)
+                if not records:
+                    break
+                flags = win32evtlog.EVENTLOG_SEQUENTIAL_READ | win32evtlog.EVENTLOG_FORWARDS_READ
+                for event in records:
+                    yield (event.RecordNumber, event.EventID & 0xFFFF,
+                           event.TimeGenerated.Format(TIMESTAMP_FORMAT), event.StringInserts)
+                    count += 1
+                    if count >= limit:
+                        break
+        finally:
+            win32evtlog.CloseEventLog(handle)
+
+class FileEventSource:
+    # Test stand-in: one JSON object per line with RecordNumber, EventID,
+    # TimeGenerated and StringInserts.
+    def __init__(self, path):
+        self.path = path
+
+    def read_after(self, record_number, limit):
+        with open(self.path, "r") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        newest = max((e["RecordNumber"] for e in events), default=0)
+        if record_number is None:
+            yield newest, None, None, None
+            return
+        if newest < record_number:
+            if not events:
+                yield newest, None, None, None
+                return
+            record_number = min(e["RecordNumber"] for e in events) - 1
+        count = 0
+        for e in events:
+            if e["RecordNumber"] > record_number and count < limit:
+                yield e["RecordNumber"], e["EventID"], e["TimeGenerated"], e["StringInserts"]
+                count += 1
+
+class LogonReader:
+    def __init__(self, source, bookmark_file=BOOKMARK_FILE, limit=MAX_EVENTS):
+        self.source = source
+        self.bookmark_file = bookmark_file
+        self.limit = limit
+        self.bookmark = self._load()
+
+    def _load(self):
+        try:
+            with open(self.bookmark_file, "r") as f:
+                return json.load(f)["RecordNumber"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save(self):
+        tmp = self.bookmark_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"RecordNumber": self.bookmark}, f)
+        os.replace(tmp, self.bookmark_file)
+
+    def read(self):
+        logons = []
+        bookmark = self.bookmark
+        for record_number, event_id, timestamp, inserts in self.source.read_after(self.bookmark, self.limit):
+            bookmark = record_number
+            fields = INSERT_FIELDS.get(event_id)
+            if fields is None or inserts is None or len(inserts) <= fields["machine"]:
+                continue
+            logon_type_code = inserts[fields["logon_type"]]
+            logons.append({
+                "Timestamp": timestamp,
+                "UserID": inserts[fields["user"]],
+                "SessionID": str(record_number),
+                "MachineName": inserts[fields["machine"]],
+                "LogonType": LOGON_TYPE_MAP.get(logon_type_code, logon_type_code),
+                "AuthResult": fields["result"],
+                "MFAUsed": "no",  # Placeholder
+                "LogonSource": inserts[fields["source"]]
+            })
+        if bookmark != self.bookmark:
+            self.bookmark = bookmark
+            self._save()
+        return logons
+
+_reader = None
 
 def collect():
-    return get_latest_logon_event()
+    global _reader
+    if _reader is None:
+        _reader = LogonReader(Win32EventSource())
+    return _reader.read()
@@ -1,14 +1,137 @@
-import psutil
+import psutil, socket, time
+from collections import OrderedDict
+
+# Connections are tracked as flows keyed by the 5-tuple. A cycle only reports
+# flows that opened, closed, or have been open for another LONG_LIVED_SECONDS,
+# each with its owning PID and process name. psutil has no per-socket byte
+# counts, so every cycle the I/O delta of each owning process is split across
+# that process's open flows and accumulated per flow; a report carries what
+# accrued since the flow was last reported. Closed flows leave the table, and
+# past MAX_FLOWS the flows that have been idle longest are evicted.
+LONG_LIVED_SECONDS = 300
+MAX_FLOWS = 20000
+
+PROTOCOLS = {socket.SOCK_STREAM: "TCP", socket.SOCK_DGRAM: "UDP"}
+
+class Flow:
+    __slots__ = ("key", "pid", "name", "status", "opened", "reported", "sent", "received")
+
+    def __init__(self, key, pid, name, status, now):
+        self.key = key
+        self.pid = pid
+        self.name = name
+        self.status = status
+        self.opened = now
+        self.reported = now
+        self.sent = 0
+        self.received = 0
+
+    def record(self, event, now):
+        protocol, source_ip, source_port, dest_ip, dest_port = self.key
+        record = {
+            "SourceIP": source_ip, "SourcePort": source_port,
+            "DestIP": dest_ip, "DestPort": dest_port,
+            "Protocol": protocol,
+            "ConnectionStatus": self.status,
+            "PID": self.pid, "ProcessName": self.name,
+            "BytesSent": self.sent, "BytesReceived": self.received,
+            "ConnectionDuration": round(now - self.opened),
+            "DNSQuery": "",
+            "FlowEvent": event,
+        }
+        self.sent = 0
+        self.received = 0
+        self.reported = now
+        return record
+
+class FlowTable:
+    def __init__(self, long_lived=LONG_LIVED_SECONDS, max_flows=MAX_FLOWS):
+        self.long_lived = long_lived
+        self.max_flows = max_flows
+        self.flows = OrderedDict()  # least recently active first
+        self.names = {}
+        self.io = {}
+        self.evicted = 0
+
+    def _name(self, pid):
+        if pid is None:
+            return None
+        name = self.names.get(pid)
+        if name is None:
+            try:
+                name = psutil.Process(pid).name()
+            except (psutil.Error, OSError):
+                name = ""
+            self.names[pid] = name
+        return name
+
+    def _io_delta(self, pid):
+        try:
+            counters = psutil.Process(pid).io_counters()
+        except (psutil.Error, OSError, AttributeError):
+            return 0, 0
+        previous = self.io.get(pid)
+        self.io[pid] = (counters.write_bytes, counters.read_bytes)
+        if previous is None:
+            return 0, 0
+        return max(0, counters.write_bytes - previous[0]), max(0, counters.read_bytes - previous[1])
+
+    def update(self, connections, now=None):
+        # connections: iterable of psutil sconn tuples. Returns the records
+        # to report this cycle.
+        now = time.time() if now is None else now
+        current = {}
+        for c in connections:
+            if not c.raddr:
+                continue  # Listening and unconnected sockets are not flows
+            key = (PROTOCOLS.get(c.type, str(c.type)), c.laddr.ip, c.laddr.port, c.raddr.ip, c.raddr.port)
+            current[key] = c
+
+        records = []
+        for key in [k for k in self.flows if k not in current]:
+            records.append(self.flows.pop(key).record("closed", now))
+
+        opened = []
+        by_pid = {}
+        for key, c in current.items():
+            flow = self.flows.get(key)
+            if flow is None:
+                flow = self.flows[key] = Flow(key, c.pid, self._name(c.pid), c.status, now)
+                opened.append(flow)
+            else:
+                flow.status = c.status
+            if c.pid is not None:
+                by_pid.setdefault(c.pid, []).append(flow)
+
+        for pid, flows in by_pid.items():
+            sent, received = self._io_delta(pid)
+            if not (sent or received):
+                continue
+            for flow in flows:
+                flow.sent += sent // len(flows)
+                flow.received += received // len(flows)
+                self.flows.move_to_end(flow.key)
+
+        records += [flow.record("opened", now) for flow in opened]
+        for flow in self.flows.values():
+            if now - flow.reported >= self.long_lived:
+                records.append(flow.record("long_lived", now))
+
+        while len(self.flows) > self.max_flows:
+            self.flows.popitem(last=False)
+            self.evicted += 1
+        live = set(by_pid)
+        self.names = {pid: name for pid, name in self.names.items() if pid in live}
+        self.io = {pid: io for pid, io in self.io.items() if pid in live}
+        return records
+
+    def stats(self):
+        return {"flows": len(self.flows), "evicted": self.evicted, "names": len(self.names)}
+
+_table = FlowTable()
+
+def stats():
+    return _table.stats()
 
 def collect():
-    conns = []
-    for c in psutil.net_connections(kind='inet'):
-        l = c.laddr._asdict() if c.laddr else {}
-        r = c.raddr._asdict() if c.raddr else {}
-        conns.append({
-            "source_ip": l.get("ip"), "source_port": l.get("port"),
-            "dest_ip": r.get("ip"), "dest_port": r.get("port"),
-            "protocol": c.type.name if hasattr(c.type, 'name') else str(c.type),
-            "status": c.status
-        })
-    return conns
+    return _table.update(psutil.net_connections(kind='inet'))
@@ -1,22 +1,151 @@
-import psutil, hashlib
+import psutil, hashlib, json, os, threading
+from concurrent.futures import ThreadPoolExecutor
+from .state_store import StateStore
+
+# Executable hashes are cached by (path, size, mtime, inode) and persisted
+# across restarts. Unknown binaries are hashed in the background, a bounded
+# number of bytes per cycle, and show up with their hash on a later cycle.
+HASH_CACHE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "hash_cache.json")
+HASH_CACHE_MAX_ENTRIES = 20000
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_WORKERS = 2
+HASH_BUDGET_BYTES = 256 * 1024 * 1024
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class HashCache:
+    def __init__(self, path=HASH_CACHE_FILE, workers=HASH_WORKERS, budget_bytes=HASH_BUDGET_BYTES,
+                 max_entries=HASH_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.budget_bytes = budget_bytes
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = self._load()
+        self.pending = set()
+        self.dirty = False
+        self.budget = budget_bytes
+        self.seen = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash")
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return {path: tuple(entry) for path, entry in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {path: list(entry) for path, entry in self.entries.items()}
+            self.dirty = False
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def start_cycle(self):
+        self.budget = self.budget_bytes
+        self.seen = {}
+
+    def lookup(self, path):
+        if not path:
+            return ""
+        if path in self.seen:
+            return self.seen[path]
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.seen[path] = ""
+            return ""
+        key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[:3] == key:
+                self.hits += 1
+                self.seen[path] = entry[3]
+                return entry[3]
+            self.misses += 1
+            # The first miss of a cycle is always scheduled so binaries larger
+            # than the whole budget still get hashed eventually.
+            fits = st.st_size <= self.budget or self.budget == self.budget_bytes
+            schedule = path not in self.pending and fits
+            if schedule:
+                self.pending.add(path)
+                self.budget -= st.st_size
+        if schedule:
+            self.pool.submit(self._hash, path, key)
+        self.seen[path] = ""
+        return ""
+
+    def _hash(self, path, key):
+        try:
+            digest = hash_file(path)
+        except OSError:
+            with self.lock:
+                self.errors += 1
+                self.pending.discard(path)
+            return
+        with self.lock:
+            self.pending.discard(path)
+            self.entries.pop(path, None)
+            self.entries[path] = key + (digest,)
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            self.dirty = True
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "pending": len(self.pending),
+                "entries": len(self.entries),
+            }
+
+_hashes = HashCache()
+
+# Processes are keyed by PID; a changed name/path/cmdline under the same PID
+# is reported as "modify" and exited processes are appended as "delete".
+_state = StateStore()
+
+def stats():
+    return _hashes.stats()
 
 def collect():
-    procs = []
+    procs = {}
+    _hashes.start_cycle()
     for p in psutil.process_iter(attrs=["pid", "ppid", "name", "exe", "cmdline", "memory_info", "cpu_percent"]):
         info = p.info
-        h = ""
-        try:
-            with open(info["exe"], "rb") as f:
-                h = hashlib.sha256(f.read()).hexdigest()
-        except:
-            pass
-        procs.append({
+        procs[str(info["pid"])] = {
             "pid": info["pid"], "ppid": info["ppid"],
             "name": info["name"], "path": info["exe"],
             "cmdline": " ".join(info["cmdline"]) if info["cmdline"] else "",
             "exit_code": None,  # You'll need process completion tracking
-            "hash": h,
+            "hash": _hashes.lookup(info["exe"]),
             "cpu": info["cpu_percent"],
             "memory": info["memory_info"].rss if info["memory_info"] else 0
-        })
-    return procs
+        }
+    try:
+        _hashes.save()
+    except OSError as e:
+        print("[-] Failed to save hash cache:", e)
+
+    identity = {pid: [p["name"], p["path"], p["cmdline"]] for pid, p in procs.items()}
+    changes = _state.diff(identity)
+    operations = {pid: operation for operation, pid, _ in changes}
+    result = [dict(p, change=operations.get(pid)) for pid, p in procs.items()]
+    for operation, pid, (name, path, cmdline) in changes:
+        if operation == "delete":
+            result.append({"pid": int(pid), "name": name, "path": path, "cmdline": cmdline, "change": operation})
+    return result
@@ -1,86 +1,85 @@
-import winreg
-import json
-import hashlib
-import os
+import json, os
+from .state_store import StateStore
+
+try:
+    import winreg
+except ImportError:  # Non-Windows hosts can still run the differ with a fake source
+    winreg = None
 
 # Registry paths to watch (example: Run key for startup items)
 WATCHED_KEYS = [
     (winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Windows\CurrentVersion\Run"),
     (winreg.HKEY_CURRENT_USER, r"SOFTWARE\Microsoft\Windows\CurrentVersion\Run")
-]
+] if winreg else []
 
-# Path to store snapshot of previous registry state
-SNAPSHOT_FILE = "reg_snapshot.json"
+# Path to store snapshot of previous registry state, next to agent.py rather
+# than in whatever directory the agent was started from
+SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reg_snapshot.json")
 
-def get_registry_values(hive, path):
-    try:
-        key = winreg.OpenKey(hive, path, 0, winreg.KEY_READ)
-        values = {}
-        i = 0
-        while True:
-            try:
-                name, value, _ = winreg.EnumValue(key, i)
-                values[name] = value
-                i += 1
-            except OSError:
-                break
-        return values
-    except Exception as e:
-        return {}
+class WinRegistrySource:
+    def __init__(self, watched_keys=WATCHED_KEYS):
+        self.watched_keys = watched_keys
 
-def collect():
-    current = {}
-    changes = []
+    def get_registry_values(self, hive, path):
+        try:
+            key = winreg.OpenKey(hive, path, 0, winreg.KEY_READ)
+            values = {}
+            i = 0
+            while True:
+                try:
+                    name, value, _ = winreg.EnumValue(key, i)
+                    values[name] = value
+                    i += 1
+                except OSError:
+                    break
+            return values
+        except Exception as e:
+            return {}
+
+    def read(self):
+        return {(str(hive), path): self.get_registry_values(hive, path) for hive, path in self.watched_keys}
 
-    for hive, path in WATCHED_KEYS:
-        key_id = f"{hive}-{path}"
-        values = get_registry_values(hive, path)
-        current[key_id] = values
+class FakeRegistrySource:
+    # Stands in for the registry in tests: {(hive, path): {name: value}}.
+    def __init__(self, keys=None):
+        self.keys = keys or {}
 
-    # Load previous snapshot
-    if os.path.exists(SNAPSHOT_FILE):
-        with open(SNAPSHOT_FILE, 'r') as f:
-            old = json.load(f)
-    else:
-        old = {}
+    def read(self):
+        return {key: dict(values) for key, values in self.keys.items()}
 
-    # Compare snapshots
-    for key_id in current:
-        old_vals = old.get(key_id, {})
-        new_vals = current[key_id]
+def _flatten(keys):
+    return {
+        json.dumps([hive, path, name]): str(value)
+        for (hive, path), values in keys.items()
+        for name, value in values.items()
+    }
 
-        # Check for added or changed values
-        for name in new_vals:
-            if name not in old_vals:
-                changes.append({
-                    "registry_hive": key_id.split('-')[0],
-                    "key_path": key_id.split('-', 1)[1],
-                    "value_name": name,
-                    "value_data": str(new_vals[name]),
-                    "operation": "create"
-                })
-            elif old_vals[name] != new_vals[name]:
-                changes.append({
-                    "registry_hive": key_id.split('-')[0],
-                    "key_path": key_id.split('-', 1)[1],
-                    "value_name": name,
-                    "value_data": str(new_vals[name]),
-                    "operation": "modify"
-                })
+def _upgrade(old):
+    # Old snapshots were {"<hive>-<path>": {name: value}}.
+    return _flatten({tuple(key_id.split('-', 1)): values for key_id, values in old.items()})
 
-        # Check for deleted values
-        for name in old_vals:
-            if name not in new_vals:
-                changes.append({
-                    "registry_hive": key_id.split('-')[0],
-                    "key_path": key_id.split('-', 1)[1],
-                    "value_name": name,
-                    "value_data": str(old_vals[name]),
-                    "operation": "delete"
-                })
+class RegistryMonitor:
+    def __init__(self, source, snapshot_file=SNAPSHOT_FILE):
+        self.source = source
+        self.state = StateStore(snapshot_file, upgrade=_upgrade)
 
-    # Save new snapshot
-    with open(SNAPSHOT_FILE, 'w') as f:
-        json.dump(current, f)
+    def collect(self):
+        changes = []
+        for operation, key, value in self.state.diff(_flatten(self.source.read())):
+            hive, path, name = json.loads(key)
+            changes.append({
+                "registry_hive": hive,
+                "key_path": path,
+                "value_name": name,
+                "value_data": value,
+                "operation": operation
+            })
+        return changes
 
-    return changes
+_monitor = None
+
+def collect():
+    global _monitor
+    if _monitor is None:
+        _monitor = RegistryMonitor(WinRegistrySource())
+    return _monitor.collect()
@@ -0,0 +1,62 @@
+import hashlib, json, os
+
+# Keeps the last snapshot of a stateful collector and turns each new snapshot
+# into create/modify/delete changes. Values are compared by a per-key content
+# digest, and when every digest matches the snapshot is left untouched. With
+# a checkpoint path the snapshot survives restarts; it is rewritten
+# atomically, and only when something changed.
+
+def digest(value):
+    text = json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+class StateStore:
+    def __init__(self, checkpoint_path=None, upgrade=None):
+        self.checkpoint_path = checkpoint_path
+        self.upgrade = upgrade
+        self.values = {}
+        self.digests = {}
+        if checkpoint_path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not (isinstance(data, dict) and "values" in data):
+            # Checkpoints written before this store existed can be converted
+            # by the owning collector; anything else is ignored.
+            data = {"values": self.upgrade(data)} if self.upgrade else {"values": {}}
+        self.values = data["values"]
+        self.digests = {key: digest(value) for key, value in self.values.items()}
+
+    def checkpoint(self):
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"values": self.values}, f, default=str)
+        os.replace(tmp, self.checkpoint_path)
+
+    def diff(self, current):
+        # current maps string keys to JSON-serialisable values. Returns a list
+        # of (operation, key, value) with operation create, modify or delete;
+        # deletes carry the last known value.
+        digests = {key: digest(value) for key, value in current.items()}
+        if digests == self.digests:
+            return []
+        changes = []
+        for key, d in digests.items():
+            previous = self.digests.get(key)
+            if previous is None:
+                changes.append(("create", key, current[key]))
+            elif previous != d:
+                changes.append(("modify", key, current[key]))
+        for key in self.digests:
+            if key not in digests:
+                changes.append(("delete", key, self.values[key]))
+        self.values = dict(current)
+        self.digests = digests
+        if self.checkpoint_path:
+            self.checkpoint()
+        return changes
@@ -1,16 +1,28 @@
 import psutil
+from .state_store import StateStore
+
+# Removable volumes currently mounted, tagged with the change that brought
+# them in, plus one record for each volume removed since the last cycle.
+_state = StateStore()
+
 def collect():
-    usb_connected = False
+    current = {}
     for part in psutil.disk_partitions():
         if 'removable' in part.opts or 'media' in part.device.lower():
-            usb_connected = True
-            break
+            current[part.mountpoint] = {
+                "USBDeviceID": "unknown",
+                "SerialNumber": "unknown",
+                "MountPoint": part.mountpoint,
+                "DataTransferVolume": 0,  # update if you can track volume
+                "FileNamesTransferred": [],
+                "AccessOutcome": "allowed"
+            }
 
-    return [{
-        "USBDeviceID": "unknown",
-        "SerialNumber": "unknown",
-        "MountPoint": part.mountpoint if usb_connected else "N/A",
-        "DataTransferVolume": 0,  # update if you can track volume
-        "FileNamesTransferred": [],
-        "AccessOutcome": "allowed" if usb_connected else "denied"
-    }] if usb_connected else []
+    changes = _state.diff(current)
+    operations = {key: operation for operation, key, _ in changes}
+    devices = [dict(device, change=operations.get(mountpoint)) for mountpoint, device in current.items()]
+    devices += [
+        dict(device, AccessOutcome="removed", change=operation)
+        for operation, _, device in changes if operation == "delete"
+    ]
+    return devices
@@ -0,0 +1,111 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+from common.metrics import REGISTRY
+
+# Runs every collector on its own interval in a shared thread pool. Each
+# collector has a single concurrency slot: it is never started again while a
+# previous run is still in flight, so one slow or hung source only delays
+# itself. Every result is handed over once, by the next snapshot: collectors
+# that report events rather than state set accumulate, and their results are
+# queued across runs; any other collector contributes its latest result, and a
+# section whose collector has not finished a run since the previous snapshot
+# is left out (the delta encoder keeps sending its last known state).
+
+COLLECTOR_SECONDS = REGISTRY.histogram(
+    "insider_agent_collector_seconds", "Collector run time.", ("collector",))
+COLLECTOR_ERRORS = REGISTRY.counter(
+    "insider_agent_collector_errors_total", "Collector runs that raised.", ("collector",))
+COLLECTOR_TIMEOUTS = REGISTRY.counter(
+    "insider_agent_collector_timeouts_total", "Collector runs abandoned after their timeout.", ("collector",))
+
+class Collector:
+    def __init__(self, section, fn, interval=10, timeout=30, default=None, accumulate=False):
+        self.section = section
+        self.fn = fn
+        self.interval = interval
+        self.timeout = timeout
+        self.default = default
+        self.accumulate = accumulate
+        self.future = None
+        self.started = 0.0
+        self.next_run = 0.0
+        self.timed_out = False
+        self.stats = {
+            "runs": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "last_duration_ms": None,
+            "last_error": None,
+            "state": "idle",
+        }
+
+class Scheduler:
+    def __init__(self, collectors):
+        self.collectors = collectors
+        self.pool = ThreadPoolExecutor(max_workers=len(collectors), thread_name_prefix="collector")
+        self.lock = threading.Lock()
+        self.results = {}
+        self.pending = {c.section: [] for c in collectors if c.accumulate}
+
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        for c in self.collectors:
+            if c.future is not None and c.future.done():
+                c.future = None
+            if c.future is not None:
+                if not c.timed_out and now - c.started > c.timeout:
+                    # Threads cannot be killed; the run is abandoned and the
+                    # collector stays parked until the stuck call returns.
+                    c.timed_out = True
+                    c.future.cancel()
+                    with self.lock:
+                        c.stats["timeouts"] += 1
+                        c.stats["state"] = "timed_out"
+                        c.stats["last_error"] = f"timed out after {c.timeout}s"
+                    COLLECTOR_TIMEOUTS.inc(labels=(c.section,))
+                    print(f"[-] Collector {c.section} timed out after {c.timeout}s")
+                continue
+            if now >= c.next_run:
+                c.started = now
+                c.next_run = now + c.interval
+                c.timed_out = False
+                with self.lock:
+                    c.stats["state"] = "running"
+                c.future = self.pool.submit(self._run, c)
+
+    def _run(self, c):
+        start = time.perf_counter()
+        try:
+            result = c.fn()
+            error = None
+        except Exception as e:
+            result = None
+            error = str(e)
+        duration = (time.perf_counter() - start) * 1000
+        COLLECTOR_SECONDS.observe(duration / 1000, (c.section,))
+        if error is not None:
+            COLLECTOR_ERRORS.inc(labels=(c.section,))
+        with self.lock:
+            c.stats["runs"] += 1
+            c.stats["last_duration_ms"] = round(duration, 1)
+            if error is not None:
+                c.stats["errors"] += 1
+                c.stats["last_error"] = error
+            elif not c.timed_out and c.accumulate:
+                self.pending[c.section].extend(result or ())
+            elif not c.timed_out:
+                self.results[c.section] = result or c.default
+            if not c.timed_out:
+                c.stats["state"] = "idle"
+
+    def snapshot(self):
+        with self.lock:
+            snapshot, self.results = self.results, {}
+            for section, events in self.pending.items():
+                snapshot[section] = events
+                self.pending[section] = []
+            return snapshot
+
+    def stats(self):
+        with self.lock:
+            return {c.section: dict(c.stats) for c in self.collectors}
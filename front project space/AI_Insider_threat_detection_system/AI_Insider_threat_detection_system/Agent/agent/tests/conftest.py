@@ -0,0 +1,7 @@
+import os, sys
+
+# The agent runs from its own directory and imports `common` from two levels
+# up; tests get the same view of the tree.
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(AGENT_DIR)))
+sys.path.insert(0, AGENT_DIR)
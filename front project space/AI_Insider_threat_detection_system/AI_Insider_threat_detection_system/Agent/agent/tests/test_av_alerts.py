@@ -0,0 +1,175 @@
+import json
+import sys
+
+import pytest
+
+from modules.av_alerts import DefenderReader, DefenderSource, FileDefenderSource, PowerShellHost
+from scheduler import Collector, Scheduler
+
+# Stands in for powershell.exe: prints a banner, then answers each stdin line
+# with the detections in the log file that match the query's since/limit,
+# followed by the sentinel. A <log>.die file makes it exit mid-command and a
+# <log>.error file makes the query report an error.
+STUB = """
+import json, os, re, sys
+log = sys.argv[1]
+print("Windows PowerShell")
+print("Copyright (C) Microsoft Corporation. All rights reserved.", flush=True)
+for line in sys.stdin:
+    script, _, sentinel = line.rstrip("\\n").rpartition("; Write-Output ")
+    since = re.search(r"Parse\\('([^']*)'", script).group(1)
+    limit = int(re.search(r"-First (\\d+)", script).group(1))
+    if os.path.exists(log + ".error"):
+        print(json.dumps({"error": "Get-MpThreatDetection failed"}))
+    with open(log) as f:
+        detections = [json.loads(d) for d in f if d.strip()]
+    detections = sorted((d for d in detections if d["InitialDetectionTime"] >= since),
+                        key=lambda d: d["InitialDetectionTime"])[:limit]
+    for d in detections:
+        print(json.dumps(d), flush=True)
+        if os.path.exists(log + ".die"):
+            os.remove(log + ".die")
+            sys.exit(1)
+    print("")
+    print(sentinel.strip("'"), flush=True)
+"""
+
+def detection(detection_id, detected, severity=4):
+    return {"DetectionID": detection_id, "ThreatID": 7, "ThreatName": "Trojan:Win32/Test",
+            "SeverityID": severity, "Resources": ["file:_C:\\Users\\bob\\x.exe"], "ProcessName": "explorer.exe",
+            "ActionSuccess": True, "InitialDetectionTime": detected}
+
+def write_detections(path, detections):
+    path.write_text("".join(json.dumps(d) + "\n" for d in detections))
+
+def ids(alerts):
+    return [a["AlertID"] for a in alerts]
+
+def test_each_detection_is_read_once(tmp_path):
+    log, bookmark = tmp_path / "detections.jsonl", str(tmp_path / "bookmark.json")
+    detections = [detection("a", "2026-01-05T09:00:00.0000000Z")]
+    write_detections(log, detections)
+    reader = DefenderReader(FileDefenderSource(str(log)), bookmark_file=bookmark)
+    alerts = reader.read()
+    assert ids(alerts) == ["a"]
+    assert alerts[0]["Severity"] == "high"
+    assert reader.read() == []
+
+    # A second detection at the same time as the mark is new; the first is not.
+    detections += [detection("b", "2026-01-05T09:00:00.0000000Z"), detection("c", "2026-01-05T09:05:00.0000000Z")]
+    write_detections(log, detections)
+    assert ids(reader.read()) == ["b", "c"]
+
+    # A restarted reader resumes from the saved mark.
+    detections.append(detection("d", "2026-01-05T10:00:00.0000000Z"))
+    write_detections(log, detections)
+    assert ids(DefenderReader(FileDefenderSource(str(log)), bookmark_file=bookmark).read()) == ["d"]
+
+def test_limit_leaves_the_rest_for_the_next_cycle(tmp_path):
+    log = tmp_path / "detections.jsonl"
+    write_detections(log, [detection(str(n), f"2026-01-05T09:00:0{n}.0000000Z") for n in range(5)])
+    reader = DefenderReader(FileDefenderSource(str(log)), bookmark_file=str(tmp_path / "bookmark.json"), limit=2)
+    assert ids(reader.read()) == ["0", "1"]
+    assert ids(reader.read()) == ["2", "3"]
+    assert ids(reader.read()) == ["4"]
+
+@pytest.fixture
+def settings():
+    # The av_alerts collector settings: slower than the agent's send loop
+    # and accumulating between sends.
+    return {"interval": 60, "timeout": 60, "accumulate": True}
+
+@pytest.fixture
+def stub_host(tmp_path):
+    stub = tmp_path / "powershell_stub.py"
+    stub.write_text(STUB)
+    hosts = []
+
+    def start(log):
+        host = PowerShellHost(argv=[sys.executable, "-u", str(stub), str(log)], timeout=10)
+        hosts.append(host)
+        return host
+
+    yield start
+    for host in hosts:
+        host.close()
+
+def test_detection_appears_in_exactly_one_snapshot(tmp_path, settings):
+    # av_alerts runs less often than the agent sends; a detection must still
+    # be sent once, not on every send until the collector runs again.
+    log = tmp_path / "detections.jsonl"
+    write_detections(log, [detection("a", "2026-01-05T09:00:00.0000000Z")])
+    reader = DefenderReader(FileDefenderSource(str(log)), bookmark_file=str(tmp_path / "bookmark.json"))
+    collector = Collector("av_alerts", reader.read, default=[], **settings)
+    scheduler = Scheduler([collector])
+
+    scheduler._run(collector)
+    snapshots = [scheduler.snapshot() for _ in range(6)]
+    scheduler._run(collector)
+    snapshots.append(scheduler.snapshot())
+    sent = [alert["AlertID"] for snapshot in snapshots for alert in snapshot.get("av_alerts", [])]
+    assert sent == ["a"]
+
+def test_host_frames_each_command_with_its_sentinel(tmp_path, stub_host):
+    log = tmp_path / "detections.jsonl"
+    detections = [detection("a", "2026-01-05T09:00:00.0000000Z"), detection("b", "2026-01-05T09:05:00.0000000Z")]
+    write_detections(log, detections)
+    host = stub_host(log)
+    source = DefenderSource(host)
+    # The banner and blank lines are skipped, and each command stops at its
+    # own sentinel, so the next one starts on a clean stream in the same host.
+    assert list(source.read_after(None, 10)) == detections
+    pid = host.process.pid
+    assert list(source.read_after("2026-01-05T09:01:00.0000000Z", 10)) == detections[1:]
+    assert list(source.read_after(None, 1)) == detections[:1]
+    assert host.process.pid == pid
+
+def test_host_restarts_after_the_child_dies(tmp_path, stub_host):
+    log = tmp_path / "detections.jsonl"
+    write_detections(log, [detection("a", "2026-01-05T09:00:00.0000000Z")])
+    host = stub_host(log)
+    reader = DefenderReader(DefenderSource(host), bookmark_file=str(tmp_path / "bookmark.json"))
+    assert ids(reader.read()) == ["a"]
+    first = host.process
+    first.kill()
+    first.wait()
+
+    write_detections(log, [detection("a", "2026-01-05T09:00:00.0000000Z"), detection("b", "2026-01-05T09:05:00.0000000Z")])
+    assert ids(reader.read()) == ["b"]
+    assert host.process is not first
+
+def test_high_water_mark_holds_across_host_restarts(tmp_path, stub_host):
+    log, bookmark = tmp_path / "detections.jsonl", str(tmp_path / "bookmark.json")
+    detections = [detection("a", "2026-01-05T09:00:00.0000000Z")]
+    write_detections(log, detections)
+    host = stub_host(log)
+    reader = DefenderReader(DefenderSource(host), bookmark_file=bookmark)
+    assert ids(reader.read()) == ["a"]
+
+    # The host dies part way through a command: nothing is reported and the
+    # mark stays put, so the restarted host returns the same detections.
+    detections += [detection("b", "2026-01-05T09:05:00.0000000Z"), detection("c", "2026-01-05T09:10:00.0000000Z")]
+    write_detections(log, detections)
+    (tmp_path / "detections.jsonl.die").touch()
+    with pytest.raises(RuntimeError, match="exited"):
+        reader.read()
+    assert host.process is None
+    assert ids(reader.read()) == ["b", "c"]
+
+    # A restarted agent, with a new host, resumes from the saved mark.
+    detections.append(detection("d", "2026-01-05T10:00:00.0000000Z"))
+    write_detections(log, detections)
+    reader = DefenderReader(DefenderSource(stub_host(log)), bookmark_file=bookmark)
+    assert ids(reader.read()) == ["d"]
+    assert reader.read() == []
+
+def test_query_error_is_raised_and_the_host_recovers(tmp_path, stub_host):
+    log = tmp_path / "detections.jsonl"
+    write_detections(log, [detection("a", "2026-01-05T09:00:00.0000000Z")])
+    host = stub_host(log)
+    reader = DefenderReader(DefenderSource(host), bookmark_file=str(tmp_path / "bookmark.json"))
+    (tmp_path / "detections.jsonl.error").touch()
+    with pytest.raises(RuntimeError, match="Get-MpThreatDetection failed"):
+        reader.read()
+    (tmp_path / "detections.jsonl.error").unlink()
+    assert ids(reader.read()) == ["a"]
@@ -0,0 +1,70 @@
+import json
+
+from modules.clipboard_screen import ClipboardMonitor, FakeClipboardBackend
+
+def started():
+    backend = FakeClipboardBackend()
+    monitor = ClipboardMonitor(backend)
+    assert monitor.poll() == []
+    return backend, monitor
+
+def meta(event):
+    return json.loads(event["ClipboardContentMeta"])
+
+def test_nothing_is_reported_without_a_change():
+    backend, monitor = started()
+    backend.set({"CF_UNICODETEXT": 64})
+    assert len(monitor.poll()) == 1
+    assert monitor.poll() == []
+    assert monitor.poll() == []
+
+def test_first_poll_only_records_the_sequence():
+    backend = FakeClipboardBackend()
+    backend.set({"CF_UNICODETEXT": 64})
+    assert ClipboardMonitor(backend).poll() == []
+
+def test_copy_reports_type_size_and_owner_without_content():
+    backend, monitor = started()
+    backend.set({"CF_UNICODETEXT": 2048, "CF_LOCALE": 4}, owner="WINWORD.EXE")
+    [event] = monitor.poll()
+    assert event["ClipboardEvent"] == "copy"
+    assert event["ScreenCaptureTrigger"] == ""
+    assert meta(event) == {"type": "text", "size": 2048, "formats": {"CF_UNICODETEXT": 2048, "CF_LOCALE": 4},
+                           "owner": "WINWORD.EXE", "changes": 1}
+
+def test_several_changes_between_polls_are_one_event():
+    backend, monitor = started()
+    backend.set({"CF_UNICODETEXT": 10})
+    backend.set({"CF_HDROP": 120})
+    [event] = monitor.poll()
+    assert meta(event)["type"] == "files"
+    assert meta(event)["changes"] == 2
+
+def test_cleared_clipboard():
+    backend, monitor = started()
+    backend.set({})
+    [event] = monitor.poll()
+    assert event["ClipboardEvent"] == "clear"
+    assert meta(event)["type"] is None
+
+def test_image_from_capture_tool_is_a_screen_capture():
+    backend, monitor = started()
+    backend.set({"CF_DIB": 8_000_000, "CF_BITMAP": None}, owner="SnippingTool.exe")
+    [event] = monitor.poll()
+    assert meta(event)["type"] == "image"
+    assert event["ScreenCaptureTrigger"] == "SnippingTool.exe"
+
+def test_printscreen_with_image_is_one_event():
+    backend, monitor = started()
+    backend.press()
+    backend.set({"CF_DIB": 8_000_000})
+    [event] = monitor.poll()
+    assert event["ScreenCaptureTrigger"] == "PrintScreen"
+    assert monitor.poll() == []
+
+def test_printscreen_without_clipboard_change_is_reported_alone():
+    backend, monitor = started()
+    backend.press()
+    assert monitor.poll("2026-01-05T09:00:00Z") == [
+        {"ScreenCaptureTrigger": "PrintScreen", "Timestamp": "2026-01-05T09:00:00Z"}]
+    assert monitor.poll() == []
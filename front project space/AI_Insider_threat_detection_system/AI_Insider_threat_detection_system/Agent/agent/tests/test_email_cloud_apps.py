@@ -0,0 +1,80 @@
+import os, shutil
+
+from modules.email_cloud_apps import ChangeIndex
+
+def write(path, text, mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+
+def touch_dir(path, mtime):
+    # Directory mtimes can be too coarse to move between two quick writes.
+    os.utime(path, ns=(mtime, mtime))
+
+def actions(changes):
+    return sorted((action, os.path.basename(path)) for action, path, _ in changes)
+
+def started(tmp_path, full_scan_every=100):
+    root = tmp_path / "OneDrive"
+    write(str(root / "a.docx"), "a")
+    write(str(root / "docs" / "b.xlsx"), "b")
+    index = ChangeIndex(str(root), index_file=str(tmp_path / "index.json"), full_scan_every=full_scan_every)
+    assert index.scan() == []
+    return root, index
+
+def test_first_scan_is_a_silent_baseline(tmp_path):
+    root, index = started(tmp_path)
+    assert sorted(os.path.basename(p) for p in index.files) == ["a.docx", "b.xlsx"]
+    assert index.scan() == []
+
+def test_create_modify_delete(tmp_path):
+    root, index = started(tmp_path, full_scan_every=1)
+    write(str(root / "docs" / "c.pdf"), "c")
+    assert actions(index.scan()) == [("created", "c.pdf")]
+    write(str(root / "a.docx"), "a, edited", mtime=1_700_000_000_000_000_000)
+    assert actions(index.scan()) == [("modified", "a.docx")]
+    os.remove(root / "docs" / "b.xlsx")
+    assert actions(index.scan()) == [("deleted", "b.xlsx")]
+    assert index.scan() == []
+
+def test_pruned_scan_skips_unchanged_directories(tmp_path):
+    root, index = started(tmp_path)
+    index.scan()
+    # An in-place edit does not move the directory mtime, so only a full
+    # scan or a watchdog refresh sees it.
+    write(str(root / "docs" / "b.xlsx"), "b, edited", mtime=1_700_000_000_000_000_000)
+    assert index.scan() == []
+    write(str(root / "docs" / "new.txt"), "n")
+    touch_dir(str(root / "docs"), 1_700_000_000_000_000_001)
+    assert actions(index.scan()) == [("created", "new.txt"), ("modified", "b.xlsx")]
+
+def test_rmtree_is_seen_by_scan(tmp_path):
+    root, index = started(tmp_path)
+    write(str(root / "docs" / "deep" / "c.pdf"), "c")
+    index.scan()
+    shutil.rmtree(root / "docs")
+    touch_dir(str(root), 1_700_000_000_000_000_000)
+    assert actions(index.scan()) == [("deleted", "b.xlsx"), ("deleted", "c.pdf")]
+    assert not any(p.startswith(str(root / "docs")) for p in list(index.files) + list(index.dirs))
+
+def test_refresh_reports_files(tmp_path):
+    root, index = started(tmp_path)
+    write(str(root / "docs" / "c.pdf"), "c")
+    assert actions(index.refresh([str(root / "docs" / "c.pdf")])) == [("created", "c.pdf")]
+    os.remove(root / "a.docx")
+    assert actions(index.refresh([str(root / "a.docx")])) == [("deleted", "a.docx")]
+    assert "a.docx" not in index.dirs[str(root)]["files"]
+
+def test_refresh_of_a_deleted_directory_forgets_its_files(tmp_path):
+    # Watchdog may report only the directory itself, e.g. when it is moved
+    # out of the tree.
+    root, index = started(tmp_path)
+    write(str(root / "docs" / "deep" / "c.pdf"), "c")
+    index.scan()
+    shutil.rmtree(root / "docs")
+    assert actions(index.refresh([str(root / "docs")])) == [("deleted", "b.xlsx"), ("deleted", "c.pdf")]
+    assert str(root / "docs") not in index.dirs
+    assert "docs" not in index.dirs[str(root)]["subdirs"]
+    assert index.scan() == []
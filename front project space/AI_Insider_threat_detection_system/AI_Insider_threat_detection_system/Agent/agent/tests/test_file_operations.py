@@ -0,0 +1,88 @@
+import threading, time
+
+from watchdog.events import DirModifiedEvent, FileModifiedEvent
+
+from modules import file_operations
+from modules.file_operations import Enricher, EventBuffer, Handler
+
+def test_repeats_on_one_path_are_coalesced():
+    buffer = EventBuffer(debounce=2.0)
+    first = buffer.add("C:\\docs\\a.docx", "modified", now=100.0)
+    assert buffer.add("C:\\docs\\a.docx", "modified", now=101.0) is None
+    assert buffer.add("C:\\docs\\a.docx", "modified", now=102.5) is None
+    # Another event type or path is its own record.
+    assert buffer.add("C:\\docs\\a.docx", "deleted", now=102.6) is not None
+    assert buffer.add("C:\\docs\\b.docx", "modified", now=102.7) is not None
+    assert first["count"] == 3 and first["last_timestamp"] == 102.5
+    assert buffer.coalesced == 2
+
+    # Past the debounce window a repeat starts a new record.
+    assert buffer.add("C:\\docs\\a.docx", "modified", now=105.0) is not None
+    assert [(e["path"][-6:], e["event"], e["count"]) for e in buffer.drain()] == [
+        ("a.docx", "modified", 3), ("a.docx", "deleted", 1), ("b.docx", "modified", 1), ("a.docx", "modified", 1)]
+
+def test_full_buffer_drops_the_oldest_and_counts_it():
+    buffer = EventBuffer(max_events=3)
+    for n in range(5):
+        buffer.add(f"f{n}.txt", "created", now=float(n))
+    assert [e["path"] for e in buffer.drain()] == ["f2.txt", "f3.txt", "f4.txt"]
+    assert buffer.dropped == 2
+    # A dropped record no longer absorbs repeats of its event.
+    buffer.add("f0.txt", "created", now=10.0)
+    buffer.add("f0.txt", "created", now=10.5)
+    assert [e["count"] for e in buffer.drain()] == [2]
+
+def test_drain_empties_the_buffer():
+    buffer = EventBuffer()
+    buffer.add("a.txt", "created", now=1.0)
+    assert len(buffer.drain()) == 1
+    assert buffer.drain() == []
+    assert buffer.add("a.txt", "created", now=1.5) is not None
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_enrichment_runs_off_the_watchdog_thread(tmp_path, monkeypatch):
+    path = tmp_path / "report.xlsx"
+    path.write_bytes(b"x" * 1234)
+    release = threading.Event()
+    threads = []
+    getsize = file_operations.os.path.getsize
+
+    def slow_getsize(p):
+        threads.append(threading.current_thread().name)
+        release.wait(5)
+        return getsize(p)
+
+    monkeypatch.setattr(file_operations.os.path, "getsize", slow_getsize)
+    buffer = EventBuffer()
+    monkeypatch.setattr(file_operations, "_buffer", buffer)
+    monkeypatch.setattr(file_operations, "_enricher", Enricher())
+
+    # The handler returns while enrichment is still blocked on the file.
+    handler = Handler()
+    handler.on_any_event(FileModifiedEvent(str(path)))
+    handler.on_any_event(DirModifiedEvent(str(tmp_path)))
+    record = buffer.events[0]
+    assert record["size_after"] is None
+
+    release.set()
+    assert wait_for(lambda: record["size_after"] == 1234)
+    assert threads == ["file-enrich"]  # Directories are not enriched
+
+def test_enrich_queue_overflow_is_counted(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(file_operations.os.path, "getsize", lambda p: release.wait(5) and 0)
+    enricher = Enricher(size=1)
+    try:
+        for n in range(4):
+            enricher.submit({"path": f"f{n}.txt", "size_after": None})
+        # One record is being enriched, one waits, the rest are dropped.
+        assert enricher.dropped >= 2
+    finally:
+        release.set()
@@ -0,0 +1,75 @@
+import json
+
+from modules.identity_session import EVENT_ID_LOGON_FAILURE, EVENT_ID_LOGON_SUCCESS, FileEventSource, LogonReader
+
+def logon(record_number, user, event_id=EVENT_ID_LOGON_SUCCESS):
+    inserts = [""] * 14
+    inserts[5] = user
+    if event_id == EVENT_ID_LOGON_SUCCESS:
+        inserts[8], inserts[10], inserts[11] = "10", "10.0.0.5", "WS-01"
+    else:
+        inserts[10], inserts[12], inserts[13] = "3", "10.0.0.5", "WS-01"
+    return {"RecordNumber": record_number, "EventID": event_id,
+            "TimeGenerated": "2026-01-05T09:00:00", "StringInserts": inserts}
+
+def write_log(path, events):
+    path.write_text("".join(json.dumps(e) + "\n" for e in events))
+
+def users(logons):
+    return [(l["UserID"], l["AuthResult"]) for l in logons]
+
+def test_first_read_starts_at_the_end(tmp_path):
+    log = tmp_path / "security.jsonl"
+    write_log(log, [logon(1, "old")])
+    reader = LogonReader(FileEventSource(str(log)), bookmark_file=str(tmp_path / "bookmark.json"))
+    assert reader.read() == []
+    assert reader.bookmark == 1
+
+def test_bookmark_resumes_after_restart(tmp_path):
+    log, bookmark = tmp_path / "security.jsonl", str(tmp_path / "bookmark.json")
+    events = [logon(1, "old")]
+    write_log(log, events)
+    LogonReader(FileEventSource(str(log)), bookmark_file=bookmark).read()
+
+    events += [logon(2, "alice"), logon(3, "bob", EVENT_ID_LOGON_FAILURE)]
+    write_log(log, events)
+    reader = LogonReader(FileEventSource(str(log)), bookmark_file=bookmark)
+    assert users(reader.read()) == [("alice", "success"), ("bob", "failure")]
+    assert reader.read() == []
+
+    # A restarted reader picks up where the previous one stopped.
+    events.append(logon(4, "carol"))
+    write_log(log, events)
+    assert users(LogonReader(FileEventSource(str(log)), bookmark_file=bookmark).read()) == [("carol", "success")]
+
+def test_limit_leaves_the_rest_for_the_next_cycle(tmp_path):
+    log = tmp_path / "security.jsonl"
+    write_log(log, [logon(1, "old")])
+    reader = LogonReader(FileEventSource(str(log)), bookmark_file=str(tmp_path / "bookmark.json"), limit=2)
+    reader.read()
+    write_log(log, [logon(n, f"user{n}") for n in range(1, 6)])
+    assert users(reader.read()) == [("user2", "success"), ("user3", "success")]
+    assert users(reader.read()) == [("user4", "success"), ("user5", "success")]
+
+def test_cleared_log_resets_the_bookmark(tmp_path):
+    log, bookmark = tmp_path / "security.jsonl", str(tmp_path / "bookmark.json")
+    write_log(log, [logon(n, "old") for n in range(1, 101)])
+    reader = LogonReader(FileEventSource(str(log)), bookmark_file=bookmark)
+    reader.read()
+    assert reader.bookmark == 100
+
+    # Clearing restarts record numbers far below the bookmark.
+    write_log(log, [])
+    assert reader.read() == []
+    assert reader.bookmark == 0
+    write_log(log, [logon(1, "alice"), logon(2, "bob")])
+    assert users(reader.read()) == [("alice", "success"), ("bob", "success")]
+
+def test_cleared_log_with_new_records_is_read_from_its_start(tmp_path):
+    log, bookmark = tmp_path / "security.jsonl", str(tmp_path / "bookmark.json")
+    write_log(log, [logon(n, "old") for n in range(1, 101)])
+    reader = LogonReader(FileEventSource(str(log)), bookmark_file=bookmark)
+    reader.read()
+    write_log(log, [logon(1, "alice"), logon(2, "bob")])
+    assert users(reader.read()) == [("alice", "success"), ("bob", "success")]
+    assert reader.read() == []
@@ -0,0 +1,98 @@
+import socket
+from collections import namedtuple
+
+import pytest
+
+from modules import network_monitor
+from modules.network_monitor import FlowTable
+
+Addr = namedtuple("Addr", "ip port")
+Conn = namedtuple("Conn", "fd family type laddr raddr status pid")
+IO = namedtuple("IO", "read_count write_count read_bytes write_bytes")
+
+class Processes:
+    # Stands in for psutil.Process: names and cumulative I/O counters by PID.
+    def __init__(self):
+        self.io = {}
+
+    def __call__(self, pid):
+        processes = self
+
+        class Process:
+            def name(self):
+                return f"proc{pid}.exe"
+
+            def io_counters(self):
+                sent, received = processes.io.get(pid, (0, 0))
+                return IO(0, 0, received, sent)
+
+        return Process()
+
+@pytest.fixture
+def processes(monkeypatch):
+    fake = Processes()
+    monkeypatch.setattr(network_monitor.psutil, "Process", fake)
+    return fake
+
+def conn(remote_port, pid=100, status="ESTABLISHED", local_port=50000):
+    return Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("10.0.0.5", local_port + remote_port),
+                Addr("93.184.216.34", remote_port), status, pid)
+
+def events(records):
+    return sorted((r["FlowEvent"], r["DestPort"]) for r in records)
+
+def test_flow_opens_updates_and_closes(processes):
+    table = FlowTable(long_lived=300)
+    listening = Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("0.0.0.0", 445), (), "LISTEN", 4)
+    records = table.update([conn(443), listening], now=0)
+    assert events(records) == [("opened", 443)]
+    assert records[0]["ProcessName"] == "proc100.exe" and records[0]["Protocol"] == "TCP"
+
+    # Still open and not yet long-lived: nothing to report, but the status
+    # follows the connection.
+    assert table.update([conn(443, status="CLOSE_WAIT")], now=10) == []
+    closed = table.update([], now=20)
+    assert events(closed) == [("closed", 443)]
+    assert closed[0]["ConnectionStatus"] == "CLOSE_WAIT"
+    assert closed[0]["ConnectionDuration"] == 20
+    assert table.stats()["flows"] == 0
+
+def test_byte_deltas_are_split_over_a_process_flows(processes):
+    table = FlowTable(long_lived=300)
+    processes.io[100] = (1000, 5000)
+    table.update([conn(443), conn(80)], now=0)  # The first sample is the baseline
+    processes.io[100] = (3000, 9000)
+    table.update([conn(443), conn(80)], now=10)
+    processes.io[100] = (3600, 9000)
+    table.update([conn(443), conn(80)], now=20)
+
+    records = {r["DestPort"]: r for r in table.update([], now=30)}
+    assert {port: (r["BytesSent"], r["BytesReceived"]) for port, r in records.items()} == {
+        443: (1300, 2000), 80: (1300, 2000)}
+
+def test_long_lived_flows_report_what_accrued_since_the_last_report(processes):
+    table = FlowTable(long_lived=300)
+    processes.io[100] = (0, 0)
+    table.update([conn(443)], now=0)
+    processes.io[100] = (500, 700)
+    assert table.update([conn(443)], now=100) == []
+    records = table.update([conn(443)], now=300)
+    assert events(records) == [("long_lived", 443)]
+    assert (records[0]["BytesSent"], records[0]["BytesReceived"]) == (500, 700)
+
+    processes.io[100] = (600, 700)
+    closed = table.update([], now=400)
+    assert (closed[0]["BytesSent"], closed[0]["BytesReceived"]) == (0, 0)
+    assert closed[0]["ConnectionDuration"] == 400
+
+def test_idle_flows_are_evicted_first(processes):
+    table = FlowTable(max_flows=2)
+    processes.io.update({1: (0, 0), 2: (0, 0), 3: (0, 0)})
+    flows = [conn(443, pid=1), conn(444, pid=2)]
+    table.update(flows, now=0)
+    # PID 1 moves traffic, so its flow is the most recently active one.
+    processes.io[1] = (10, 10)
+    table.update(flows, now=1)
+    table.update(flows + [conn(445, pid=3)], now=2)
+    assert [key[4] for key in table.flows] == [443, 445]
+    assert table.stats()["evicted"] == 1
@@ -0,0 +1,55 @@
+from delta import DeltaEncoder
+from scheduler import Collector, Scheduler
+
+def make_scheduler(*collectors):
+    scheduler = Scheduler(list(collectors))
+    return scheduler, {c.section: c for c in collectors}
+
+def run(scheduler, collector):
+    # Runs one cycle synchronously instead of through the pool.
+    scheduler._run(collector)
+
+def test_accumulated_events_are_handed_over_once():
+    batches = iter([[{"n": 1}], [{"n": 2}]])
+    scheduler, c = make_scheduler(Collector("files", lambda: next(batches), default=[], accumulate=True))
+    run(scheduler, c["files"])
+    run(scheduler, c["files"])
+    assert scheduler.snapshot()["files"] == [{"n": 1}, {"n": 2}]
+    assert scheduler.snapshot()["files"] == []
+
+def test_state_result_is_handed_over_once():
+    scheduler, c = make_scheduler(Collector("processes", lambda: [{"PID": 1}], default=[]))
+    assert "processes" not in scheduler.snapshot()
+    run(scheduler, c["processes"])
+    assert scheduler.snapshot()["processes"] == [{"PID": 1}]
+    assert "processes" not in scheduler.snapshot()
+
+def test_failed_run_keeps_nothing():
+    def fail():
+        raise OSError("boom")
+    scheduler, c = make_scheduler(Collector("usb", fail, default=[]))
+    run(scheduler, c["usb"])
+    assert "usb" not in scheduler.snapshot()
+    assert c["usb"].stats["errors"] == 1
+
+def test_encoder_keeps_sections_that_were_not_refreshed():
+    encoder = DeltaEncoder("host", keyframe_every=3)
+    first = encoder.encode({"processes": [{"PID": 1, "ProcessPath": "a"}], "files": [{"path": "x"}]})
+    assert first["delta"]["keyframe"]
+    # processes did not run: unchanged, so nothing is sent for it.
+    second = encoder.encode({"files": []})
+    assert "processes" not in second["changes"]
+    assert second["changes"]["files"] == {"removed": [first["changes"]["files"]["added"][0][0]]}
+    encoder.encode({"files": []})
+    # The next keyframe still carries the last known processes.
+    keyframe = encoder.encode({"files": []})
+    assert keyframe["delta"]["keyframe"]
+    assert [r for _, r in keyframe["changes"]["processes"]["added"]] == [{"PID": 1, "ProcessPath": "a"}]
+
+def test_encoder_reset_resends_last_known_state():
+    encoder = DeltaEncoder("host")
+    encoder.encode({"processes": [{"PID": 1, "ProcessPath": "a"}]})
+    encoder.reset()
+    message = encoder.encode({})
+    assert message["delta"]["keyframe"]
+    assert len(message["changes"]["processes"]["added"]) == 1
@@ -0,0 +1,43 @@
+import json
+
+from modules.registry_changes import FakeRegistrySource, RegistryMonitor
+from modules.state_store import StateStore
+
+RUN = ("HKLM", r"SOFTWARE\Microsoft\Windows\CurrentVersion\Run")
+
+def operations(changes):
+    return sorted((c["operation"], c["value_name"], c["value_data"]) for c in changes)
+
+def test_diff_reports_create_modify_delete():
+    store = StateStore()
+    assert store.diff({"a": 1, "b": 2}) == [("create", "a", 1), ("create", "b", 2)]
+    assert store.diff({"a": 1, "b": 2}) == []
+    assert sorted(store.diff({"a": 3, "c": 4})) == [("create", "c", 4), ("delete", "b", 2), ("modify", "a", 3)]
+
+def test_registry_add_change_remove(tmp_path):
+    source = FakeRegistrySource({RUN: {"OneDrive": "onedrive.exe"}})
+    monitor = RegistryMonitor(source, snapshot_file=str(tmp_path / "reg.json"))
+    assert operations(monitor.collect()) == [("create", "OneDrive", "onedrive.exe")]
+    assert monitor.collect() == []
+
+    source.keys[RUN]["Updater"] = "evil.exe"
+    assert operations(monitor.collect()) == [("create", "Updater", "evil.exe")]
+
+    source.keys[RUN]["Updater"] = "evil2.exe"
+    assert operations(monitor.collect()) == [("modify", "Updater", "evil2.exe")]
+
+    del source.keys[RUN]["Updater"]
+    assert operations(monitor.collect()) == [("delete", "Updater", "evil2.exe")]
+
+def test_registry_snapshot_survives_restart(tmp_path):
+    path = str(tmp_path / "reg.json")
+    source = FakeRegistrySource({RUN: {"OneDrive": "onedrive.exe"}})
+    RegistryMonitor(source, snapshot_file=path).collect()
+    source.keys[RUN]["Updater"] = "evil.exe"
+    assert operations(RegistryMonitor(source, snapshot_file=path).collect()) == [("create", "Updater", "evil.exe")]
+
+def test_registry_upgrades_old_snapshot(tmp_path):
+    path = tmp_path / "reg.json"
+    path.write_text(json.dumps({"HKLM-" + RUN[1]: {"OneDrive": "onedrive.exe"}}))
+    source = FakeRegistrySource({RUN: {"OneDrive": "onedrive.exe"}})
+    assert RegistryMonitor(source, snapshot_file=str(path)).collect() == []
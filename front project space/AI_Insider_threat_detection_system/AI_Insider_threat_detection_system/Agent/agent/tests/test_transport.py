@@ -0,0 +1,117 @@
+import gzip, json
+
+import requests
+
+from common import wire
+from delta import DeltaEncoder
+from transport import Transport
+
+ROUTER = "http://server:5000/agent"
+SHARD = "http://server:5002/agent"
+OTHER = "http://server:5001/agent"
+
+class Response:
+    def __init__(self, status_code, shard_url=None, body=None):
+        self.status_code = status_code
+        self.headers = {"X-Shard-Url": shard_url} if shard_url else {}
+        self.ok = status_code < 400
+        self.text = ""
+        self.body = body or {"status": "accepted"}
+
+    def json(self):
+        return self.body
+
+class FakeSession:
+    # Answers each URL from a list of responses; an exception is raised.
+    def __init__(self, answers):
+        self.answers = answers
+        self.posted = []
+        self.bodies = []
+        self.headers = {}
+
+    def post(self, url, data=None, **kwargs):
+        self.posted.append(url)
+        lines = gzip.decompress(data).splitlines()
+        self.bodies.append(json.loads(lines[0]) if len(lines) == 1 else [json.loads(line) for line in lines])
+        answer = self.answers[url].pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+def transport(tmp_path, answers, encoder=None):
+    t = Transport(ROUTER, "WS-01", str(tmp_path / "spool"), wire_format=wire.JSON, encoder=encoder)
+    t.session = FakeSession(answers)
+    return t
+
+def test_posts_go_to_the_shard_the_router_names(tmp_path):
+    t = transport(tmp_path, {ROUTER: [Response(200, SHARD)], SHARD: [Response(200), Response(200)]})
+    assert t.send({"n": 1}).delivered
+    assert t.send({"n": 2}).delivered
+    assert t.send({"n": 3}).delivered
+    assert t.session.posted == [ROUTER, SHARD, SHARD]
+
+def test_misdirected_post_follows_the_owner(tmp_path):
+    t = transport(tmp_path, {ROUTER: [Response(200, SHARD)], SHARD: [Response(421, OTHER)], OTHER: [Response(200)]})
+    t.send({"n": 1})
+    assert t.send({"n": 2}).delivered
+    assert t.session.posted == [ROUTER, SHARD, OTHER]
+    assert t.shard_url == OTHER
+
+def test_unreachable_shard_falls_back_to_the_router(tmp_path):
+    t = transport(tmp_path, {ROUTER: [Response(200, SHARD), Response(200)],
+                             SHARD: [requests.ConnectionError("refused")]})
+    t.send({"n": 1})
+    assert t.send({"n": 2}).delivered
+    assert t.session.posted == [ROUTER, SHARD, ROUTER]
+    assert not len(t.spool)
+
+def test_spool_replays_to_the_shard_batch_endpoint(tmp_path):
+    t = transport(tmp_path, {ROUTER: [Response(503)], SHARD + "/batch": [Response(202)],
+                             ROUTER + "/batch": [Response(202, SHARD + "/batch")]})
+    assert t.send({"n": 1}).spooled
+    t.retry_at = 0.0
+    t.replay()
+    assert t.shard_url == SHARD
+    t.spool.append({"n": 2})
+    t.replay()
+    assert t.session.posted == [ROUTER, ROUTER + "/batch", SHARD + "/batch"]
+    assert not len(t.spool)
+
+def event(path):
+    return {"FilePath": path, "OperationType": "delete"}
+
+def test_resync_resends_the_snapshot_as_a_keyframe(tmp_path):
+    # The server restarted between two sends and lost this agent's delta
+    # state; the events of the refused snapshot must still arrive.
+    t = transport(tmp_path, {ROUTER: [Response(200), Response(409), Response(200)]}, DeltaEncoder("WS-01"))
+    assert t.send({"files": [event("a.docx")]}).delivered
+    result = t.send({"files": [event("b.docx")]})
+    assert result.delivered and result.resync
+    first, refused, resent = t.session.bodies
+    assert not refused["delta"]["keyframe"]
+    assert resent["delta"]["keyframe"]
+    assert [record for _, record in resent["changes"]["files"]["added"]] == [event("b.docx")]
+    assert not len(t.spool)
+
+def test_spooled_snapshots_are_keyframes(tmp_path):
+    t = transport(tmp_path, {ROUTER: [Response(200), Response(503)]}, DeltaEncoder("WS-01"))
+    t.send({"files": [event("a.docx")]})
+    assert t.send({"files": [event("b.docx")]}).spooled
+    assert t.send({"files": [event("c.docx")]}).spooled
+    _, lines = t.spool.oldest()
+    spooled = [json.loads(line) for line in lines.splitlines()]
+    assert [m["delta"]["keyframe"] for m in spooled] == [True, True]
+    assert [m["changes"]["files"]["added"][0][1] for m in spooled] == [event("b.docx"), event("c.docx")]
+
+def test_partly_accepted_batch_keeps_only_the_failed_payloads(tmp_path):
+    # The router split the segment over two shards and one was down.
+    partial = Response(202, body={"status": "accepted", "count": 2, "failed": [1, 3]})
+    t = transport(tmp_path, {ROUTER + "/batch": [partial, Response(202)]})
+    for n in range(4):
+        t.spool.append({"n": n})
+    t.replay()
+    assert len(t.spool) == 1 and t.retry_at > 0
+    t.retry_at = 0.0
+    t.replay()
+    assert t.session.bodies[1] == [{"n": 1}, {"n": 3}]
+    assert not len(t.spool)
@@ -0,0 +1,265 @@
+import gzip, json, os, time
+import requests
+from requests.adapters import HTTPAdapter
+from common import wire
+from common.metrics import BYTES_BUCKETS, REGISTRY
+
+# Ships payloads over one pooled keep-alive session with gzip bodies. While
+# the server is unreachable payloads go to an on-disk spool of small NDJSON
+# segments (oldest dropped past a size cap), which is replayed oldest first
+# through /agent/batch with exponential backoff once the server is back.
+# Live payloads use the configured wire format (MessagePack by default) and
+# drop to JSON for good if the server does not accept it; the spool stays JSON.
+# With a DeltaEncoder, live snapshots go out as deltas; a 409 (the server has
+# lost this agent's delta state) resends the same snapshot as a keyframe, and
+# whatever is spooled is a keyframe, since the state a delta builds on may be
+# gone by the time it is replayed.
+# A clustered server names this agent's shard in X-Shard-Url; posts then go
+# straight to the shard, and back through server_url if it moves or is down.
+# A batch the router split over shards can be taken in part; the payloads it
+# lists as failed stay spooled and the rest are dropped from the segment.
+
+SPOOL_MAX_BYTES = 100 * 1024 * 1024
+SEGMENT_MAX_BYTES = 1024 * 1024
+SEGMENT_MAX_ITEMS = 200
+REPLAY_SEGMENTS_PER_CALL = 10
+BACKOFF_INITIAL = 5
+BACKOFF_MAX = 300
+
+SEND_SECONDS = REGISTRY.histogram("insider_agent_send_seconds", "Time to post one payload.")
+SEND_BYTES = REGISTRY.histogram("insider_agent_send_bytes", "Compressed size of each posted body.",
+                                ("endpoint",), BYTES_BUCKETS)
+SEND_RESULTS = REGISTRY.counter("insider_agent_sends_total", "Payloads by outcome.", ("result",))
+
+class Spool:
+    def __init__(self, path, max_bytes=SPOOL_MAX_BYTES, segment_bytes=SEGMENT_MAX_BYTES,
+                 segment_items=SEGMENT_MAX_ITEMS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.segment_items = segment_items
+        self.dropped = 0
+        os.makedirs(path, exist_ok=True)
+        self.segments = sorted(n for n in os.listdir(path) if n.endswith(".ndjson"))
+        self.sizes = {n: os.path.getsize(os.path.join(path, n)) for n in self.segments}
+        self.open_name = None
+        self.open_items = 0
+
+    def __len__(self):
+        return len(self.segments)
+
+    def total_bytes(self):
+        return sum(self.sizes.values())
+
+    def _next_name(self):
+        last = int(self.segments[-1].split(".")[0]) if self.segments else 0
+        return f"{last + 1:012d}.ndjson"
+
+    def append(self, payload):
+        line = (json.dumps(payload, default=str) + "\n").encode()
+        name = self.open_name
+        if name is None or self.sizes[name] + len(line) > self.segment_bytes or self.open_items >= self.segment_items:
+            name = self.open_name = self._next_name()
+            self.segments.append(name)
+            self.sizes[name] = 0
+            self.open_items = 0
+        with open(os.path.join(self.path, name), "ab") as f:
+            f.write(line)
+        self.sizes[name] += len(line)
+        self.open_items += 1
+        while self.total_bytes() > self.max_bytes and len(self.segments) > 1:
+            self.dropped += self._lines(self.segments[0])
+            self.remove(self.segments[0])
+
+    def _lines(self, name):
+        try:
+            with open(os.path.join(self.path, name), "rb") as f:
+                return sum(1 for _ in f)
+        except OSError:
+            return 0
+
+    def oldest(self):
+        # The segment being written is sealed before it is handed out so
+        # new payloads never land in a segment that is mid-replay.
+        if not self.segments:
+            return None, None
+        name = self.segments[0]
+        if name == self.open_name:
+            self.open_name = None
+        with open(os.path.join(self.path, name), "rb") as f:
+            return name, f.read()
+
+    def keep(self, name, lines):
+        # Rewrites a segment with only the given lines, e.g. the payloads of
+        # a batch that the server took only part of.
+        tmp = os.path.join(self.path, name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(b"".join(line + b"\n" for line in lines))
+        os.replace(tmp, os.path.join(self.path, name))
+        self.sizes[name] = os.path.getsize(os.path.join(self.path, name))
+
+    def remove(self, name):
+        if name == self.open_name:
+            self.open_name = None
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+        self.segments.remove(name)
+        del self.sizes[name]
+
+class SendResult:
+    def __init__(self, delivered=False, spooled=False, resync=False):
+        self.delivered = delivered
+        self.spooled = spooled
+        self.resync = resync
+
+class Transport:
+    def __init__(self, server_url, agent_id, spool_dir, timeout=10, spool_max_bytes=SPOOL_MAX_BYTES,
+                 wire_format=wire.MSGPACK, encoder=None):
+        self.server_url = server_url
+        self.encoder = encoder
+        self.shard_url = None
+        self.wire_format = wire_format
+        self.timeout = timeout
+        self.spool = Spool(spool_dir, max_bytes=spool_max_bytes)
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.headers.update({"X-Agent-Id": agent_id, "Content-Encoding": "gzip"})
+        self.backoff = 0
+        self.retry_at = 0.0
+
+    def _fail(self, retry_after=None):
+        self.backoff = min(BACKOFF_MAX, self.backoff * 2 if self.backoff else BACKOFF_INITIAL)
+        self.retry_at = time.monotonic() + (retry_after if retry_after is not None else self.backoff)
+
+    def _retry_after(self, response):
+        try:
+            return float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def _encode(self, snapshot, keyframe=False):
+        if self.encoder is None:
+            return snapshot
+        if keyframe:
+            self.encoder.reset()
+        return self.encoder.encode(snapshot)
+
+    def _queue(self, snapshot):
+        self.spool.append(self._encode(snapshot, keyframe=True))
+
+    def send(self, snapshot):
+        # Order is preserved: while anything is spooled, new payloads queue
+        # behind it instead of overtaking it.
+        resync = False
+        if len(self.spool) and time.monotonic() >= self.retry_at:
+            resync = self.replay()
+        if len(self.spool) or time.monotonic() < self.retry_at:
+            self._queue(snapshot)
+            SEND_RESULTS.inc(labels=("spooled",))
+            return SendResult(spooled=True, resync=resync)
+        try:
+            message = self._encode(snapshot)
+            response = self._post(message)
+            if response.status_code in (400, 415) and self.wire_format != wire.JSON:
+                print(f"[-] Server rejected {self.wire_format}, falling back to JSON")
+                self.wire_format = wire.JSON
+                response = self._post(message)
+            if response.status_code == 409:
+                print("[-] Server lost our delta state, resending as a keyframe")
+                SEND_RESULTS.inc(labels=("resync",))
+                resync = True
+                response = self._post(self._encode(snapshot, keyframe=True))
+        except requests.RequestException as e:
+            print("[-] Error sending data:", e)
+            self._fail()
+            self._queue(snapshot)
+            SEND_RESULTS.inc(labels=("error",))
+            return SendResult(spooled=True, resync=resync)
+        print("[+] Server response:", response.status_code, response.text)
+        if response.status_code in (421, 429) or response.status_code >= 500:
+            self._fail(self._retry_after(response))
+            self._queue(snapshot)
+            SEND_RESULTS.inc(labels=("spooled",))
+            return SendResult(spooled=True, resync=resync)
+        self.backoff = 0
+        SEND_RESULTS.inc(labels=("delivered" if response.ok else "rejected",))
+        return SendResult(delivered=response.ok, resync=resync)
+
+    def _post(self, payload):
+        body, content_type = wire.encode(payload, self.wire_format)
+        body = gzip.compress(body)
+        SEND_BYTES.observe(len(body), ("agent",))
+        with SEND_SECONDS.time():
+            return self._deliver(body, content_type)
+
+    def _deliver(self, body, content_type, batch=False):
+        # One move is followed per post: to the shard a 421 names, or back to
+        # server_url when the shard is unreachable or names no other.
+        for attempt in (0, 1):
+            url = self.shard_url or self.server_url
+            if batch:
+                url = url.rstrip("/") + "/batch"
+            try:
+                response = self.session.post(url, data=body, timeout=self.timeout,
+                                             headers={"Content-Type": content_type})
+            except requests.RequestException as e:
+                if self.shard_url is None or attempt:
+                    raise
+                print(f"[-] Shard {self.shard_url} unreachable ({e}), sending through {self.server_url}")
+                self.shard_url = None
+                continue
+            shard_url = response.headers.get("X-Shard-Url")
+            if shard_url:
+                self.shard_url = shard_url[:-len("/batch")] if shard_url.endswith("/batch") else shard_url
+            elif response.status_code == 421:
+                self.shard_url = None
+            if response.status_code != 421:
+                break
+        return response
+
+    def replay(self):
+        resync = False
+        for _ in range(REPLAY_SEGMENTS_PER_CALL):
+            name, lines = self.spool.oldest()
+            if name is None:
+                break
+            body = gzip.compress(lines)
+            SEND_BYTES.observe(len(body), ("batch",))
+            try:
+                response = self._deliver(body, "application/x-ndjson", batch=True)
+            except requests.RequestException as e:
+                print("[-] Spool replay failed:", e)
+                self._fail()
+                break
+            if response.status_code in (421, 429) or response.status_code >= 500:
+                self._fail(self._retry_after(response))
+                break
+            if not response.ok:
+                print(f"[-] Server rejected spooled segment {name}: {response.status_code} {response.text}")
+            else:
+                try:
+                    result = response.json()
+                except ValueError:
+                    result = {}
+                resync = resync or bool(result.get("resync"))
+                if result.get("failed"):
+                    # A clustered server took the payloads of the shards that
+                    # were up; only the rest stay spooled for the next try.
+                    payloads = [line for line in lines.splitlines() if line.strip()]
+                    self.spool.keep(name, [payloads[i] for i in result["failed"] if i < len(payloads)])
+                    print(f"[-] {len(result['failed'])} payloads of spooled segment {name} not accepted yet")
+                    self._fail(self._retry_after(response))
+                    break
+            self.spool.remove(name)
+            self.backoff = 0
+        if resync and self.encoder is not None:
+            # Only deltas spooled by an older agent can be refused; the live
+            # stream restarts from a keyframe.
+            print("[-] Server refused spooled deltas, next payload is a keyframe")
+            self.encoder.reset()
+        if len(self.spool):
+            print(f"[+] {len(self.spool)} spooled segments left, {self.spool.dropped} payloads dropped so far")
+        return resync
@@ -0,0 +1,194 @@
+import bisect
+import threading
+import time
+
+# In-process counters and latency histograms, shared by the server and the
+# agent. Recording is a dict update under a per-metric lock; nothing is
+# formatted until the registry is rendered, as Prometheus text for the
+# server's /metrics or as a dict for the agent's stats file. Gauges are
+# callbacks read at render time, so sizes of queues and stores cost nothing
+# until someone looks.
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = tuple(2 ** i for i in range(8, 27, 2))  # 256 B .. 64 MB
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in self.values.items()]
+
+    def snapshot(self):
+        with self.lock:
+            return {",".join(map(str, labels)): value for labels, value in self.values.items()}
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 3)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def time(self, labels=()):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(labels, list(counts)) for labels, counts in self.values.items()]
+        result = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                result.append((self.name + "_bucket", labels + (_number(bound),), cumulative))
+            result.append((self.name + "_sum", labels, counts[-2]))
+            result.append((self.name + "_count", labels, counts[-1]))
+        return result
+
+    def snapshot(self):
+        # count, sum and an approximate p50/p99 (bucket upper bounds) per label set.
+        with self.lock:
+            values = [(labels, list(counts)) for labels, counts in self.values.items()]
+        result = {}
+        for labels, counts in values:
+            total = counts[-1]
+            entry = {"count": total, "sum": round(counts[-2], 6)}
+            for name, q in (("p50", 0.5), ("p99", 0.99)):
+                seen = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    seen += count
+                    if total and seen >= q * total:
+                        entry[name] = bound if bound != float("inf") else None
+                        break
+            result[",".join(map(str, labels))] = entry
+        return result
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labels=()):
+        # fn returns a number, or a dict of label value tuples to numbers.
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.label_names = tuple(labels)
+
+    def _read(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return {}
+        return value if isinstance(value, dict) else {(): value}
+
+    def samples(self):
+        return [(self.name, labels, value) for labels, value in self._read().items() if value is not None]
+
+    def snapshot(self):
+        return {",".join(map(str, labels)): value for labels, value in self._read().items()}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _add(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=()):
+        # Registering a gauge again replaces its callback.
+        with self.lock:
+            metric = self.metrics[name] = Gauge(name, help, fn, labels)
+            return metric
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4.
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            names = metric.label_names
+            for name, labels, value in metric.samples():
+                label_names = names + ("le",) if name.endswith("_bucket") else names
+                lines.append(f"{name}{_labels(label_names, labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Statistical profiler that can be switched on in a running process. While
+# started, a background thread snapshots every other thread's stack each
+# interval and counts identical stacks; report() returns them in the
+# collapsed "frame;frame;frame count" format that flamegraph.pl and speedscope
+# read. When stopped it costs nothing.
+INTERVAL = 0.005
+MAX_DEPTH = 64
+MAX_SECONDS = 300
+
+
+def _frame(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=INTERVAL, max_depth=MAX_DEPTH):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.started = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, seconds=None):
+        # Samples until stop(), or for `seconds` if given (capped at MAX_SECONDS).
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.started = time.time()
+            self.stopped.clear()
+            deadline = time.monotonic() + min(seconds or MAX_SECONDS, MAX_SECONDS)
+            self.thread = threading.Thread(target=self._run, args=(deadline,), name="profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.stopped.set()
+            thread.join()
+        return self.report()
+
+    def _run(self, deadline):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval) and time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        with self.lock:
+            if self.thread is threading.current_thread():
+                self.thread = None
+
+    def report(self, limit=None):
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common(limit)]
+        return "\n".join(lines) + "\n" if lines else ""
@@ -0,0 +1,170 @@
+import json
+
+# Record schema shared by the agent and the server. Field names are the
+# CamelCase names the rules and dashboards read; FIELDS gives each list
+# section's fields in wire order. Collectors that still emit snake_case keys
+# are mapped by ALIASES, optionally converting the value on the way.
+# normalize_payload() stamps the payload with SCHEMA_VERSION, so the server
+# only re-maps payloads from agents that predate it.
+SCHEMA_VERSION = 1
+
+FIELDS = {
+    "identity": (
+        "Timestamp", "UserID", "SessionID", "MachineName", "LogonType", "AuthResult", "MFAUsed",
+        "LogonSource",
+    ),
+    "processes": (
+        "ProcessName", "ProcessPath", "PID", "ParentPID", "CommandLineArgs", "ExitCode", "ImageHash",
+        "CPUUsage", "MemoryUsage", "Change",
+    ),
+    "files": (
+        "FilePath", "FileType", "OperationType", "FileSizeBefore", "FileSizeAfter", "FileHash",
+        "AccessResult", "SensitivityLabel", "Timestamp", "LastTimestamp", "EventCount",
+    ),
+    "network": (
+        "SourceIP", "SourcePort", "DestIP", "DestPort", "Protocol", "BytesSent", "BytesReceived",
+        "ConnectionDuration", "DNSQuery", "ConnectionStatus", "PID", "ProcessName", "FlowEvent",
+    ),
+    "registry": (
+        "RegistryHive", "KeyPath", "ValueName", "ValueData", "OperationType",
+    ),
+    "usb": (
+        "USBDeviceID", "SerialNumber", "MountPoint", "DataTransferVolume", "FileNamesTransferred",
+        "AccessOutcome", "Change",
+    ),
+    "email_cloud": (
+        "ApplicationName", "EmailSender", "EmailRecipient", "EmailSubject", "AttachmentDetails",
+        "UploadVolume", "DownloadVolume", "CloudActionType", "CloudAPICallDetails", "FileName",
+        "FilePath", "Timestamp",
+    ),
+    "av_alerts": (
+        "AlertID", "Signature", "Severity", "InvolvedFile", "InvolvedProcess", "ActionTaken", "Timestamp",
+    ),
+    "clipboard_screen": (
+        "ClipboardEvent", "ClipboardContentMeta", "ScreenCaptureTrigger", "Timestamp",
+    ),
+}
+
+
+def _megabytes(value):
+    return round(value / (1024 * 1024), 1) if isinstance(value, (int, float)) else value
+
+
+FILE_OPERATIONS = {"created": "create", "modified": "modify", "deleted": "delete", "moved": "move"}
+
+
+def _file_operation(value):
+    return FILE_OPERATIONS.get(value, value)
+
+
+# section -> {legacy key: (field, converter or None)}
+ALIASES = {
+    "processes": {
+        "pid": ("PID", None), "ppid": ("ParentPID", None), "name": ("ProcessName", None),
+        "path": ("ProcessPath", None), "cmdline": ("CommandLineArgs", None),
+        "exit_code": ("ExitCode", None), "hash": ("ImageHash", None), "cpu": ("CPUUsage", None),
+        "memory": ("MemoryUsage", _megabytes), "change": ("Change", None),
+    },
+    "files": {
+        "path": ("FilePath", None), "event": ("OperationType", _file_operation),
+        "size_before": ("FileSizeBefore", None), "size_after": ("FileSizeAfter", None),
+        "hash": ("FileHash", None), "timestamp": ("Timestamp", None),
+        "last_timestamp": ("LastTimestamp", None), "count": ("EventCount", None),
+    },
+    "network": {
+        "source_ip": ("SourceIP", None), "source_port": ("SourcePort", None),
+        "dest_ip": ("DestIP", None), "dest_port": ("DestPort", None),
+        "protocol": ("Protocol", None), "status": ("ConnectionStatus", None),
+        "change": ("Change", None),
+    },
+    "registry": {
+        "registry_hive": ("RegistryHive", None), "key_path": ("KeyPath", None),
+        "value_name": ("ValueName", None), "value_data": ("ValueData", None),
+        "operation": ("OperationType", None),
+    },
+    "usb": {
+        "change": ("Change", None),
+    },
+    "email_cloud": {
+        "application": ("ApplicationName", None), "email_recipient": ("EmailRecipient", None),
+        "email_subject": ("EmailSubject", None), "attachment_details": ("AttachmentDetails", None),
+        "cloud_action": ("CloudActionType", None), "filename": ("FileName", None),
+        "path": ("FilePath", None), "timestamp": ("Timestamp", None),
+    },
+    "av_alerts": {
+        "alert_id": ("AlertID", None), "signature": ("Signature", None), "severity": ("Severity", None),
+        "involved_file": ("InvolvedFile", None), "action_taken": ("ActionTaken", None),
+        "timestamp": ("Timestamp", None),
+    },
+    "clipboard_screen": {
+        "event": ("ClipboardEvent", None), "content_meta": ("ClipboardContentMeta", json.dumps),
+        "timestamp": ("Timestamp", None),
+    },
+}
+
+COMMON_ALIASES = {"error": ("Error", None)}
+
+
+def normalize(section, record):
+    # Returns the record with legacy keys renamed; records that are already
+    # canonical are returned as they are.
+    aliases = ALIASES.get(section, {})
+    if not any(key in aliases or key in COMMON_ALIASES for key in record):
+        return record
+    result = {}
+    for key, value in record.items():
+        alias = aliases.get(key) or COMMON_ALIASES.get(key)
+        if alias is None:
+            result[key] = value
+            continue
+        field, convert = alias
+        result[field] = convert(value) if convert is not None and value is not None else value
+    return result
+
+
+def normalize_payload(payload):
+    if payload.get("schema", 0) >= SCHEMA_VERSION:
+        return payload
+    result = dict(payload)
+    for section, value in payload.items():
+        if section not in FIELDS:
+            continue
+        if isinstance(value, list):
+            result[section] = [normalize(section, r) if isinstance(r, dict) else r for r in value]
+        elif isinstance(value, dict):
+            result[section] = normalize(section, value)
+    result["schema"] = SCHEMA_VERSION
+    return result
+
+
+def to_columns(section, records):
+    # Array-backed form of a list of records: the field names once, then one
+    # row per record. Schema fields come first in schema order, any extra
+    # keys after them. A key a record does not have is sent as None and its
+    # [row, column] listed under "absent", so it is not confused with a field
+    # whose value is None.
+    known = FIELDS.get(section, ())
+    present = set()
+    for record in records:
+        present.update(record)
+    columns = [f for f in known if f in present]
+    columns += sorted(present.difference(columns))
+    packed = {"columns": columns, "rows": [[record.get(c) for c in columns] for record in records]}
+    absent = [[i, j] for i, record in enumerate(records) if len(record) < len(columns)
+              for j, c in enumerate(columns) if c not in record]
+    if absent:
+        packed["absent"] = absent
+    return packed
+
+
+def from_columns(packed):
+    # Inverse of to_columns; None values are kept as sent. Raises ValueError
+    # on anything that is not in that form.
+    columns, rows = packed.get("columns"), packed.get("rows")
+    if not isinstance(columns, list) or not isinstance(rows, list) or \
+            not all(isinstance(row, list) and len(row) == len(columns) for row in rows):
+        raise ValueError("packed records need a columns list and rows of the same length")
+    records = [dict(zip(columns, row)) for row in rows]
+    for i, j in packed.get("absent", ()):
+        del records[i][columns[j]]
+    return records
@@ -0,0 +1,100 @@
+import json
+
+from .schema import from_columns, to_columns
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Payload encodings, chosen by Content-Type. MessagePack bodies also send every
+# list of records in the array-backed column form from schema.py, so field
+# names travel once per section instead of once per record; this covers plain
+# payload sections and the added/changed lists of delta messages. JSON bodies
+# are left as they are, so JSON stays the fallback any server understands.
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+COLUMNS = "$columns"
+
+
+def available(content_type):
+    return content_type == JSON or (content_type == MSGPACK and msgpack is not None)
+
+
+def _is_records(value):
+    return isinstance(value, list) and value and all(isinstance(r, dict) for r in value)
+
+
+def _pack(section, records):
+    return {COLUMNS: to_columns(section, records)}
+
+
+def _unpack(value):
+    if isinstance(value, dict) and COLUMNS in value:
+        return from_columns(value[COLUMNS])
+    return value
+
+
+def pack(payload):
+    result = dict(payload)
+    for section, value in payload.items():
+        if _is_records(value):
+            result[section] = _pack(section, value)
+    changes = payload.get("changes")
+    if isinstance(changes, dict):
+        result["changes"] = packed = {}
+        for section, diff in changes.items():
+            diff = dict(diff)
+            for name in ("added", "changed"):
+                entries = diff.get(name)
+                if entries and all(isinstance(record, dict) for _, record in entries):
+                    diff[name] = {
+                        "keys": [key for key, _ in entries],
+                        "records": _pack(section, [record for _, record in entries]),
+                    }
+            packed[section] = diff
+    return result
+
+
+def unpack(payload):
+    result = {section: _unpack(value) for section, value in payload.items()}
+    changes = payload.get("changes")
+    if isinstance(changes, dict):
+        result["changes"] = unpacked = {}
+        for section, diff in changes.items():
+            diff = dict(diff)
+            for name in ("added", "changed"):
+                entries = diff.get(name)
+                if isinstance(entries, dict):
+                    diff[name] = [list(pair) for pair in zip(entries["keys"], _unpack(entries["records"]))]
+            unpacked[section] = diff
+    return result
+
+
+def encode(payload, content_type=MSGPACK):
+    # Returns (body, content type). Falls back to JSON when MessagePack is
+    # not installed.
+    if content_type == MSGPACK and msgpack is not None:
+        return msgpack.packb(pack(payload), use_bin_type=True, default=str), MSGPACK
+    return json.dumps(payload, default=str).encode(), JSON
+
+
+def decode(body, content_type=JSON):
+    if content_type == MSGPACK:
+        if msgpack is None:
+            raise ValueError("MessagePack bodies are not supported: msgpack is not installed")
+        try:
+            payload = msgpack.unpackb(body, raw=False)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as e:
+            raise ValueError(f"invalid MessagePack body: {e}")
+        if not isinstance(payload, dict):
+            raise ValueError("payload must be a map")
+        try:
+            return unpack(payload)
+        except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
+            raise ValueError(f"invalid packed records: {e!r}")
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("payload must be a JSON object")
+    return payload
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Collapses repeated rule hits into incidents. A hit whose fingerprint was last
+# seen within its rule's suppression window bumps that incident's count and
+# last_seen instead of raising a new alert; once a fingerprint has been quiet
+# for the whole window the next hit opens a new incident. The cache is LRU
+# bounded, and entries whose window has lapsed are dropped as it is touched.
+MAX_INCIDENTS = 100_000
+
+
+class AlertCache:
+    def __init__(self, max_incidents=MAX_INCIDENTS):
+        self.max_incidents = max_incidents
+        self.incidents = OrderedDict()
+        self.lock = threading.Lock()
+        self.suppressed = 0
+        self.evicted = 0
+
+    def observe(self, hit, now=None):
+        # Returns (incident, is_new). The incident is a copy that is safe to
+        # serialise outside the lock.
+        now = time.time() if now is None else now
+        key = hit["fingerprint"]
+        with self.lock:
+            incident = self.incidents.get(key)
+            if incident is not None and now - incident["last_seen"] <= hit["suppress_seconds"]:
+                incident["count"] += 1
+                incident["last_seen"] = now
+                incident["message"] = hit["message"]
+                incident["suppress_seconds"] = hit["suppress_seconds"]
+                if "score" in hit:
+                    incident["score"] = hit["score"]
+                self.incidents.move_to_end(key)
+                self.suppressed += 1
+                return dict(incident), False
+            incident = {
+                "id": f"{key}-{int(now * 1000)}",
+                "fingerprint": key,
+                "rule": hit["rule"],
+                "section": hit["section"],
+                "entity": hit["entity"],
+                "message": hit["message"],
+                "first_seen": now,
+                "last_seen": now,
+                "count": 1,
+                "suppress_seconds": hit["suppress_seconds"],
+            }
+            if "score" in hit:
+                incident["score"] = hit["score"]
+            self.incidents[key] = incident
+            self.incidents.move_to_end(key)
+            self._expire(now)
+            return dict(incident), True
+
+    def _expire(self, now):
+        while len(self.incidents) > self.max_incidents:
+            self.incidents.popitem(last=False)
+            self.evicted += 1
+        # Least recently seen first; windows differ per rule, so this stops at
+        # the first live entry rather than scanning the whole cache.
+        while self.incidents:
+            key, incident = next(iter(self.incidents.items()))
+            if now - incident["last_seen"] <= incident["suppress_seconds"]:
+                break
+            del self.incidents[key]
+
+    def load(self, incidents):
+        # Seeds the cache from persisted incidents (oldest first) so a restart
+        # does not reopen everything that is still active.
+        with self.lock:
+            for incident in incidents:
+                self.incidents[incident["fingerprint"]] = dict(incident)
+                self.incidents.move_to_end(incident["fingerprint"])
+            self._expire(time.time())
+
+    def __len__(self):
+        return len(self.incidents)
@@ -1,26 +1,378 @@
 
-from flask import Flask, request, render_template
-from datetime import datetime
-from rules_engine import run_rules
+import atexit
+import hmac
+import json
+import os
+import sys
+import time
+
+# The schema and wire format are shared with the agent and live one level up.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.metrics import BYTES_BUCKETS, REGISTRY
+from common.profiler import SamplingProfiler
+from common.schema import normalize_payload
+from flask import Flask, Response, g, request, render_template
+from datetime import datetime, timezone
+from alerts import AlertCache
+from baseline import BaselineScorer
+from rules_engine import engine, match_rules, payload_entity
+from storage import Store
+from stream import Broadcaster, SummaryPublisher, TooManyClients
+from views import Views
+from ingest import IngestPool, QueueFull, PayloadTooLarge, UnsupportedMediaType, decode_payload, decode_ndjson
+from delta import DeltaDecoder, ResyncRequired
+from shards import Membership, shard_url
+
+STORE_PATH = os.environ.get("INSIDER_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "insider.db"))
+STORE_RECENT = int(os.environ.get("INSIDER_STORE_RECENT", 100))
+STORE_MAX_AGE = float(os.environ.get("INSIDER_STORE_MAX_AGE", 7 * 24 * 3600))
+STORE_MAX_ROWS = int(os.environ.get("INSIDER_STORE_MAX_ROWS", 1_000_000))
+
+INGEST_WORKERS = int(os.environ.get("INSIDER_INGEST_WORKERS", 4))
+INGEST_MAX_BATCHES = int(os.environ.get("INSIDER_INGEST_MAX_BATCHES", 256))
+BATCH_MAX_ITEMS = int(os.environ.get("INSIDER_BATCH_MAX_ITEMS", 1000))
+BATCH_MAX_BYTES = int(os.environ.get("INSIDER_BATCH_MAX_BYTES", 64 * 1024 * 1024))
+RETRY_AFTER = 5
+
+WINDOWS_PATH = os.environ.get("INSIDER_WINDOWS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "windows.json"))
+WINDOWS_CHECKPOINT_INTERVAL = float(os.environ.get("INSIDER_WINDOWS_CHECKPOINT_INTERVAL", 60))
+
+ALERT_CACHE_SIZE = int(os.environ.get("INSIDER_ALERT_CACHE_SIZE", 100_000))
+ALERT_RESTORE_SECONDS = float(os.environ.get("INSIDER_ALERT_RESTORE_SECONDS", 24 * 3600))
+
+BASELINE_PATH = os.environ.get("INSIDER_BASELINE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.npz"))
+BASELINE_INTERVAL = float(os.environ.get("INSIDER_BASELINE_INTERVAL", 5.0))
+BASELINE_CHECKPOINT_INTERVAL = float(os.environ.get("INSIDER_BASELINE_CHECKPOINT_INTERVAL", 300))
+
+STREAM_CLIENT_QUEUE = int(os.environ.get("INSIDER_STREAM_CLIENT_QUEUE", 256))
+STREAM_REPLAY = int(os.environ.get("INSIDER_STREAM_REPLAY", 1000))
+STREAM_MAX_CLIENTS = int(os.environ.get("INSIDER_STREAM_MAX_CLIENTS", 100))
+STREAM_SUMMARY_INTERVAL = float(os.environ.get("INSIDER_STREAM_SUMMARY_INTERVAL", 1.0))
+
+# Set by cluster.py when this process is one shard of a cluster.
+SHARD = os.environ.get("INSIDER_SHARD")
+CLUSTER_TOKEN = os.environ.get("INSIDER_CLUSTER_TOKEN", "")
+
+PROFILE_MAX_SECONDS = 60
+
+# Payload keys that are not collector sections.
+META_KEYS = {"agent_id", "timestamp", "alerts", "collectors", "schema"}
 
 app = Flask(__name__)
-data_store = []
-alert_store = []
+deltas = DeltaDecoder()
+store = Store(STORE_PATH, recent_size=STORE_RECENT, max_age=STORE_MAX_AGE, max_rows=STORE_MAX_ROWS)
+alert_cache = AlertCache(max_incidents=ALERT_CACHE_SIZE)
+alert_cache.load(store.alerts_since(time.time() - ALERT_RESTORE_SECONDS))
+broadcaster = Broadcaster(
+    client_queue_size=STREAM_CLIENT_QUEUE, replay_size=STREAM_REPLAY, max_clients=STREAM_MAX_CLIENTS,
+)
+summaries = SummaryPublisher(broadcaster, interval=STREAM_SUMMARY_INTERVAL)
+views = Views()
+profiler = SamplingProfiler()
+membership = Membership(SHARD) if SHARD is not None else None
+
+REQUESTS = REGISTRY.counter("insider_http_requests_total", "HTTP requests by endpoint and status.",
+                            ("endpoint", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("insider_http_request_seconds", "Time to build each response.", ("endpoint",))
+REQUEST_BYTES = REGISTRY.histogram("insider_http_request_bytes", "Request body size as sent, before inflating.",
+                                   ("endpoint",), BYTES_BUCKETS)
+PROCESS_SECONDS = REGISTRY.histogram("insider_process_payload_seconds", "Time to evaluate and record one payload.")
+RULES_SECONDS = REGISTRY.histogram("insider_rules_seconds", "Rule evaluation time per payload.")
+engine.section_timer = REGISTRY.histogram(
+    "insider_rule_section_seconds", "Rule evaluation time per payload section.", ("section",))
+
+def record_hits(hits):
+    # Returns the incidents that were repeated rather than opened; new ones
+    # are published straight away.
+    updated = []
+    for hit in hits:
+        alert, new = alert_cache.observe(hit)
+        store.add_alert(alert)
+        if new:
+            broadcaster.publish("alert", alert)
+        else:
+            updated.append(alert)
+    return updated
+
+def record_anomalies(hits):
+    updated = record_hits(hits)
+    summaries.add({}, alerts=len(hits), updated=updated, events=0)
+    views.add_alerts(hits)
+
+baseline = BaselineScorer(record_anomalies, interval=BASELINE_INTERVAL)
+
+def process_payload(content):
+    start = time.perf_counter()
+    content = normalize_payload(content)
+    rules_start = time.perf_counter()
+    hits = match_rules(content)
+    RULES_SECONDS.observe(time.perf_counter() - rules_start)
+    updated = []
+    if hits:
+        content["alerts"] = [hit["message"] for hit in hits]
+        updated = record_hits(hits)
+    entity = payload_entity(content)
+    sections = {
+        key: len(value) if isinstance(value, list) else 1
+        for key, value in content.items() if key not in META_KEYS and value
+    }
+    store.add_event(content, user=entity["UserID"], host=entity["MachineName"], sections=sections)
+    summaries.add(sections, alerts=len(hits), updated=updated)
+    views.add(content, entity["MachineName"], sections, hits)
+    baseline.add(entity, content)
+    PROCESS_SECONDS.observe(time.perf_counter() - start)
+
+engine.windows.load(WINDOWS_PATH)
+engine.windows.checkpoint_every(WINDOWS_CHECKPOINT_INTERVAL)
+baseline.load(BASELINE_PATH, checkpoint_interval=BASELINE_CHECKPOINT_INTERVAL)
+ingest = IngestPool(process_payload, workers=INGEST_WORKERS, max_batches=INGEST_MAX_BATCHES)
+atexit.register(store.close)
+atexit.register(engine.windows.close)
+atexit.register(summaries.close)
+atexit.register(baseline.close)
+atexit.register(ingest.close)
+
+REGISTRY.gauge("insider_store_pending_writes", "Rows queued for the store writer.", store.pending.qsize)
+REGISTRY.gauge("insider_store_bytes", "Size of the SQLite database and its WAL.", store.size_bytes)
+REGISTRY.gauge("insider_ingest_queued_batches", "Batches waiting for an ingest worker.", ingest.depth)
+REGISTRY.gauge("insider_alert_incidents", "Incidents held for suppression.", lambda: len(alert_cache))
+REGISTRY.gauge("insider_alerts_suppressed", "Hits folded into an existing incident.", lambda: alert_cache.suppressed)
+REGISTRY.gauge("insider_window_counters", "Sliding-window counters held by windowed rules.",
+               lambda: len(engine.windows.counters))
+REGISTRY.gauge("insider_rules_loaded", "Rules in the active rule table.", lambda: len(engine.compiled.rules))
+REGISTRY.gauge("insider_delta_agents", "Agents with delta state on the server.", lambda: len(deltas.agents))
+REGISTRY.gauge("insider_stream_clients", "Connected /api/stream clients.", lambda: len(broadcaster.clients))
+REGISTRY.gauge("insider_stream_dropped", "Stream events dropped for slow clients.", lambda: broadcaster.dropped)
+REGISTRY.gauge("insider_baseline_entities", "Entities with a behavioural baseline.",
+               lambda: baseline.stats().get("entities"))
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or "unmatched"
+    start = g.get("start")
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, (endpoint,))
+    REQUESTS.inc(labels=(endpoint, str(response.status_code)))
+    if request.content_length:
+        REQUEST_BYTES.observe(request.content_length, (endpoint,))
+    return response
+
+def misdirected():
+    # In a cluster agents may post to their shard directly. A post for an
+    # agent this shard does not own is turned away with the owner's address,
+    # so the agent's state never splits across shards. The router forwards
+    # with its ring version; while a newer ring is on its way here, the
+    # router's choice stands.
+    agent_id = request.headers.get("X-Agent-Id")
+    if membership is None or agent_id is None:
+        return None
+    try:
+        if int(request.headers.get("X-Ring-Version", 0)) > membership.version:
+            return None
+    except ValueError:
+        pass
+    port = membership.redirect(agent_id)
+    if port is None:
+        return None
+    return ({"status": "misdirected"}, 421,
+            {"X-Shard-Url": shard_url(request.scheme, request.host, port, request.path)})
 
 @app.route('/agent', methods=['POST'])
 def receive_data():
-    content = request.json
+    redirect = misdirected()
+    if redirect is not None:
+        return redirect
+    try:
+        message = decode_payload(
+            request.get_data(),
+            content_type=request.mimetype,
+            encoding=request.headers.get("Content-Encoding"),
+            max_bytes=BATCH_MAX_BYTES,
+        )
+    except PayloadTooLarge as e:
+        return {"status": "rejected", "error": str(e)}, 413
+    except UnsupportedMediaType as e:
+        return {"status": "rejected", "error": str(e)}, 415
+    except ValueError as e:
+        return {"status": "rejected", "error": str(e)}, 400
+    try:
+        content = deltas.apply(message)
+    except ResyncRequired:
+        return {"status": "resync"}, 409
+    except ValueError as e:
+        return {"status": "rejected", "error": str(e)}, 400
     content['timestamp'] = datetime.utcnow().isoformat()
-    alerts = run_rules(content)
-    if alerts:
-        content["alerts"] = alerts
-        alert_store.append({"timestamp": content["timestamp"], "alerts": alerts})
-    data_store.append(content)
+    process_payload(content)
     return {"status": "received"}, 200
 
+@app.route('/agent/batch', methods=['POST'])
+def receive_batch():
+    redirect = misdirected()
+    if redirect is not None:
+        return redirect
+    try:
+        payloads = decode_ndjson(
+            request.get_data(),
+            encoding=request.headers.get("Content-Encoding"),
+            max_bytes=BATCH_MAX_BYTES,
+            max_items=BATCH_MAX_ITEMS,
+        )
+    except PayloadTooLarge as e:
+        return {"status": "rejected", "error": str(e)}, 413
+    except ValueError as e:
+        return {"status": "rejected", "error": str(e)}, 400
+
+    if ingest.full():
+        return {"status": "busy"}, 429, {"Retry-After": str(RETRY_AFTER)}
+
+    # Deltas are applied here, in arrival order, so the worker pool only ever
+    # sees complete payloads. An agent that falls out of sync has its deltas
+    # in the rest of this batch dropped, up to its next keyframe, and is told
+    # to send a keyframe. Malformed messages are skipped and counted.
+    timestamp = datetime.utcnow().isoformat()
+    accepted = []
+    resync = set()
+    rejected = 0
+    for message in payloads:
+        header = message.get("delta")
+        if message.get("agent_id") in resync and not (isinstance(header, dict) and header.get("keyframe")):
+            continue
+        try:
+            content = deltas.apply(message)
+        except ResyncRequired:
+            resync.add(message.get("agent_id"))
+            continue
+        except ValueError:
+            rejected += 1
+            continue
+        resync.discard(message.get("agent_id"))
+        content['timestamp'] = timestamp
+        accepted.append(content)
+    try:
+        ingest.submit(accepted)
+    except QueueFull:
+        return {"status": "busy"}, 429, {"Retry-After": str(RETRY_AFTER)}
+    response = {"status": "accepted", "count": len(accepted)}
+    if resync:
+        response["resync"] = sorted(resync, key=str)
+    if rejected:
+        response["rejected"] = rejected
+    return response, 202
+
+def parse_time(value):
+    # Epoch seconds or an ISO 8601 timestamp (naive means UTC).
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    ts = datetime.fromisoformat(value)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+def query_response(query, fields):
+    args = request.args
+    try:
+        rows, cursor = query(
+            since=parse_time(args.get("since")),
+            until=parse_time(args.get("until")),
+            cursor=int(args["cursor"]) if "cursor" in args else None,
+            limit=int(args.get("limit", 100)),
+            **{field: args.get(field) for field in fields},
+        )
+    except ValueError as e:
+        return {"status": "rejected", "error": str(e)}, 400
+    # Stored bodies are already JSON; splice them in rather than re-encoding.
+    # ids lets the sharded router (cluster.py) resume each shard mid-page.
+    body = ('{"items":[' + ",".join(row for _, row in rows) + '],"ids":' + json.dumps([i for i, _ in rows])
+            + ',"next_cursor":' + json.dumps(cursor) + "}")
+    return Response(body, mimetype="application/json")
+
+@app.route('/api/events')
+def api_events():
+    return query_response(store.query_events, ("user", "host", "section"))
+
+@app.route('/api/alerts')
+def api_alerts():
+    return query_response(store.query_alerts, ("user", "host", "section", "rule"))
+
+@app.route('/api/summary')
+def api_summary():
+    return views.summary()
+
+@app.route('/api/stream')
+def api_stream():
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return {"status": "rejected", "error": "Last-Event-ID must be an integer"}, 400
+    try:
+        events = broadcaster.stream(last_event_id)
+    except TooManyClients:
+        return {"status": "busy"}, 503, {"Retry-After": str(RETRY_AFTER)}
+    return Response(events, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/healthz')
+def healthz():
+    if membership is not None:
+        return {"status": "ok", "shard": SHARD, "ring": membership.version}
+    return {"status": "ok"}
+
+@app.route('/cluster/ring', methods=['PUT'])
+def cluster_ring():
+    # The router pushes {"version", "shards": {shard: port}} here whenever the
+    # ring changes. Shards may listen beyond loopback, so only the router,
+    # which holds the cluster token, is answered.
+    if membership is None:
+        return {"status": "rejected", "error": "not a cluster shard"}, 404
+    if not CLUSTER_TOKEN or not hmac.compare_digest(request.headers.get("X-Cluster-Token", ""), CLUSTER_TOKEN):
+        return {"status": "forbidden"}, 403
+    body = request.get_json(silent=True) or {}
+    try:
+        version = int(body["version"])
+        ports = {str(shard): int(port) for shard, port in body["shards"].items()}
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return {"status": "rejected", "error": "expected version and shards"}, 400
+    membership.update(version, ports)
+    return {"status": "ok", "ring": version}
+
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/debug/profile')
+def debug_profile():
+    # Samples every thread for ?seconds= (default 10) and returns collapsed
+    # stacks. Only answered on loopback.
+    if request.remote_addr not in ("127.0.0.1", "::1"):
+        return {"status": "forbidden"}, 403
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:  # Also rejects nan
+            raise ValueError(f"seconds must be more than 0 and at most {PROFILE_MAX_SECONDS}")
+    except ValueError as e:
+        return {"status": "rejected", "error": str(e)}, 400
+    if not profiler.start(seconds):
+        return {"status": "busy", "error": "a profile is already running"}, 409
+    time.sleep(seconds)
+    return Response(profiler.stop(), mimetype="text/plain")
+
+@app.template_filter('isotime')
+def isotime(ts):
+    return datetime.utcfromtimestamp(ts).isoformat(timespec="seconds")
+
 @app.route('/')
 def dashboard():
-    return render_template('index.html', data=data_store[-10:], alerts=alert_store[-10:])
+    return render_template('index.html', summary=views.summary(), alerts=store.recent_alerts(10))
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
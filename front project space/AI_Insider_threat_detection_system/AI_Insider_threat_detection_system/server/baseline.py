@@ -0,0 +1,355 @@
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+from rules_engine import DEFAULT_SUPPRESS_SECONDS, fingerprint
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Per-entity behavioural baselines. Every payload is reduced to one value per
+# feature and queued once for its host (the reporting agent) and once for its
+# user when it names one; the two are separate entities ("host:WS-01",
+# "user:alice"), so a payload without identity never lands in a user's
+# history. A background thread scores the queue as one batch against each
+# entity's history and then folds the batch into that history. State is
+# a set of NumPy arrays with one row per entity: Welford count/mean/M2 for each
+# feature, plus a fixed-bin histogram that serves as the quantile sketch. A
+# value is anomalous once the entity has MIN_SAMPLES of history and the value
+# is both far above the mean and in the sketch's upper tail ("high" features),
+# or falls in a bin the entity has rarely used ("rare" features). State is
+# checkpointed with np.savez so baselines survive a restart.
+MIN_SAMPLES = 20
+Z_THRESHOLD = 4.0
+P_THRESHOLD = 0.05
+MAX_ENTITIES = 100_000
+BATCH_INTERVAL = 5.0
+BINS = 41
+# entity field -> key prefix
+ENTITY_KINDS = {"UserID": "user", "MachineName": "host"}
+
+
+def _total(section, field):
+    def extract(payload):
+        records = payload.get(section)
+        if records is None:
+            return None
+        if isinstance(records, dict):
+            records = (records,)
+        total = 0.0
+        for record in records:
+            try:
+                value = float(record.get(field) or 0)
+            except (TypeError, ValueError):
+                continue
+            if math.isfinite(value):
+                total += value
+        return total
+    return extract
+
+
+def _count(section):
+    def extract(payload):
+        records = payload.get(section)
+        return None if records is None else float(len(records))
+    return extract
+
+
+def _logon_hour(payload):
+    identity = payload.get("identity")
+    if isinstance(identity, list):
+        identity = identity[-1] if identity else None
+    try:
+        text = str((identity or {})["Timestamp"])
+    except KeyError:
+        return None
+    try:
+        ts = datetime.fromisoformat(text)
+    except ValueError:
+        # Agents before ISO timestamps sent the event log's "%c" text.
+        try:
+            ts = datetime.strptime(text, "%c")
+        except ValueError:
+            return None
+    return ts.hour + ts.minute / 60
+
+
+# name -> (section, extractor, kind, sketch bin edges)
+# BINS - 1 edges make BINS bins: below 0, then one per edge upwards.
+VOLUME_EDGES = [0.0] + [10 ** (i / 4) for i in range(BINS - 2)]  # 1 .. 1e9.5
+FEATURES = {
+    "upload_volume": ("email_cloud", _total("email_cloud", "UploadVolume"), "high", VOLUME_EDGES),
+    "usb_volume": ("usb", _total("usb", "DataTransferVolume"), "high", VOLUME_EDGES),
+    "bytes_sent": ("network", _total("network", "BytesSent"), "high", VOLUME_EDGES),
+    "process_count": ("processes", _count("processes"), "high", VOLUME_EDGES),
+    "logon_hour": ("identity", _logon_hour, "rare", list(range(1, 24))),
+}
+FEATURE_NAMES = tuple(FEATURES)
+
+
+class Baseline:
+    # The batch state. score() and update() take a batch as an array of
+    # entity rows and a (rows, features) array of values, NaN where a payload
+    # had nothing for a feature, and never loop over it in Python.
+    def __init__(self, max_entities=MAX_ENTITIES, min_samples=MIN_SAMPLES,
+                 z_threshold=Z_THRESHOLD, p_threshold=P_THRESHOLD):
+        self.max_entities = max_entities
+        self.min_samples = min_samples
+        self.z_threshold = z_threshold
+        self.p_threshold = p_threshold
+        self.rows = {}
+        self.untracked = 0
+        features = len(FEATURE_NAMES)
+        self.high = np.array([FEATURES[f][2] == "high" for f in FEATURE_NAMES])
+        self.edges = [np.array(FEATURES[f][3], dtype=np.float64) for f in FEATURE_NAMES]
+        self.count = np.zeros((0, features), dtype=np.float64)
+        self.mean = np.zeros((0, features), dtype=np.float64)
+        self.m2 = np.zeros((0, features), dtype=np.float64)
+        self.hist = np.zeros((0, features, BINS), dtype=np.uint32)
+
+    def _grow(self, size):
+        capacity = len(self.count)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 64)
+        for name in ("count", "mean", "m2", "hist"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def lookup(self, keys):
+        # Entity rows for a batch, allocating rows for new entities; -1 once
+        # max_entities are tracked.
+        rows = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            row = self.rows.get(key)
+            if row is None:
+                if len(self.rows) >= self.max_entities:
+                    self.untracked += 1
+                    row = -1
+                else:
+                    row = self.rows[key] = len(self.rows)
+            rows[i] = row
+        self._grow(len(self.rows))
+        return rows
+
+    def bins(self, values):
+        result = np.zeros(values.shape, dtype=np.int64)
+        for f, edges in enumerate(self.edges):
+            result[:, f] = np.searchsorted(edges, np.nan_to_num(values[:, f]), side="right")
+        return result
+
+    def score(self, rows, values):
+        # Returns (anomalous, score, z) arrays shaped like values. The score
+        # is -log10 of the smoothed sketch probability, so higher is rarer.
+        n = self.count[rows]
+        mean = self.mean[rows]
+        std = np.sqrt(np.divide(self.m2[rows], n - 1, out=np.zeros_like(n), where=n > 1))
+        # Entities whose history is nearly constant would otherwise turn any
+        # change into an enormous z.
+        z = (values - mean) / np.maximum(std, 0.1 * np.abs(mean) + 1.0)
+
+        bins = self.bins(values)
+        hist = self.hist[rows].astype(np.float64)
+        at_or_above = np.cumsum(hist[:, :, ::-1], axis=2)[:, :, ::-1]
+        index = bins[:, :, None]
+        tail = np.take_along_axis(at_or_above, index, axis=2)[:, :, 0]
+        same = np.take_along_axis(hist, index, axis=2)[:, :, 0]
+        observed = np.where(self.high, tail, same)
+        probability = (observed + 1) / (n + 1)
+
+        ready = ~np.isnan(values) & (n >= self.min_samples)
+        anomalous = ready & (probability <= self.p_threshold) & (~self.high | (z >= self.z_threshold))
+        return anomalous, -np.log10(probability), z
+
+    def update(self, rows, values):
+        # Folds the batch into each entity's statistics with Chan's parallel
+        # form of Welford's update, so an entity seen several times in one
+        # batch is merged once.
+        present = ~np.isnan(values)
+        unique, inverse = np.unique(rows, return_inverse=True)
+        shape = (len(unique), values.shape[1])
+        batch_n = np.zeros(shape)
+        batch_sum = np.zeros(shape)
+        np.add.at(batch_n, inverse, present)
+        np.add.at(batch_sum, inverse, np.where(present, values, 0.0))
+        batch_mean = np.divide(batch_sum, batch_n, out=np.zeros(shape), where=batch_n > 0)
+        deviation = np.where(present, values - batch_mean[inverse], 0.0)
+        batch_m2 = np.zeros(shape)
+        np.add.at(batch_m2, inverse, deviation ** 2)
+
+        n = self.count[unique]
+        total = n + batch_n
+        safe_total = np.maximum(total, 1)
+        delta = batch_mean - self.mean[unique]
+        mean = self.mean[unique] + delta * batch_n / safe_total
+        m2 = self.m2[unique] + batch_m2 + delta ** 2 * n * batch_n / safe_total
+        seen = batch_n > 0
+        self.mean[unique] = np.where(seen, mean, self.mean[unique])
+        self.m2[unique] = np.where(seen, m2, self.m2[unique])
+        self.count[unique] = total
+
+        hit_rows, hit_features = np.nonzero(present)
+        np.add.at(self.hist, (rows[hit_rows], hit_features, self.bins(values)[hit_rows, hit_features]), 1)
+
+    def save(self, f):
+        size = len(self.rows)
+        keys = sorted(self.rows, key=self.rows.get)
+        np.savez_compressed(
+            f, features=np.array(FEATURE_NAMES), entities=np.array(keys, dtype=str),
+            count=self.count[:size], mean=self.mean[:size], m2=self.m2[:size], hist=self.hist[:size],
+        )
+
+    def load(self, f):
+        with np.load(f, allow_pickle=False) as data:
+            if tuple(data["features"]) != FEATURE_NAMES or data["hist"].shape[2] != BINS:
+                raise ValueError("baseline file was written for a different feature set")
+            prefixes = tuple(f"{kind}:" for kind in ENTITY_KINDS.values())
+            if not all(str(key).startswith(prefixes) for key in data["entities"]):
+                raise ValueError("baseline file predates separate user and host baselines")
+            self.rows = {str(key): row for row, key in enumerate(data["entities"])}
+            self.count = data["count"].copy()
+            self.mean = data["mean"].copy()
+            self.m2 = data["m2"].copy()
+            self.hist = data["hist"].copy()
+
+
+class BaselineScorer:
+    # Queues one feature row per payload and scores the queue every interval
+    # (or once it reaches batch_size) on a background thread. Anomalies are
+    # handed to on_hits as rule-style hits, so they go through the same
+    # incident suppression as rule alerts. Without NumPy the scorer is a no-op.
+    def __init__(self, on_hits, interval=BATCH_INTERVAL, batch_size=10_000, **options):
+        self.on_hits = on_hits
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.pending = []
+        self.path = None
+        self.checkpointed = time.time()
+        self.checkpoint_interval = None
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        if np is None:
+            print("[-] NumPy is not installed; behavioural baselines are disabled")
+            self.baseline = None
+            return
+        self.baseline = Baseline(**options)
+        self.thread = threading.Thread(target=self._run, name="baseline", daemon=True)
+        self.thread.start()
+
+    def add(self, entity, payload):
+        if self.baseline is None:
+            return
+        keyed = [(field, entity.get(field)) for field in ENTITY_KINDS if entity.get(field) is not None]
+        if not keyed:
+            return
+        values = [FEATURES[name][1](payload) for name in FEATURE_NAMES]
+        if all(v is None for v in values):
+            return
+        with self.lock:
+            for field, value in keyed:
+                self.pending.append((f"{ENTITY_KINDS[field]}:{value}", {field: value}, values))
+            if len(self.pending) >= self.batch_size:
+                self.ready.set()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return []
+        keys = [key for key, _, _ in pending]
+        values = np.array([v for _, _, v in pending], dtype=np.float64)  # None becomes NaN
+        with self.state_lock:
+            rows = self.baseline.lookup(keys)
+            tracked = rows >= 0
+            rows, values = rows[tracked], values[tracked]
+            entities = [entity for (_, entity, _), keep in zip(pending, tracked) if keep]
+            anomalous, score, z = self.baseline.score(rows, values)
+            mean = self.baseline.mean[rows]
+            self.baseline.update(rows, values)
+        hits = [
+            self._hit(entities[i], f, values[i, f], score[i, f], z[i, f], mean[i, f])
+            for i, f in zip(*np.nonzero(anomalous))
+        ]
+        if hits:
+            self.on_hits(hits)
+        return hits
+
+    def _hit(self, entity, f, value, score, z, mean):
+        name = FEATURE_NAMES[f]
+        section, _, kind, _ = FEATURES[name]
+        rule = f"baseline.{name}"
+        field, key = next(iter(entity.items()))
+        who = f"{ENTITY_KINDS[field]} {key}"
+        if kind == "high":
+            message = (f"{name} of {value:g} for {who} is {z:.1f} standard deviations above "
+                       f"its baseline mean of {mean:.1f} (score {score:.1f})")
+        else:
+            message = f"Unusual {name} of {value:.1f} for {who} (score {score:.1f})"
+        return {
+            "fingerprint": fingerprint(rule, entity),
+            "rule": rule,
+            "section": section,
+            "entity": entity,
+            "message": message,
+            "score": round(float(score), 2),
+            "suppress_seconds": DEFAULT_SUPPRESS_SECONDS,
+        }
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.ready.wait(self.interval)
+            self.ready.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[-] Failed to score baselines: {e}")
+            if self.checkpoint_interval and time.time() - self.checkpointed >= self.checkpoint_interval:
+                try:
+                    self.checkpoint()
+                except OSError as e:
+                    print(f"[-] Failed to checkpoint baselines: {e}")
+
+    def load(self, path, checkpoint_interval=None):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        if self.baseline is None:
+            return
+        try:
+            with open(path, "rb") as f, self.state_lock:
+                self.baseline.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[-] Ignoring baseline file {path}: {e}")
+
+    def checkpoint(self):
+        self.checkpointed = time.time()
+        if self.baseline is None or self.path is None:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f, self.state_lock:
+            self.baseline.save(f)
+        os.replace(tmp, self.path)
+
+    def stats(self):
+        if self.baseline is None:
+            return {"enabled": False}
+        return {"enabled": True, "entities": len(self.baseline.rows), "untracked": self.baseline.untracked,
+                "pending": len(self.pending)}
+
+    def close(self):
+        self.stopped.set()
+        self.ready.set()
+        if self.baseline is None:
+            return
+        self.thread.join()
+        self.flush()
+        self.checkpoint()
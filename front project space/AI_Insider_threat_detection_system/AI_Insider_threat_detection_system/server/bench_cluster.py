@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from bench_ingest import http_sender, run_load, synthetic_payload
+
+# Ingest throughput of cluster.py as the shard count grows, with agents posting
+# through the router and straight to their shards. Each row starts a fresh
+# cluster on scratch state and reports payloads/s and the router's CPU seconds
+# per payload; a routed cluster cannot go faster than one router process can
+# forward, a direct one is bounded by the shards (and the cores they get).
+#
+#   python bench_cluster.py --workers 1 2 4 8 --duration 20
+
+
+def cpu_seconds(pid):
+    # utime + stime from /proc; None where that is not available.
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def wait_ready(url, workers, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/healthz", timeout=2) as response:
+                if json.load(response)["shards"] == workers:
+                    return
+        except (OSError, ValueError, KeyError):
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"[-] Cluster with {workers} shards did not come up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cluster ingest throughput, routed and direct.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=19000)
+    parser.add_argument("--agents", type=int, default=200)
+    parser.add_argument("--records", type=int, default=5, help="records per list section")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per run")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    bodies = [(f"WORKSTATION-{agent:04d}", json.dumps(synthetic_payload(rng, agent, args.records, 0.05)).encode())
+              for agent in range(args.agents)]
+    url = f"http://127.0.0.1:{args.port}"
+
+    print(f"[+] {os.cpu_count()} CPUs, {args.agents} agents, {len(bodies[0][1]) / 1024:.1f} KB per payload")
+    print(f"{'shards':>6} {'mode':>7} {'payloads/s':>11} {'p50 ms':>7} {'router ms/payload':>18}")
+    for workers in args.workers:
+        env = dict(os.environ, INSIDER_CLUSTER_DIR=tempfile.mkdtemp(prefix="bench_cluster_"))
+        router = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cluster.py"),
+             "--workers", str(workers), "--host", "127.0.0.1", "--port", str(args.port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(url, workers)
+            for direct in (False, True):
+                send = http_sender(url + "/agent", timeout=10, direct=direct)
+                cpu_start = cpu_seconds(router.pid)
+                latencies, statuses, elapsed = run_load(send, bodies, args.duration, 0, 0, args.concurrency)
+                cpu_end = cpu_seconds(router.pid)
+                delivered = statuses.get("200", 0)
+                router_ms = (cpu_end - cpu_start) * 1000 / delivered if cpu_start is not None and delivered else None
+                p50 = sorted(latencies)[len(latencies) // 2] if latencies else 0.0
+                print(f"{workers:>6} {'direct' if direct else 'routed':>7} {delivered / elapsed:>11.1f} "
+                      f"{p50:>7.1f} {router_ms if router_ms is not None else float('nan'):>18.3f}")
+        finally:
+            router.terminate()
+            router.wait(timeout=60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from rules_engine import RuleEngine
+from test import data
+
+# Load generator for the ingest path. Payloads follow the test.py schema, one
+# identity per simulated agent, with `records` entries in every list section
+# and `hit_rate` of them crossing a rule threshold. The app is driven either
+# in-process through Flask's test client (with throwaway state) or over
+# HTTP against a running server, optionally paced to a target rate. Over HTTP
+# each simulated agent sends X-Agent-Id and, like the agent, posts straight to
+# the shard a cluster names in X-Shard-Url (--no-direct keeps every post on
+# --url, i.e. through the cluster router).
+#
+#   python bench_ingest.py --agents 200 --duration 30 --output run.json
+#   python bench_ingest.py --mode http --rate 100 --server-pid 1234 --baseline run.json
+
+# Environment variables naming the app's on-disk state (see app.py).
+STATE_FILES = {
+    "INSIDER_STORE_PATH": "insider.db",
+    "INSIDER_WINDOWS_PATH": "windows.json",
+    "INSIDER_BASELINE_PATH": "baseline.npz",
+}
+
+SECTIONS = ("processes", "files", "network", "registry", "usb", "email_cloud", "av_alerts", "clipboard_screen")
+
+# Field values that make a record cross its rule, and benign ones that don't.
+HOT = {
+    "processes": {"CPUUsage": 95, "MemoryUsage": 2048},
+    "files": {"OperationType": "delete", "FileSizeBefore": 5_000_000},
+    "network": {"BytesSent": 50_000},
+    "registry": {"OperationType": "modify"},
+    "usb": {"DataTransferVolume": 900},
+    "email_cloud": {"UploadVolume": 9000, "EmailSubject": "confidential plans"},
+    "av_alerts": {"Severity": "high"},
+    "clipboard_screen": {"ClipboardEvent": "copy", "ScreenCaptureTrigger": "PrintScreen"},
+}
+COLD = {
+    "processes": {"CPUUsage": 2, "MemoryUsage": 150},
+    "files": {"OperationType": "read", "SensitivityLabel": "Public", "FileSizeBefore": 1000},
+    "network": {"BytesSent": 200},
+    "registry": {"OperationType": "read"},
+    "usb": {"DataTransferVolume": 10},
+    "email_cloud": {"UploadVolume": 10, "EmailSubject": "lunch"},
+    "av_alerts": {"Severity": "low"},
+    "clipboard_screen": {"ClipboardEvent": "paste", "ScreenCaptureTrigger": ""},
+}
+
+
+def synthetic_payload(rng, agent, records, hit_rate):
+    host = f"WORKSTATION-{agent:04d}"
+    payload = {"agent_id": host}
+    identity = dict(data["identity"], UserID=f"user{agent:04d}", MachineName=host,
+                    Timestamp=datetime.utcnow().isoformat())
+    hot = rng.random() < hit_rate
+    identity.update(
+        {"AuthResult": "failure", "MFAUsed": "no", "LogonType": "remote"} if hot
+        else {"AuthResult": "success", "MFAUsed": "yes", "LogonType": "interactive"}
+    )
+    payload["identity"] = identity
+    for section in SECTIONS:
+        template = data[section][0]
+        entries = []
+        for i in range(records):
+            record = copy.copy(template)
+            record.update(HOT[section] if rng.random() < hit_rate else COLD[section])
+            if section == "processes":
+                record.update(PID=1000 + i, ProcessName=f"proc{i}.exe")
+            elif section == "network":
+                record.update(SourcePort=40000 + i, DestIP=f"10.0.{i // 250}.{i % 250}")
+            elif section == "files":
+                record["FilePath"] = f"C:\\Users\\{identity['UserID']}\\file{i}.docx"
+            entries.append(record)
+        payload[section] = entries
+    return payload
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def rss_mb(pid=None):
+    # Resident set size from /proc; None where that is not available.
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def time_rules(payloads):
+    # run_rules cost per payload, on a separate engine so window state from
+    # this measurement does not leak into the load run.
+    engine = RuleEngine()
+    timings = []
+    for payload in payloads:
+        start = time.perf_counter()
+        engine.evaluate(payload)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def in_process_sender():
+    # The app opens its store and loads windows and baselines at import time,
+    # and checkpoints them on exit, so every state path is pointed at a
+    # scratch directory first; a benchmark must never touch a deployment's
+    # state, even when the environment names it.
+    scratch = tempfile.mkdtemp(prefix="bench_ingest_")
+    for variable, name in STATE_FILES.items():
+        os.environ[variable] = os.path.join(scratch, name)
+    import app as server
+
+    local = threading.local()
+
+    def send(agent_id, body):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = server.app.test_client()
+        response = client.post("/agent", data=body, headers={"Content-Type": "application/json"})
+        return response.status_code
+
+    return send, server
+
+
+def http_sender(url, timeout, direct=True):
+    import requests
+
+    local = threading.local()
+    shards = {}
+
+    def send(agent_id, body):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        headers = {"Content-Type": "application/json", "X-Agent-Id": agent_id}
+        for attempt in (0, 1):
+            target = shards.get(agent_id, url)
+            try:
+                response = session.post(target, data=body, timeout=timeout, headers=headers)
+            except requests.RequestException:
+                if target == url or attempt:
+                    return "error"
+                shards.pop(agent_id, None)
+                continue
+            if direct and response.headers.get("X-Shard-Url"):
+                shards[agent_id] = response.headers["X-Shard-Url"]
+            elif response.status_code == 421:
+                shards.pop(agent_id, None)
+            if response.status_code != 421:
+                break
+        return response.status_code
+
+    return send
+
+
+def run_load(send, bodies, duration, max_payloads, rate, concurrency):
+    # Workers take payload slots in order; with a rate, slot i is not sent
+    # before start + i / rate, so the schedule stays fixed even when
+    # responses are slow.
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    next_slot = [0]
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def worker():
+        while True:
+            with lock:
+                slot = next_slot[0]
+                next_slot[0] += 1
+            if max_payloads and slot >= max_payloads:
+                return
+            if rate:
+                delay = start + slot / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if time.perf_counter() >= deadline:
+                return
+            sent = time.perf_counter()
+            status = send(*bodies[slot % len(bodies)])
+            elapsed = (time.perf_counter() - sent) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def summarize(values):
+    return {
+        "p50": percentile(values, 50),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+        "mean": sum(values) / len(values) if values else None,
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    rows = [
+        ("throughput/s", results["throughput"], baseline.get("throughput")),
+        ("latency p50 ms", results["latency_ms"]["p50"], baseline.get("latency_ms", {}).get("p50")),
+        ("latency p99 ms", results["latency_ms"]["p99"], baseline.get("latency_ms", {}).get("p99")),
+        ("rules p50 ms", results["rules_ms"]["p50"], baseline.get("rules_ms", {}).get("p50")),
+        ("rss growth MB", results["rss_mb"]["growth"], baseline.get("rss_mb", {}).get("growth")),
+    ]
+    print(f"{'metric':<16} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, current, before in rows:
+        if current is None or not before:
+            print(f"{name:<16} {before!s:>10} {current!s:>10}")
+            continue
+        print(f"{name:<16} {before:>10.2f} {current:>10.2f} {current / before:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the ingest endpoint with synthetic agent payloads.")
+    parser.add_argument("--mode", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--url", default="http://localhost:5000/agent")
+    parser.add_argument("--direct", action=argparse.BooleanOptionalAction, default=True,
+                        help="http mode: follow X-Shard-Url to post to cluster shards directly")
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--records", type=int, default=20, help="records per list section")
+    parser.add_argument("--hit-rate", type=float, default=0.05, help="fraction of records that trigger a rule")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--payloads", type=int, default=0, help="stop after this many payloads (0: no limit)")
+    parser.add_argument("--rate", type=float, default=0.0, help="target payloads per second (0: unpaced)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--server-pid", type=int, help="sample this process's RSS in http mode")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="compare against a previous --output file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    payloads = [synthetic_payload(rng, agent, args.records, args.hit_rate) for agent in range(args.agents)]
+    bodies = [(p["agent_id"], json.dumps(p).encode()) for p in payloads]
+    rules = time_rules(payloads)
+
+    if args.mode == "inprocess":
+        send, server = in_process_sender()
+        pid = None
+    else:
+        send, server = http_sender(args.url, args.timeout, args.direct), None
+        pid = args.server_pid
+    rss_start = rss_mb(pid)
+
+    print(f"[+] {args.mode}: {args.agents} agents, {args.records} records per section, "
+          f"{len(bodies[0][1]) / 1024:.1f} KB per payload")
+    latencies, statuses, elapsed = run_load(
+        send, bodies, args.duration, args.payloads, args.rate, args.concurrency)
+    rss_end = rss_mb(pid)
+
+    results = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "payload_bytes": sum(len(b) for _, b in bodies) / len(bodies),
+        "sent": len(latencies),
+        "status": statuses,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": summarize(latencies),
+        "rules_ms": summarize(rules),
+        "rss_mb": {
+            "start": rss_start,
+            "end": rss_end,
+            "growth": rss_end - rss_start if rss_start is not None and rss_end is not None else None,
+        },
+    }
+    if server is not None:
+        results["store_pending"] = server.store.pending.qsize()
+
+    lat, rul = results["latency_ms"], results["rules_ms"]
+    print(f"[+] {results['sent']} payloads in {elapsed:.1f}s: {results['throughput']:.1f}/s, status {statuses}")
+    if lat["p50"] is not None:
+        print(f"[+] latency p50 {lat['p50']:.2f} ms, p99 {lat['p99']:.2f} ms, max {lat['max']:.2f} ms")
+    print(f"[+] run_rules p50 {rul['p50']:.3f} ms, p99 {rul['p99']:.3f} ms per payload")
+    if rss_start is not None and rss_end is not None:
+        print(f"[+] RSS {rss_start:.1f} MB -> {rss_end:.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[+] Results written to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+    if not results["sent"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
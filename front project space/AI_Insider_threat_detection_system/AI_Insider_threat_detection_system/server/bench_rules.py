@@ -0,0 +1,120 @@
+import argparse
+import copy
+import time
+
+from rules_engine import RuleEngine, compile_rules, load_rules
+from test import data
+
+
+def legacy_run_rules(payload):
+    # The hand-written run_rules this engine replaced, kept as the baseline.
+    alerts = []
+
+    identity = payload.get("identity", {})
+    if identity.get("AuthResult") == "failure":
+        alerts.append(f"Failed login for user {identity.get('UserID', 'Unknown')} on {identity.get('MachineName', 'Unknown')}")
+    if identity.get("MFAUsed") == "no":
+        alerts.append(f"MFA not used by {identity.get('UserID', 'Unknown')}")
+    if identity.get("LogonType") != "interactive":
+        alerts.append(f"Non-interactive logon detected via {identity.get('LogonSource', 'Unknown')}")
+
+    for proc in payload.get("processes", []):
+        if proc.get("CPUUsage", 0) > 80:
+            alerts.append(f"High CPU usage by process {proc.get('ProcessName', 'Unknown')} ({proc.get('PID')})")
+        if proc.get("MemoryUsage", 0) > 1000:
+            alerts.append(f"High memory usage by {proc.get('ProcessName', 'Unknown')} ({proc.get('PID')})")
+
+    for f in payload.get("files", []):
+        if f.get("SensitivityLabel") == "Confidential" and f.get("AccessResult") == "allowed":
+            alerts.append(f"Confidential file accessed: {f.get('FilePath', 'Unknown')}")
+        if f.get("OperationType") == "delete" and int(f.get("FileSizeBefore", 0)) > 1e6:
+            alerts.append(f"Large file deleted: {f.get('FilePath', 'Unknown')}")
+
+    for net in payload.get("network", []):
+        if net.get("DestIP") not in ["127.0.0.1", "localhost"] and net.get("BytesSent", 0) > 5000:
+            alerts.append(f"Large external connection to {net.get('DestIP', 'Unknown')} (DNS: {net.get('DNSQuery', '')})")
+
+    for reg in payload.get("registry", []):
+        if reg.get("OperationType") in ["delete", "modify"]:
+            alerts.append(f"Registry {reg.get('OperationType')} on {reg.get('KeyPath', '')}\\{reg.get('ValueName', '')}")
+
+    for usb in payload.get("usb", []):
+        if usb.get("DataTransferVolume", 0) > 500:
+            alerts.append(f"Large data transfer ({usb.get('DataTransferVolume')} MB) to USB {usb.get('USBDeviceID')} ({usb.get('MountPoint')})")
+
+    for e in payload.get("email_cloud", []):
+        if int(e.get("UploadVolume", 0)) > 5000:
+            alerts.append(f"Large upload ({e.get('UploadVolume')} KB) via {e.get('ApplicationName', '')}")
+        if "confidential" in e.get("EmailSubject", "").lower():
+            alerts.append(f"Potential exfiltration of confidential data via email: {e.get('EmailSubject')}")
+
+    for av in payload.get("av_alerts", []):
+        if av.get("Severity") == "high":
+            alerts.append(f"High severity alert: {av.get('AlertID')} involving {av.get('InvolvedFile')}")
+
+    for clip in payload.get("clipboard_screen", []):
+        if clip.get("ClipboardEvent") in ["copy", "cut"]:
+            alerts.append(f"Clipboard activity detected: {clip.get('ClipboardEvent')} of {clip.get('ClipboardContentMeta', '')}")
+        if clip.get("ScreenCaptureTrigger"):
+            alerts.append(f"Screen capture triggered: {clip.get('ScreenCaptureTrigger')}")
+
+    return alerts
+
+
+def scaled_payload(records):
+    # Scales the test.py payload to `records` process and network entries,
+    # with one in ten of them crossing a threshold.
+    payload = copy.deepcopy(data)
+    proc = payload["processes"][0]
+    net = payload["network"][0]
+    payload["processes"] = []
+    payload["network"] = []
+    for i in range(records):
+        hot = i % 10 == 0
+        p = dict(proc, PID=1000 + i, ProcessName=f"proc{i}.exe")
+        p["CPUUsage"] = 92 if hot else 5
+        p["MemoryUsage"] = 1024 if hot else 200
+        payload["processes"].append(p)
+        n = dict(net, SourcePort=40000 + i % 20000)
+        n["BytesSent"] = 6000 if hot else 100
+        n["DestIP"] = "8.8.8.8" if i % 3 else "127.0.0.1"
+        payload["network"].append(n)
+    return payload
+
+
+def stateless_engine():
+    # Windowed rules keep state across calls and have no legacy counterpart,
+    # so the comparison runs a fresh engine with only the other rules.
+    engine = RuleEngine()
+    engine.compiled = compile_rules([rule for rule in load_rules() if "window" not in rule])
+    return engine
+
+
+def timeit(fn, payload, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(payload)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the compiled rule engine against the legacy run_rules.")
+    parser.add_argument("--records", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = stateless_engine()
+    print(f"{'records':>8} {'legacy ms':>10} {'compiled ms':>12} {'speedup':>8}")
+    for n in args.records:
+        payload = scaled_payload(n)
+        if engine.evaluate(payload) != legacy_run_rules(payload):
+            raise SystemExit(f"[-] Compiled rules disagree with legacy run_rules at {n} records")
+        legacy = timeit(legacy_run_rules, payload, args.repeat)
+        compiled = timeit(engine.evaluate, payload, args.repeat)
+        print(f"{n:>8} {legacy * 1000:>10.2f} {compiled * 1000:>12.2f} {legacy / compiled:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
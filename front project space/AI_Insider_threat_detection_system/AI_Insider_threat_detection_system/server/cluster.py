@@ -0,0 +1,636 @@
+import argparse
+import http.client
+import json
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode
+
+# The schema and wire format are shared with the agent and live one level up.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.metrics import REGISTRY
+from flask import Flask, Response, request, render_template
+from ingest import PayloadTooLarge, UnsupportedMediaType, decode_ndjson, decode_payload, encode_ndjson
+from shards import HashRing, decode_cursor, merge_pages, merge_summaries, shard_url
+from stream import Broadcaster, SummaryPublisher, TooManyClients
+
+# Production ingest mode for large fleets, on one box with no broker:
+#
+#   python cluster.py --workers 8 --port 5000
+#
+# Each shard is a worker process running app.py on its own port (base port + 1
+# + shard) with its own store, windows and baselines under
+# INSIDER_CLUSTER_DIR/<shard>. This process is the router. Agents are assigned
+# to shards by consistent hashing on the agent id (the X-Agent-Id header, i.e.
+# the machine name), so every agent's delta, window, alert and baseline state
+# lives on one shard. Reads fan out to every shard and are merged; the live
+# stream is every shard's stream relayed through one broadcaster.
+#
+# Agent posts sent to the router are forwarded as raw bytes, and the answer
+# names the owning shard in X-Shard-Url. With --direct (the default) shards
+# listen on --host as well, and agents post straight to that URL from then on,
+# so ingest is spread over the shard processes instead of queueing behind the
+# router. Shards get the ring from the router and answer posts for agents
+# they do not own with 421 and the owner's URL; an agent that cannot reach
+# its shard goes back through the router.
+#
+# Shards that die are taken off the ring and restarted, and POST
+# /cluster/scale changes the shard count; either way only the agents whose
+# owner changed move. A moved agent's next delta is answered 409 by its new
+# shard (which has no delta state for it), so the agent sends a keyframe and
+# carries on; window and baseline history for moved agents restarts on the
+# new shard. Shards removed by scaling down leave the ring but keep serving
+# reads until retention has emptied them (or they are scaled back in).
+#
+# A merged read that some shards cannot answer returns what the others have,
+# with "partial": true and the missing shards under "unavailable"; only when
+# no shard answers is it a 503.
+CLUSTER_DIR = os.environ.get("INSIDER_CLUSTER_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "shards"))
+HEALTH_INTERVAL = 1.0
+RESTART_BACKOFF_MAX = 30.0
+RETIRED_CHECK_INTERVAL = 300.0
+FORWARD_TIMEOUT = 30.0
+RETRY_AFTER = 5
+AGENT_HEADERS = ("Content-Type", "Content-Encoding", "X-Agent-Id")
+WILDCARD_HOSTS = {"0.0.0.0": "127.0.0.1", "::": "::1", "": "127.0.0.1"}
+
+FORWARDED = REGISTRY.counter("insider_router_forwarded_total", "Agent posts forwarded, by shard and status.",
+                             ("shard", "status"))
+FORWARD_SECONDS = REGISTRY.histogram("insider_router_forward_seconds", "Time for a shard to answer a forwarded post.",
+                                     ("shard",))
+FANOUT_SECONDS = REGISTRY.histogram("insider_router_fanout_seconds", "Time to answer a merged read.", ("endpoint",))
+PARTIAL_READS = REGISTRY.counter("insider_router_partial_reads_total", "Merged reads missing at least one shard.",
+                                 ("endpoint",))
+
+
+class ShardUnavailable(Exception):
+    pass
+
+
+class Worker:
+    def __init__(self, shard, port, retired=False):
+        self.shard = shard
+        self.port = port
+        self.process = None
+        self.healthy = False
+        self.retired = retired
+        self.stopping = False
+        self.restarts = 0
+        self.restart_at = 0.0
+        self.checked_at = 0.0
+        self.relay = None
+
+
+class Cluster:
+    # Supervises the worker processes and owns the ring. Healthy workers that
+    # are not retired are on the ring; every worker holds data for reads.
+    def __init__(self, base_port, host="127.0.0.1", direct=False, vnodes=None):
+        self.base_port = base_port
+        self.host = host if direct else "127.0.0.1"
+        self.connect_host = WILDCARD_HOSTS.get(self.host, self.host)
+        self.direct = direct
+        self.token = secrets.token_hex(16)
+        self.workers = {}
+        self.ring = HashRing() if vnodes is None else HashRing(vnodes=vnodes)
+        self.version = 0
+        self.lock = threading.Lock()
+        self.ring_lock = threading.Lock()
+        self.local = threading.local()
+        self.broadcaster = Broadcaster()
+        self.summaries = SummaryPublisher(self.broadcaster)
+        self.stopped = threading.Event()
+        self.monitor = threading.Thread(target=self._monitor, name="cluster-monitor", daemon=True)
+
+    def start(self, count):
+        self.scale(count)
+        # Shards left behind by a larger cluster still hold data; they come
+        # back retired and serve reads until retention empties them.
+        names = os.listdir(CLUSTER_DIR) if os.path.isdir(CLUSTER_DIR) else ()
+        with self.lock:
+            for name in sorted(names, key=lambda n: int(n) if n.isdigit() else -1):
+                if name.isdigit() and name not in self.workers and \
+                        os.path.exists(os.path.join(CLUSTER_DIR, name, "insider.db")):
+                    worker = self.workers[name] = Worker(name, self.base_port + 1 + int(name), retired=True)
+                    self._spawn(worker)
+        self.monitor.start()
+
+    def scale(self, count):
+        with self.lock:
+            changed = []
+            for i in range(count):
+                shard = str(i)
+                worker = self.workers.get(shard)
+                if worker is None:
+                    worker = self.workers[shard] = Worker(shard, self.base_port + 1 + i)
+                    self._spawn(worker)
+                elif worker.retired:
+                    worker.retired = False
+                    changed.append(worker)
+            for shard, worker in self.workers.items():
+                if int(shard) >= count and not worker.retired:
+                    worker.retired = True
+                    worker.checked_at = 0.0
+                    changed.append(worker)
+        # Retired shards only leave the ring: they keep their data and answer
+        # reads until the monitor finds them empty.
+        for worker in changed:
+            self._set_healthy(worker, worker.healthy)
+
+    def _spawn(self, worker):
+        worker.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "worker", "--shard", worker.shard,
+             "--host", self.host, "--port", str(worker.port)],
+            env=dict(os.environ, INSIDER_CLUSTER_TOKEN=self.token))
+        worker.healthy = False
+        print(f"[+] Started shard {worker.shard} on port {worker.port} (pid {worker.process.pid})")
+
+    def _stop(self, worker):
+        # Off the ring first so no new posts arrive, then a clean shutdown so
+        # the shard's store and windows are flushed.
+        worker.stopping = True
+        self._set_healthy(worker, False)
+        worker.process.terminate()
+        try:
+            worker.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            worker.process.kill()
+        print(f"[+] Stopped shard {worker.shard}")
+
+    def _set_healthy(self, worker, healthy):
+        with self.ring_lock:
+            worker.healthy = healthy
+            if healthy and (worker.relay is None or not worker.relay.is_alive()):
+                worker.relay = threading.Thread(target=self._relay, args=(worker,), daemon=True)
+                worker.relay.start()
+            member = healthy and not worker.retired and not worker.stopping
+            if member == (worker.shard in self.ring.nodes):
+                return
+            if member:
+                self.ring.add(worker.shard)
+            else:
+                self.ring.remove(worker.shard)
+            self.version += 1
+        print(f"[+] Shard {worker.shard} {'joined' if member else 'left'} the ring ({len(self.ring)} shards)")
+        if self.stopped.is_set():
+            return
+        with self.lock:
+            workers = [w for w in self.workers.values() if w.healthy]
+        for w in workers:
+            self._push_ring(w)
+
+    def _push_ring(self, worker):
+        # Shards check direct posts against their copy of the ring; the
+        # monitor re-pushes to any shard whose copy is behind.
+        with self.ring_lock:
+            body = {"version": self.version,
+                    "shards": {s: self.workers[s].port for s in self.ring.nodes if s in self.workers}}
+        try:
+            self.request(worker, "PUT", "/cluster/ring", json.dumps(body),
+                         {"Content-Type": "application/json", "X-Cluster-Token": self.token}, timeout=5)
+        except ShardUnavailable as e:
+            print(f"[-] {e}")
+
+    def _drained(self, worker):
+        # True once retention has emptied a retired shard.
+        for path in ("/api/events?limit=1", "/api/alerts?limit=1"):
+            status, _, body = self.request(worker, "GET", path, timeout=30)
+            if status != 200 or json.loads(body)["items"]:
+                return False
+        return True
+
+    def _monitor(self):
+        while not self.stopped.wait(HEALTH_INTERVAL):
+            with self.lock:
+                workers = list(self.workers.values())
+            for worker in workers:
+                if worker.stopping:
+                    continue
+                if worker.process.poll() is not None:
+                    self._set_healthy(worker, False)
+                    now = time.monotonic()
+                    if not worker.restart_at:
+                        worker.restart_at = now + min(RESTART_BACKOFF_MAX, 2 ** worker.restarts)
+                        print(f"[-] Shard {worker.shard} exited with {worker.process.returncode}")
+                    elif now >= worker.restart_at:
+                        worker.restarts += 1
+                        worker.restart_at = 0.0
+                        self._spawn(worker)
+                    continue
+                try:
+                    status, _, body = self.request(worker, "GET", "/healthz", timeout=5)
+                    healthy = status == 200
+                    ring = json.loads(body).get("ring") if healthy else None
+                except (ShardUnavailable, ValueError):
+                    healthy, ring = False, None
+                self._set_healthy(worker, healthy)
+                if healthy and ring != self.version:
+                    self._push_ring(worker)
+                if healthy and worker.retired and time.monotonic() >= worker.checked_at:
+                    worker.checked_at = time.monotonic() + RETIRED_CHECK_INTERVAL
+                    self._retire_if_drained(worker)
+
+    def _retire_if_drained(self, worker):
+        try:
+            if not self._drained(worker):
+                return
+        except (ShardUnavailable, ValueError, KeyError):
+            return
+        with self.lock:
+            if not worker.retired or self.workers.get(worker.shard) is not worker:
+                return
+            del self.workers[worker.shard]
+        self._stop(worker)
+        print(f"[+] Retired shard {worker.shard} is empty and was removed")
+
+    def _connection(self, worker, timeout):
+        # One keep-alive connection per thread and shard.
+        connections = getattr(self.local, "connections", None)
+        if connections is None:
+            connections = self.local.connections = {}
+        conn = connections.get(worker.port)
+        if conn is None:
+            conn = connections[worker.port] = http.client.HTTPConnection(self.connect_host, worker.port,
+                                                                         timeout=timeout)
+        conn.timeout = timeout
+        return conn
+
+    def request(self, worker, method, path, body=None, headers=None, timeout=FORWARD_TIMEOUT):
+        # Returns (status, headers, body). A dropped keep-alive connection is
+        # retried once on a fresh one.
+        for attempt in (0, 1):
+            conn = self._connection(worker, timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                return response.status, dict(response.getheaders()), response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self.local.connections.pop(worker.port, None)
+                if attempt:
+                    raise ShardUnavailable(f"shard {worker.shard}: {e}")
+
+    def owner(self, key):
+        shard = self.ring.owner(key)
+        return self.workers.get(shard) if shard is not None else None
+
+    def readable(self):
+        # Every shard that holds data, retired ones included.
+        with self.lock:
+            return [w for w in self.workers.values() if not w.stopping]
+
+    def fan_out(self, method, path, workers=None):
+        # ({shard: (status, body)}, [unavailable shards]) over every shard
+        # holding data, in parallel. Shards that are down or fail with a 5xx
+        # count as unavailable; callers serve what the rest returned.
+        workers = self.readable() if workers is None else workers
+        live = [w for w in workers if w.healthy]
+        unavailable = [w.shard for w in workers if not w.healthy]
+        with ThreadPoolExecutor(max_workers=max(1, len(live))) as pool:
+            futures = {w.shard: pool.submit(self.request, w, method, path(w) if callable(path) else path)
+                       for w in live}
+        results = {}
+        for shard, future in futures.items():
+            try:
+                status, _, body = future.result()
+            except ShardUnavailable as e:
+                print(f"[-] {e}")
+                unavailable.append(shard)
+                continue
+            if status >= 500:
+                unavailable.append(shard)
+                continue
+            results[shard] = (status, body)
+        return results, sorted(unavailable, key=int)
+
+    def _relay(self, worker):
+        # Republishes a shard's live stream: alerts as they are, summaries
+        # folded into the router's own per-interval summary.
+        while worker.healthy and not self.stopped.is_set():
+            try:
+                conn = http.client.HTTPConnection(self.connect_host, worker.port, timeout=60)
+                conn.request("GET", "/api/stream")
+                response = conn.getresponse()
+                event, data = None, []
+                for raw in response:
+                    line = raw.decode().rstrip("\r\n")
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:"):
+                        data.append(line[5:].strip())
+                    elif not line and event is not None:
+                        self._republish(event, json.loads("\n".join(data) or "{}"))
+                        event, data = None, []
+                    if not worker.healthy:
+                        break
+                conn.close()
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                print(f"[-] Stream from shard {worker.shard} interrupted: {e}")
+            time.sleep(1)
+
+    def _republish(self, event, data):
+        if event == "alert":
+            self.broadcaster.publish("alert", data)
+        elif event == "summary":
+            self.summaries.add(data.get("sections", {}), alerts=data.get("alerts", 0),
+                               updated=data.get("updated", ()), events=data.get("events", 0))
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            self._stop(worker)
+        self.summaries.close()
+
+    def status(self):
+        shares = self.ring.shares()
+        with self.lock:
+            workers = list(self.workers.values())
+        return {"ring": self.version, "direct": self.direct, "workers": [
+            {"shard": w.shard, "port": w.port, "pid": w.process.pid if w.process else None,
+             "healthy": w.healthy, "retired": w.retired, "restarts": w.restarts,
+             "share": round(shares.get(w.shard, 0.0), 4)}
+            for w in workers
+        ]}
+
+
+router = Flask(__name__)
+cluster = None
+
+def agent_key(body):
+    # The routing key of a post without an X-Agent-Id header.
+    try:
+        message = decode_payload(body, content_type=request.mimetype,
+                                 encoding=request.headers.get("Content-Encoding"))
+    except (ValueError, PayloadTooLarge, UnsupportedMediaType):
+        return None
+    identity = message.get("identity")
+    if isinstance(identity, list):
+        identity = identity[-1] if identity else None
+    return message.get("agent_id") or (identity or {}).get("MachineName")
+
+def forward(worker, path, body, headers, advertise=False):
+    # advertise: name the shard in X-Shard-Url so the agent can post to it
+    # directly next time.
+    if worker is None:
+        return {"status": "busy", "error": "no shard available"}, 503, {"Retry-After": str(RETRY_AFTER)}
+    start = time.perf_counter()
+    headers = dict(headers, **{"X-Ring-Version": str(cluster.version)})
+    try:
+        status, response_headers, data = cluster.request(worker, "POST", path, body, headers)
+    except ShardUnavailable as e:
+        print(f"[-] {e}")
+        FORWARDED.inc(labels=(worker.shard, "unavailable"))
+        return {"status": "busy", "error": "shard unavailable"}, 503, {"Retry-After": str(RETRY_AFTER)}
+    FORWARD_SECONDS.observe(time.perf_counter() - start, (worker.shard,))
+    FORWARDED.inc(labels=(worker.shard, str(status)))
+    passed = {k: v for k, v in response_headers.items()
+              if k.lower() in ("content-type", "retry-after", "x-shard-url")}
+    if advertise and cluster.direct and status < 300:
+        passed["X-Shard-Url"] = shard_url(request.scheme, request.host, worker.port, path)
+    return Response(data, status=status, headers=passed)
+
+@router.route('/agent', methods=['POST'])
+def receive_data():
+    body = request.get_data()
+    key = request.headers.get("X-Agent-Id") or agent_key(body)
+    headers = {h: request.headers[h] for h in AGENT_HEADERS if h in request.headers}
+    return forward(cluster.owner(key), "/agent", body, headers, advertise="X-Agent-Id" in headers)
+
+@router.route('/agent/batch', methods=['POST'])
+def receive_batch():
+    body = request.get_data()
+    headers = {h: request.headers[h] for h in AGENT_HEADERS if h in request.headers}
+    key = request.headers.get("X-Agent-Id")
+    if key is not None:
+        return forward(cluster.owner(key), "/agent/batch", body, headers, advertise=True)
+
+    # Without a header the batch may mix agents, so it is split by owner.
+    # Groups are forwarded independently: if some shards take theirs and
+    # others fail, the answer is still 202 with the positions of the failed
+    # payloads under "failed", so the agent resends only those and nothing is
+    # ingested twice. Only when no group got through is the failure passed on.
+    try:
+        payloads = decode_ndjson(body, encoding=request.headers.get("Content-Encoding"))
+    except PayloadTooLarge as e:
+        return {"status": "rejected", "error": str(e)}, 413
+    except ValueError as e:
+        return {"status": "rejected", "error": str(e)}, 400
+    groups = {}
+    for position, payload in enumerate(payloads):
+        worker = cluster.owner(payload.get("agent_id"))
+        if worker is None:
+            return {"status": "busy", "error": "no shard available"}, 503, {"Retry-After": str(RETRY_AFTER)}
+        worker, group, positions = groups.setdefault(worker.shard, (worker, [], []))
+        group.append(payload)
+        positions.append(position)
+    headers = {"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+    count, rejected, resync, failed, failure = 0, 0, set(), [], None
+    for worker, group, positions in groups.values():
+        response = forward(worker, "/agent/batch", encode_ndjson(group), headers)
+        status = response.status_code if isinstance(response, Response) else response[1]
+        if status == 202:
+            result = json.loads(response.get_data())
+            count += result.get("count", 0)
+            rejected += result.get("rejected", 0)
+            resync.update(result.get("resync", ()))
+        elif status in (421, 429) or status >= 500:
+            failed.extend(positions)
+            failure = response
+        else:
+            rejected += len(group)  # Refused by the shard; resending will not help
+    if failed and len(failed) == len(payloads):
+        return failure  # Nothing got through; the agent retries the whole segment
+    response = {"status": "accepted", "count": count}
+    if resync:
+        response["resync"] = sorted(resync, key=str)
+    if rejected:
+        response["rejected"] = rejected
+    if failed:
+        response["failed"] = sorted(failed)
+        return response, 202, {"Retry-After": str(RETRY_AFTER)}
+    return response, 202
+
+def unavailable_response(unavailable):
+    return ({"status": "busy", "error": "no shard answered", "unavailable": unavailable},
+            503, {"Retry-After": str(RETRY_AFTER)})
+
+def merged_query(path, key):
+    start = time.perf_counter()
+    args = request.args.to_dict()
+    try:
+        limit = int(args.get("limit", 100))
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        cursors = decode_cursor(args.pop("cursor")) if "cursor" in args else None
+    except ValueError as e:
+        return {"status": "rejected", "error": str(e)}, 400
+
+    def query(worker):
+        shard_args = dict(args)
+        if cursors is not None and cursors[worker.shard] is not None:
+            shard_args["cursor"] = cursors[worker.shard]
+        return f"{path}?{urlencode(shard_args)}"
+
+    workers = [w for w in cluster.readable() if cursors is None or w.shard in cursors]
+    results, unavailable = cluster.fan_out("GET", query, workers)
+    if unavailable and not results:
+        return unavailable_response(unavailable)
+    pages = {}
+    for shard, (status, body) in results.items():
+        if status != 200:
+            # A rejected query is rejected by every shard alike.
+            return Response(body, status=status, mimetype="application/json")
+        page = json.loads(body)
+        page["cursor"] = cursors[shard] if cursors is not None else None
+        pages[shard] = page
+    # Shards that did not answer keep their place in the cursor, so paging on
+    # picks them up once they are back.
+    pending = {shard: cursors[shard] if cursors is not None else None for shard in unavailable}
+    items, cursor = merge_pages(pages, limit, key, pending)
+    FANOUT_SECONDS.observe(time.perf_counter() - start, (path,))
+    response = {"items": items, "next_cursor": cursor}
+    if unavailable:
+        PARTIAL_READS.inc(labels=(path,))
+        response.update(partial=True, unavailable=unavailable)
+    return response
+
+@router.route('/api/events')
+def api_events():
+    return merged_query("/api/events", "timestamp")
+
+@router.route('/api/alerts')
+def api_alerts():
+    return merged_query("/api/alerts", "first_seen")
+
+def merged_summary():
+    # (summary, unavailable shards); the summary says when it is partial.
+    start = time.perf_counter()
+    results, unavailable = cluster.fan_out("GET", "/api/summary")
+    summary = merge_summaries([json.loads(body) for status, body in results.values() if status == 200])
+    FANOUT_SECONDS.observe(time.perf_counter() - start, ("/api/summary",))
+    if unavailable:
+        PARTIAL_READS.inc(labels=("/api/summary",))
+        summary.update(partial=True, unavailable=unavailable)
+    return summary, unavailable
+
+@router.route('/api/summary')
+def api_summary():
+    summary, unavailable = merged_summary()
+    if unavailable and not summary["shards"]:
+        return unavailable_response(unavailable)
+    return summary
+
+@router.route('/api/stream')
+def api_stream():
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return {"status": "rejected", "error": "Last-Event-ID must be an integer"}, 400
+    try:
+        events = cluster.broadcaster.stream(last_event_id)
+    except TooManyClients:
+        return {"status": "busy"}, 503, {"Retry-After": str(RETRY_AFTER)}
+    return Response(events, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.route('/cluster')
+def cluster_status():
+    return cluster.status()
+
+@router.route('/cluster/scale', methods=['POST'])
+def cluster_scale():
+    # ?workers=N; only answered on loopback.
+    if request.remote_addr not in ("127.0.0.1", "::1"):
+        return {"status": "forbidden"}, 403
+    try:
+        count = int(request.args["workers"])
+    except (KeyError, ValueError):
+        return {"status": "rejected", "error": "workers must be an integer"}, 400
+    if count < 1:
+        return {"status": "rejected", "error": "workers must be at least 1"}, 400
+    cluster.scale(count)
+    return cluster.status()
+
+@router.route('/healthz')
+def healthz():
+    return {"status": "ok", "shards": len(cluster.ring)}
+
+@router.route('/metrics')
+def metrics():
+    # The router's own metrics; each shard serves its own on the port listed
+    # by /cluster.
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@router.template_filter('isotime')
+def isotime(ts):
+    return datetime.utcfromtimestamp(ts).isoformat(timespec="seconds")
+
+@router.route('/')
+def dashboard():
+    alerts = merged_query("/api/alerts", "first_seen")
+    alerts = list(reversed(alerts["items"])) if isinstance(alerts, dict) else []
+    summary, _ = merged_summary()
+    return render_template('index.html', summary=summary, alerts=alerts)
+
+def run_worker(shard, host, port):
+    directory = os.path.join(CLUSTER_DIR, shard)
+    os.makedirs(directory, exist_ok=True)
+    os.environ["INSIDER_SHARD"] = shard
+    os.environ["INSIDER_STORE_PATH"] = os.path.join(directory, "insider.db")
+    os.environ["INSIDER_WINDOWS_PATH"] = os.path.join(directory, "windows.json")
+    os.environ["INSIDER_BASELINE_PATH"] = os.path.join(directory, "baseline.npz")
+    from werkzeug.serving import make_server
+    import app as server
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    httpd = make_server(host, port, server.app, threaded=True)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+
+def main():
+    global cluster
+    parser = argparse.ArgumentParser(description="Run the server as a router over N shard processes.")
+    parser.add_argument("role", nargs="?", choices=("router", "worker"), default="router")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--direct", action=argparse.BooleanOptionalAction, default=True,
+                        help="shards listen on --host too and agents post to them directly")
+    parser.add_argument("--shard", help="worker role: shard name")
+    args = parser.parse_args()
+    if args.role == "worker":
+        run_worker(args.shard, args.host, args.port)
+        return
+
+    from werkzeug.serving import make_server
+
+    cluster = Cluster(base_port=args.port, host=args.host, direct=args.direct)
+    cluster.start(args.workers)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    httpd = make_server(args.host, args.port, router, threaded=True)
+    print(f"[+] Routing on {args.host}:{args.port} over {args.workers} shards")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        cluster.close()
+
+
+if __name__ == "__main__":
+    main()
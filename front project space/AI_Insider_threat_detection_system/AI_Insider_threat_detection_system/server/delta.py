@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+
+
+class ResyncRequired(Exception):
+    pass
+
+
+class _AgentState:
+    __slots__ = ("seq", "lists", "values")
+
+    def __init__(self):
+        self.seq = 0
+        self.lists = {}
+        self.values = {}
+
+
+class DeltaDecoder:
+    # Rebuilds each agent's full payload from the delta messages produced by
+    # the agent's DeltaEncoder. Payloads without a "delta" header are passed
+    # through untouched so plain JSON posts keep working.
+    def __init__(self, max_agents=10_000):
+        self.max_agents = max_agents
+        self.agents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def apply(self, message):
+        # Raises ValueError for a malformed delta message, and ResyncRequired
+        # when the message does not follow the state held for its agent.
+        header = message.get("delta")
+        if header is None:
+            return message
+        agent_id = message.get("agent_id")
+        changes = message.get("changes", {})
+        self._check(agent_id, header, changes)
+        with self.lock:
+            state = self.agents.get(agent_id)
+            if header.get("keyframe"):
+                state = _AgentState()
+            elif state is None or header["seq"] != state.seq + 1:
+                self.agents.pop(agent_id, None)
+                raise ResyncRequired(agent_id)
+            try:
+                self._apply_changes(state, changes)
+            except ResyncRequired:
+                # Half applied; the agent sends a keyframe next.
+                self.agents.pop(agent_id, None)
+                raise
+            state.seq = header["seq"]
+            self.agents[agent_id] = state
+            self.agents.move_to_end(agent_id)
+            if len(self.agents) > self.max_agents:
+                self.agents.popitem(last=False)
+            payload = {section: list(records.values()) for section, records in state.lists.items()}
+            payload.update(state.values)
+        payload["agent_id"] = agent_id
+        return payload
+
+    @staticmethod
+    def _check(agent_id, header, changes):
+        if not isinstance(agent_id, str):
+            raise ValueError("delta message needs a string agent_id")
+        if not isinstance(header, dict) or type(header.get("seq")) is not int \
+                or not isinstance(header.get("keyframe", False), bool):
+            raise ValueError("delta header must be {\"seq\": int, \"keyframe\": bool}")
+        if not isinstance(changes, dict):
+            raise ValueError("delta changes must be an object")
+        for section, diff in changes.items():
+            if not isinstance(diff, dict):
+                raise ValueError(f"delta for {section} must be an object")
+            removed = diff.get("removed", [])
+            if not isinstance(removed, list) or not all(isinstance(key, str) for key in removed):
+                raise ValueError(f"removed keys for {section} must be a list of strings")
+            for name in ("changed", "added"):
+                entries = diff.get(name, [])
+                if not isinstance(entries, list) or not all(
+                        isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], str)
+                        for entry in entries):
+                    raise ValueError(f"{name} records for {section} must be [key, record] pairs")
+
+    @staticmethod
+    def _apply_changes(state, changes):
+        # A record removed or changed that was never added means the agent
+        # diffed against state this decoder does not have.
+        for section, diff in changes.items():
+            if diff.get("drop"):
+                state.lists.pop(section, None)
+                state.values.pop(section, None)
+            elif "set" in diff:
+                state.values[section] = diff["set"]
+            else:
+                records = state.lists.setdefault(section, {})
+                for key in diff.get("removed", ()):
+                    if records.pop(key, None) is None:
+                        raise ResyncRequired(section)
+                for key, record in diff.get("changed", ()):
+                    if key not in records:
+                        raise ResyncRequired(section)
+                    records[key] = record
+                for key, record in diff.get("added", ()):
+                    records[key] = record
@@ -0,0 +1,119 @@
+import gzip
+import json
+import queue
+import threading
+import zlib
+
+from common import wire
+
+
+class QueueFull(Exception):
+    pass
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class UnsupportedMediaType(Exception):
+    pass
+
+
+def inflate(body, encoding=None, max_bytes=64 * 1024 * 1024):
+    # Decompression is capped at max_bytes so a small gzip bomb cannot blow
+    # up server memory.
+    if encoding == "gzip":
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(body, max_bytes)
+        except zlib.error as e:
+            raise ValueError(f"invalid gzip body: {e}")
+        if inflater.unconsumed_tail:
+            raise PayloadTooLarge(f"body exceeds {max_bytes} bytes when decompressed")
+    elif encoding not in (None, "", "identity"):
+        raise ValueError(f"unsupported Content-Encoding {encoding!r}")
+    elif len(body) > max_bytes:
+        raise PayloadTooLarge(f"body exceeds {max_bytes} bytes")
+    return body
+
+
+def decode_json(body, encoding=None, max_bytes=64 * 1024 * 1024):
+    payload = json.loads(inflate(body, encoding, max_bytes))
+    if not isinstance(payload, dict):
+        raise ValueError("payload must be a JSON object")
+    return payload
+
+
+def decode_payload(body, content_type=None, encoding=None, max_bytes=64 * 1024 * 1024):
+    # JSON or MessagePack by Content-Type; a missing type is taken as JSON.
+    content_type = content_type or wire.JSON
+    if content_type == wire.JSON:
+        return decode_json(body, encoding, max_bytes)
+    if not wire.available(content_type):
+        raise UnsupportedMediaType(f"unsupported Content-Type {content_type!r}")
+    return wire.decode(inflate(body, encoding, max_bytes), content_type)
+
+
+def decode_ndjson(body, encoding=None, max_bytes=64 * 1024 * 1024, max_items=1000):
+    body = inflate(body, encoding, max_bytes)
+    payloads = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        if len(payloads) >= max_items:
+            raise PayloadTooLarge(f"batch exceeds {max_items} payloads")
+        payload = json.loads(line)
+        if not isinstance(payload, dict):
+            raise ValueError("each batch line must be a JSON object")
+        payloads.append(payload)
+    return payloads
+
+
+def encode_ndjson(payloads, compress=True):
+    body = "\n".join(json.dumps(p) for p in payloads).encode()
+    return gzip.compress(body) if compress else body
+
+
+class IngestPool:
+    # Batches are queued whole and evaluated by a fixed pool of worker threads.
+    # The queue is bounded in batches; a full queue raises QueueFull so the
+    # endpoint can answer 429 instead of buffering without limit.
+    def __init__(self, process, workers=4, max_batches=256):
+        self.process = process
+        self.batches = queue.Queue(maxsize=max_batches)
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run, name=f"ingest-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, payloads):
+        try:
+            self.batches.put_nowait(payloads)
+        except queue.Full:
+            raise QueueFull()
+
+    def depth(self):
+        return self.batches.qsize()
+
+    def full(self):
+        return self.batches.full()
+
+    def _run(self):
+        while True:
+            payloads = self.batches.get()
+            if payloads is None:
+                break
+            for payload in payloads:
+                try:
+                    self.process(payload)
+                except Exception as e:
+                    print(f"[-] Failed to process payload: {e}")
+            self.batches.task_done()
+
+    def close(self):
+        self.batches.join()
+        for _ in self.threads:
+            self.batches.put(None)
+        for t in self.threads:
+            t.join()
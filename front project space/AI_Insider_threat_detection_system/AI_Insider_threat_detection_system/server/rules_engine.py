@@ -1,61 +1,400 @@
+import hashlib
+import json
+import os
+import string
+import time
+
+from windows import DEFAULT_BUCKETS, WindowStore
+
+# Rules are declared in rules.json and compiled once into one generated Python
+# function per section. Each record is visited a single time, only the rules of
+# its own section run against it, and messages are only formatted on a hit.
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+RELOAD_CHECK_INTERVAL = 1.0
+
+# Structured alerts are fingerprinted by rule id plus the values of the rule's
+# "entity" fields; repeats of a fingerprint within "suppress_seconds" are one
+# incident (see alerts.py).
+DEFAULT_ENTITY = ("UserID", "MachineName")
+DEFAULT_SUPPRESS_SECONDS = 3600
+
+CASTS = {
+    "int": "int",
+    "float": "float",
+    "str": "str",
+}
+
+COMPARISONS = {
+    "eq": "==",
+    "ne": "!=",
+    "gt": ">",
+    "ge": ">=",
+    "lt": "<",
+    "le": "<=",
+    "in": "in",
+    "not_in": "not in",
+}
+
+
+LITERAL_TYPES = (str, int, float, bool, type(None))
+
+
+class _Namespace:
+    # Plain scalars are emitted as literals so they compile to constants; any
+    # other value is bound to a name in the generated module's globals.
+    def __init__(self):
+        self.values = {}
+
+    def add(self, value, quote=None):
+        # Inside an f-string field (pre-3.12) a literal may not contain the
+        # enclosing quote character or a backslash.
+        text = repr(value)
+        inline = text not in ("nan", "inf", "-inf") and not (quote and (quote in text or "\\" in text))
+        if type(value) in LITERAL_TYPES and inline:
+            return text
+        if type(value) is frozenset and all(type(v) in LITERAL_TYPES for v in value):
+            return "{" + ", ".join(self.add(v) for v in value) + "}" if value else "frozenset()"
+        name = f"c{len(self.values)}"
+        self.values[name] = value
+        return name
+
+
+# Operators that raise on None, so a field sent as null has to be replaced by
+# the rule's default (or fail the condition when there is none) first.
+NONE_UNSAFE = {"gt", "ge", "lt", "le", "icontains"}
+
+
+def _condition_source(cond, ns):
+    field = ns.add(cond["field"])
+    op = cond["op"]
+    default = cond.get("default")
+    guard = None
+    if "cast" not in cond and op not in NONE_UNSAFE:
+        expr = f"record.get({field}, {ns.add(default)})"
+    elif default is None:
+        guard = f"(value := record.get({field})) is not None"
+        expr = "value"
+    else:
+        expr = f"({ns.add(default)} if (value := record.get({field})) is None else value)"
+    if "cast" in cond:
+        expr = f"{CASTS[cond['cast']]}({expr})"
+
+    if op in ("in", "not_in"):
+        test = f"{expr} {COMPARISONS[op]} {ns.add(frozenset(cond['value']))}"
+    elif op in COMPARISONS:
+        test = f"{expr} {COMPARISONS[op]} {ns.add(cond['value'])}"
+    elif op == "icontains":
+        test = f"{ns.add(cond['value'].lower())} in {expr}.lower()"
+    elif op == "truthy":
+        test = expr
+    else:
+        raise ValueError(f"Unknown operator {op!r} on field {cond['field']!r}")
+    return f"{guard} and {test}" if guard else test
+
+
+def _message_source(template, defaults, ns):
+    # "{Field}" placeholders become f-string fields over record.get() calls.
+    parts = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        if literal:
+            parts.append(repr(literal))
+        if field is None:
+            continue
+        key = ns.add(field, quote='"')
+        default = ns.add(defaults.get(field), quote='"')
+        expr = f"record.get({key}, {default})"
+        if conversion:
+            expr += f"!{conversion}"
+        if spec:
+            expr += ":{" + ns.add(spec, quote='"') + "}"
+        parts.append('f"{' + expr + '}"')
+    return " ".join(parts) or "''"
+
+
+def _section_source(name, rules, ns, structured=False):
+    # rules is a list of (index, rule, window), where window is the position of
+    # the rule's spec in the windowed table or None. Windowed rules queue
+    # (window, record) with observe() instead of alerting directly; the queue
+    # is folded into the windows once the sections have run. The plain
+    # variant appends message strings; the structured one calls
+    # emit(rule index, record, message).
+    lines = [
+        f"def {name}(records, {'emit' if structured else 'append'}, observe):",
+        "    for record in records:",
+    ]
+    for index, rule, window in rules:
+        conditions = [_condition_source(c, ns) for c in rule.get("when", [])]
+        test = " and ".join(f"({c})" for c in conditions) or "True"
+        lines.append(f"        if {test}:")
+        if window is not None:
+            lines.append(f"            observe(({window}, record))")
+            continue
+        message = _message_source(rule["message"], rule.get("defaults", {}), ns)
+        if structured:
+            lines.append(f"            emit({index}, record, {message})")
+        else:
+            lines.append(f"            append({message})")
+    return "\n".join(lines)
+
+
+def _rule_meta(rule):
+    if "window" in rule:
+        entity = (rule["window"]["by"],)
+    else:
+        entity = tuple(rule.get("entity", DEFAULT_ENTITY))
+    return {
+        "id": rule["id"],
+        "section": rule["section"],
+        "entity": entity,
+        "suppress_seconds": rule.get("suppress_seconds", DEFAULT_SUPPRESS_SECONDS),
+    }
+
+
+def fingerprint(rule_id, entity):
+    text = json.dumps([rule_id, entity], sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def _window_spec(index, rule):
+    window = dict(rule["window"])
+    window.setdefault("buckets", DEFAULT_BUCKETS)
+    if "gt" not in window and "baseline" not in window:
+        raise ValueError(f"Windowed rule {rule['id']!r} needs a 'gt' threshold or a 'baseline'")
+    if "baseline" in window:
+        window["baseline"] = dict(window["baseline"])
+        window["baseline"].setdefault("buckets", 30)
+    return {
+        "id": rule["id"],
+        "rule": index,
+        "window": window,
+        "message": rule["message"],
+        "defaults": rule.get("defaults", {}),
+    }
+
+
+class _WindowFields:
+    __slots__ = ("extra", "record", "defaults")
+
+    def __init__(self, extra, record, defaults):
+        self.extra = extra
+        self.record = record
+        self.defaults = defaults
+
+    def __getitem__(self, key):
+        if key in self.extra:
+            return self.extra[key]
+        if key in self.record:
+            return self.record[key]
+        return self.defaults.get(key)
+
+
+def payload_entity(payload):
+    # The user and host a payload belongs to. The host is the reporting agent;
+    # an identity record's MachineName is the logon's workstation, which for
+    # network and remote logons is the remote client, so it is only used for
+    # payloads without an agent_id. The user comes from the most recent
+    # identity record.
+    identity = payload.get("identity")
+    if isinstance(identity, list):
+        identity = identity[-1] if identity else None
+    identity = identity or {}
+    return {
+        "UserID": identity.get("UserID"),
+        "MachineName": payload.get("agent_id") or identity.get("MachineName"),
+    }
+
+
+class CompiledRules:
+    # table and structured hold (section, function, windowed) where windowed
+    # says whether the section has windowed rules and needs observe().
+    def __init__(self, table, structured, windowed, rules, source):
+        self.table = table
+        self.structured = structured
+        self.windowed = windowed
+        self.rules = rules
+        self.source = source
+
+
+def compile_rules(rules):
+    by_section = {}
+    seen = set()
+    windowed = []
+    for index, rule in enumerate(rules):
+        if rule["id"] in seen:
+            raise ValueError(f"Duplicate rule id {rule['id']!r}")
+        seen.add(rule["id"])
+        window = None
+        if "window" in rule:
+            window = len(windowed)
+            windowed.append(_window_spec(index, rule))
+        by_section.setdefault(rule["section"], []).append((index, rule, window))
+
+    ns = _Namespace()
+    sources = []
+    names = []
+    for i, (section, section_rules) in enumerate(by_section.items()):
+        name = f"section_{i}"
+        names.append((section, name))
+        sources.append(_section_source(name, section_rules, ns))
+        sources.append(_section_source(name + "_structured", section_rules, ns, structured=True))
+
+    source = "\n\n".join(sources)
+    scope = dict(ns.values)
+    exec(compile(source, "<rules>", "exec"), scope)
+    has_windows = {section for section, rules in by_section.items() if any(w is not None for _, _, w in rules)}
+    return CompiledRules(
+        table=tuple((section, scope[name], section in has_windows) for section, name in names),
+        structured=tuple((section, scope[name + "_structured"], section in has_windows) for section, name in names),
+        windowed=tuple(windowed),
+        rules=tuple(_rule_meta(rule) for rule in rules),
+        source=source,
+    )
+
+
+def load_rules(path=RULES_FILE):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class RuleEngine:
+    def __init__(self, path=RULES_FILE, windows=None):
+        self.path = path
+        self.windows = windows if windows is not None else WindowStore()
+        # Optional histogram that match() reports per-section run time to.
+        self.section_timer = None
+        self.mtime = None
+        self.next_check = 0.0
+        self.compiled = CompiledRules((), (), (), (), "")
+        self.reload()
+
+    def reload(self):
+        # Window state is keyed by rule id, so it carries over a reload.
+        mtime = os.path.getmtime(self.path)
+        self.compiled = compile_rules(load_rules(self.path))
+        self.mtime = mtime
+
+    def maybe_reload(self):
+        # Rules are hot-reloaded when rules.json changes on disk. A broken edit
+        # keeps the previously compiled table active.
+        now = time.monotonic()
+        if now < self.next_check:
+            return False
+        self.next_check = now + RELOAD_CHECK_INTERVAL
+        try:
+            if os.path.getmtime(self.path) == self.mtime:
+                return False
+            self.reload()
+            print(f"[+] Reloaded rules from {self.path}")
+            return True
+        except Exception as e:
+            print(f"[-] Failed to reload rules: {e}")
+            return False
+
+    def _observe(self, windowed, observed, payload, emit, now):
+        # Adds the queued (window, record) pairs to their windows and calls
+        # emit(rule index, record, message, key) when a window crosses its
+        # threshold.
+        entity = None
+        for index, record in observed:
+            spec = windowed[index]
+            window = spec["window"]
+            by = window["by"]
+            key = record.get(by)
+            if key is None:
+                if entity is None:
+                    entity = payload_entity(payload)
+                key = entity.get(by)
+            value = 1 if "sum" not in window else float(record.get(window["sum"]) or 0)
+            before, total = self.windows.add(spec["id"], key, value, window["seconds"], window["buckets"], now)
+            extra = {"key": key, "total": total, "norm": None}
+
+            threshold = window.get("gt")
+            baseline = window.get("baseline")
+            if baseline is not None:
+                history, _ = self.windows.add(
+                    spec["id"] + "#baseline", key, value, baseline["seconds"], baseline["buckets"], now)
+                if history < baseline.get("min_total", 0):
+                    continue
+                norm = history / (baseline["seconds"] / window["seconds"])
+                extra["norm"] = round(norm, 2)
+                threshold = max(threshold or 0, norm * baseline.get("factor", 1))
+            if before <= threshold < total:
+                emit(spec["rule"], record, spec["message"].format_map(_WindowFields(extra, record, spec["defaults"])), key)
+
+    def evaluate(self, payload, now=None):
+        # Alert messages as plain strings; windowed alerts come last.
+        compiled = self.compiled
+        alerts = []
+        append = alerts.append
+        observed = []
+        for section, run, windowed in compiled.table:
+            records = payload.get(section)
+            if records is None:
+                continue
+            if isinstance(records, dict):
+                records = (records,)
+            run(records, append, observed.append if windowed else None)
+        if observed:
+            def emit(index, record, message, key=None):
+                append(message)
+            self._observe(compiled.windowed, observed, payload, emit, time.time() if now is None else now)
+        return alerts
+
+    def match(self, payload, now=None):
+        # Structured alerts: one dict per hit with the rule id, section,
+        # entity, fingerprint and suppression window.
+        compiled = self.compiled
+        rules = compiled.rules
+        hits = []
+        entity = []
+
+        def emit(index, record, message, key=None):
+            rule = rules[index]
+            values = {}
+            for field in rule["entity"]:
+                value = key if key is not None else record.get(field)
+                if value is None:
+                    if not entity:
+                        entity.append(payload_entity(payload))
+                    value = entity[0].get(field)
+                values[field] = value
+            hits.append({
+                "fingerprint": fingerprint(rule["id"], values),
+                "rule": rule["id"],
+                "section": rule["section"],
+                "entity": values,
+                "message": message,
+                "suppress_seconds": rule["suppress_seconds"],
+            })
+
+        observed = []
+        timer = self.section_timer
+        for section, run, windowed in compiled.structured:
+            records = payload.get(section)
+            if records is None:
+                continue
+            if isinstance(records, dict):
+                records = (records,)
+            observe = observed.append if windowed else None
+            if timer is None:
+                run(records, emit, observe)
+                continue
+            start = time.perf_counter()
+            run(records, emit, observe)
+            timer.observe(time.perf_counter() - start, (section,))
+        if observed:
+            self._observe(compiled.windowed, observed, payload, emit, time.time() if now is None else now)
+        return hits
+
+
+engine = RuleEngine()
+
+
 def run_rules(payload):
-    alerts = []
-
-    # 1. Identity & Sessions
-    identity = payload.get("identity", {})
-    if identity.get("AuthResult") == "failure":
-        alerts.append(f"Failed login for user {identity.get('UserID', 'Unknown')} on {identity.get('MachineName', 'Unknown')}")
-    if identity.get("MFAUsed") == "no":
-        alerts.append(f"MFA not used by {identity.get('UserID', 'Unknown')}")
-    if identity.get("LogonType") != "interactive":
-        alerts.append(f"Non-interactive logon detected via {identity.get('LogonSource', 'Unknown')}")
-
-    # 2. Process Activity
-    for proc in payload.get("processes", []):
-        if proc.get("CPUUsage", 0) > 80:
-            alerts.append(f"High CPU usage by process {proc.get('ProcessName', 'Unknown')} ({proc.get('PID')})")
-        if proc.get("MemoryUsage", 0) > 1000:
-            alerts.append(f"High memory usage by {proc.get('ProcessName', 'Unknown')} ({proc.get('PID')})")
-
-    # 3. File Operations
-    for f in payload.get("files", []):
-        if f.get("SensitivityLabel") == "Confidential" and f.get("AccessResult") == "allowed":
-            alerts.append(f"Confidential file accessed: {f.get('FilePath', 'Unknown')}")
-        if f.get("OperationType") == "delete" and int(f.get("FileSizeBefore", 0)) > 1e6:
-            alerts.append(f"Large file deleted: {f.get('FilePath', 'Unknown')}")
-
-    # 4. Network Connections
-    for net in payload.get("network", []):
-        if net.get("DestIP") not in ["127.0.0.1", "localhost"] and net.get("BytesSent", 0) > 5000:
-            alerts.append(f"Large external connection to {net.get('DestIP', 'Unknown')} (DNS: {net.get('DNSQuery', '')})")
-
-    # 5. Registry & Config Changes
-    for reg in payload.get("registry", []):
-        if reg.get("OperationType") in ["delete", "modify"]:
-            alerts.append(f"Registry {reg.get('OperationType')} on {reg.get('KeyPath', '')}\\{reg.get('ValueName', '')}")
-
-    # 6. Removable Media
-    for usb in payload.get("usb", []):
-        if usb.get("DataTransferVolume", 0) > 500:
-            alerts.append(f"Large data transfer ({usb.get('DataTransferVolume')} MB) to USB {usb.get('USBDeviceID')} ({usb.get('MountPoint')})")
-
-    # 7. Email & Cloud Apps
-    for e in payload.get("email_cloud", []):
-        if int(e.get("UploadVolume", 0)) > 5000:
-            alerts.append(f"Large upload ({e.get('UploadVolume')} KB) via {e.get('ApplicationName', '')}")
-        if "confidential" in e.get("EmailSubject", "").lower():
-            alerts.append(f"Potential exfiltration of confidential data via email: {e.get('EmailSubject')}")
-
-    # 8. Security Alerts & AV
-    for av in payload.get("av_alerts", []):
-        if av.get("Severity") == "high":
-            alerts.append(f"High severity alert: {av.get('AlertID')} involving {av.get('InvolvedFile')}")
-
-    # 9. Clipboard & Screen Capture
-    for clip in payload.get("clipboard_screen", []):
-        if clip.get("ClipboardEvent") in ["copy", "cut"]:
-            alerts.append(f"Clipboard activity detected: {clip.get('ClipboardEvent')} of {clip.get('ClipboardContentMeta', '')}")
-        if clip.get("ScreenCaptureTrigger"):
-            alerts.append(f"Screen capture triggered: {clip.get('ScreenCaptureTrigger')}")
-
-    return alerts
+    engine.maybe_reload()
+    return engine.evaluate(payload)
+
+
+def match_rules(payload):
+    engine.maybe_reload()
+    return engine.match(payload)
@@ -0,0 +1,204 @@
+import base64
+import bisect
+import hashlib
+import heapq
+import json
+
+# Pieces of the sharded mode (see cluster.py) that do not touch processes or
+# sockets: the consistent hash ring that maps agents to shards, a shard's view
+# of the ring, and the merges that turn per-shard query pages and summaries
+# into one view.
+VNODES = 128
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    # Each node owns VNODES points on a 64-bit ring and a key belongs to the
+    # first point at or after its hash, so adding or removing a node only
+    # moves the keys that node gains or loses. The ring is rebuilt on change
+    # and swapped in as one tuple, so lookups need no lock.
+    def __init__(self, nodes=(), vnodes=VNODES):
+        self.vnodes = vnodes
+        self.nodes = set(nodes)
+        self.ring = ((), ())
+        self._rebuild()
+
+    def _rebuild(self):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(self.vnodes))
+        self.ring = (tuple(p for p, _ in points), tuple(n for _, n in points))
+
+    def add(self, node):
+        if node not in self.nodes:
+            self.nodes = self.nodes | {node}
+            self._rebuild()
+
+    def remove(self, node):
+        if node in self.nodes:
+            self.nodes = self.nodes - {node}
+            self._rebuild()
+
+    def owner(self, key):
+        points, owners = self.ring
+        if not points:
+            return None
+        return owners[bisect.bisect_left(points, _hash(str(key))) % len(points)]
+
+    def shares(self):
+        # Fraction of the ring each node owns.
+        points, owners = self.ring
+        if not points:
+            return {}
+        shares = dict.fromkeys(self.nodes, 0)
+        span = 1 << 64
+        previous = points[-1] - span
+        for point, node in zip(points, owners):
+            shares[node] += (point - previous) / span
+            previous = point
+        return shares
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class Membership:
+    # A shard's copy of the router's ring, pushed by the router whenever it
+    # changes. Agents may post to their shard directly; a shard answers posts
+    # for agents it does not own with the owner's port so they can move on.
+    def __init__(self, shard):
+        self.shard = shard
+        self.version = 0
+        self.view = (HashRing(), {})
+
+    def update(self, version, ports):
+        # ports: {shard: port} of every shard on the ring.
+        self.view = (HashRing(ports), dict(ports))
+        self.version = version
+
+    def redirect(self, key):
+        # The owner's port when another shard owns key, else None. An empty
+        # or unknown ring accepts everything rather than bouncing posts.
+        ring, ports = self.view
+        owner = ring.owner(key)
+        if owner is None or owner == self.shard:
+            return None
+        return ports.get(owner)
+
+
+def shard_url(scheme, host, port, path):
+    # host is a Host header ("name", "name:port", "[::1]:port"); the port is
+    # swapped for the shard's.
+    name, _, tail = host.rpartition(":")
+    if not name or not tail.isdigit():
+        name = host
+    return f"{scheme}://{name}:{port}{path}"
+
+
+def encode_cursor(cursors):
+    # {shard: cursor id, or None to start from the newest}; shards that are
+    # exhausted are left out.
+    return base64.urlsafe_b64encode(json.dumps(cursors, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(text):
+    try:
+        cursors = json.loads(base64.urlsafe_b64decode(text.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+    if not isinstance(cursors, dict) or not all(v is None or isinstance(v, int) for v in cursors.values()):
+        raise ValueError("invalid cursor")
+    return cursors
+
+
+def merge_pages(pages, limit, key, pending=None):
+    # pages: {shard: {"items", "ids", "next_cursor", "cursor"}}, each newest
+    # first. Takes the newest `limit` items across shards by item[key],
+    # keeping each shard's own order, and returns (items, next cursor). There
+    # are only a handful of shards, so the heads are scanned rather than heaped.
+    # pending: {shard: cursor} of shards that could not be read this time;
+    # the next cursor resumes them where they were.
+    taken = dict.fromkeys(pages, 0)
+    items = []
+    while len(items) < limit:
+        best = None
+        for shard, page in pages.items():
+            if taken[shard] < len(page["items"]):
+                value = page["items"][taken[shard]].get(key)
+                if best is None or _newer(value, best[1]):
+                    best = (shard, value)
+        if best is None:
+            break
+        shard = best[0]
+        items.append(pages[shard]["items"][taken[shard]])
+        taken[shard] += 1
+
+    cursors = {}
+    for shard, page in pages.items():
+        if taken[shard] < len(page["items"]):
+            # Resume right after the last item used; a shard none of whose
+            # items were used starts again from where it started.
+            if taken[shard]:
+                cursors[shard] = page["ids"][taken[shard] - 1]
+            elif page.get("cursor") is not None:
+                cursors[shard] = page["cursor"]
+            else:
+                cursors[shard] = page["ids"][0] + 1
+        elif page["next_cursor"] is not None:
+            cursors[shard] = page["next_cursor"]
+    cursors.update(pending or {})
+    return items, encode_cursor(cursors) if cursors else None
+
+
+def _newer(a, b):
+    # Epoch seconds or ISO timestamps; a missing value sorts oldest.
+    if a is None:
+        return False
+    if b is None:
+        return True
+    try:
+        return a > b
+    except TypeError:
+        return str(a) > str(b)
+
+
+def merge_series(series):
+    minutes = {}
+    for entries in series:
+        for entry in entries:
+            counts = minutes.setdefault(entry["minute"], {})
+            for name, count in entry["counts"].items():
+                counts[name] = counts.get(name, 0) + count
+    return [{"minute": minute, "counts": counts} for minute, counts in sorted(minutes.items())]
+
+
+def merge_top(lists, n):
+    totals = {}
+    for entries in lists:
+        for entry in entries:
+            totals[entry["key"]] = totals.get(entry["key"], 0) + entry["total"]
+    return [{"key": key, "total": total} for key, total in heapq.nlargest(n, totals.items(), key=lambda kv: kv[1])]
+
+
+def merge_summaries(summaries, top_n=10):
+    # Hosts live on exactly one shard, so per-host views (top processes, USB
+    # volume) merge exactly; top talkers are keyed by destination, which can
+    # appear on every shard, so their merge is over each shard's top N.
+    totals = {}
+    for summary in summaries:
+        for name, value in summary.get("totals", {}).items():
+            totals[name] = totals.get(name, 0) + value
+    return {
+        "generated": max((s.get("generated", 0) for s in summaries), default=0),
+        "shards": len(summaries),
+        "totals": totals,
+        "events_per_minute": merge_series(s.get("events_per_minute", ()) for s in summaries),
+        "alerts_per_minute": merge_series(s.get("alerts_per_minute", ()) for s in summaries),
+        "top_talkers": merge_top((s.get("top_talkers", ()) for s in summaries), top_n),
+        "top_cpu": heapq.nlargest(
+            top_n, (p for s in summaries for p in s.get("top_cpu", ())), key=lambda p: p["CPUUsage"]),
+        "top_memory": heapq.nlargest(
+            top_n, (p for s in summaries for p in s.get("top_memory", ())), key=lambda p: p["MemoryUsage"]),
+        "usb_volume": merge_top((s.get("usb_volume", ()) for s in summaries), top_n),
+    }
@@ -0,0 +1,344 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Events and alerts are persisted to a local SQLite database in WAL mode. Writes
+# go through a single background thread that commits in batches, so one fsync
+# covers many agent posts; the dashboard reads from bounded in-memory rings.
+# Alerts are incidents (see alerts.py) and are upserted by incident id, so a
+# repeating alert is one row whose count and last_seen move.
+#
+# The user, host, rule and section of each record are copied into indexed
+# columns at ingest (event sections into event_sections), so the query API
+# can page through any filter newest first with keyset cursors on id. Event
+# ids are never reused: the next id is kept in meta, so section postings left
+# behind by retention can never collide with new events.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    body TEXT NOT NULL,
+    user TEXT,
+    host TEXT
+);
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    body TEXT NOT NULL,
+    incident TEXT,
+    rule TEXT,
+    section TEXT,
+    user TEXT,
+    host TEXT
+);
+CREATE TABLE IF NOT EXISTS event_sections (
+    section TEXT NOT NULL,
+    event_id INTEGER NOT NULL,
+    PRIMARY KEY (section, event_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+"""
+
+# Columns added after the first release. Rows written before a column existed
+# keep NULL there and simply never match a filter on it.
+MIGRATIONS = {
+    ("alerts", "incident"): "ALTER TABLE alerts ADD COLUMN incident TEXT",
+    ("alerts", "rule"): "ALTER TABLE alerts ADD COLUMN rule TEXT",
+    ("alerts", "section"): "ALTER TABLE alerts ADD COLUMN section TEXT",
+    ("alerts", "user"): "ALTER TABLE alerts ADD COLUMN user TEXT",
+    ("alerts", "host"): "ALTER TABLE alerts ADD COLUMN host TEXT",
+    ("events", "user"): "ALTER TABLE events ADD COLUMN user TEXT",
+    ("events", "host"): "ALTER TABLE events ADD COLUMN host TEXT",
+}
+
+INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS alerts_incident ON alerts (incident);
+CREATE INDEX IF NOT EXISTS alerts_rule ON alerts (rule, id);
+CREATE INDEX IF NOT EXISTS alerts_section ON alerts (section, id);
+CREATE INDEX IF NOT EXISTS alerts_user ON alerts (user, id);
+CREATE INDEX IF NOT EXISTS alerts_host ON alerts (host, id);
+CREATE INDEX IF NOT EXISTS events_user ON events (user, id);
+CREATE INDEX IF NOT EXISTS events_host ON events (host, id);
+CREATE INDEX IF NOT EXISTS event_sections_event ON event_sections (event_id);
+"""
+
+QUERY_MAX_LIMIT = 1000
+
+TABLES = ("events", "alerts")
+
+
+class Store:
+    def __init__(self, path, recent_size=100, max_age=7 * 24 * 3600, max_rows=1_000_000,
+                 batch_size=500, flush_interval=0.5, prune_interval=60.0, max_pending=10_000):
+        self.path = path
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+
+        self.recent_size = recent_size
+        self.recent = {"events": deque(maxlen=recent_size), "alerts": OrderedDict()}
+        self.recent_lock = threading.Lock()
+        # Bounded so a stalled disk pushes back on request threads instead of
+        # buffering without limit.
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript(SCHEMA)
+        self._migrate()
+        self.db.executescript(INDEXES)
+        self.next_event_id = self._next_event_id()
+        self._load_recent(recent_size)
+
+        # Queries get their own connection so WAL lets them run alongside the
+        # writer instead of waiting on its lock.
+        self.reader = sqlite3.connect(path, check_same_thread=False)
+        self.read_lock = threading.Lock()
+
+        self.writer = threading.Thread(target=self._run, name="store-writer", daemon=True)
+        self.writer.start()
+
+    def _migrate(self):
+        for (table, column), statement in MIGRATIONS.items():
+            columns = {row[1] for row in self.db.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self.db.execute(statement)
+        self.db.commit()
+
+    def _next_event_id(self):
+        # Databases from before meta existed fall back to the highest id
+        # still referenced anywhere.
+        row = self.db.execute(
+            "SELECT MAX(n) FROM (SELECT value AS n FROM meta WHERE key = 'next_event_id' "
+            "UNION ALL SELECT MAX(id) + 1 FROM events "
+            "UNION ALL SELECT MAX(event_id) + 1 FROM event_sections)"
+        ).fetchone()
+        return row[0] or 1
+
+    def _load_recent(self, limit):
+        rows = self.db.execute(
+            "SELECT body FROM events ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        self.recent["events"].extend(json.loads(body) for (body,) in reversed(rows))
+        # Rows from before incidents existed have no incident id and are left
+        # to age out.
+        rows = self.db.execute(
+            "SELECT body FROM alerts WHERE incident IS NOT NULL ORDER BY ts DESC LIMIT ?", (limit,)
+        ).fetchall()
+        for (body,) in reversed(rows):
+            alert = json.loads(body)
+            self.recent["alerts"][alert["id"]] = alert
+
+    def add_event(self, event, user=None, host=None, sections=()):
+        with self.recent_lock:
+            self.recent["events"].append(event)
+        self.pending.put(("events", time.time(), json.dumps(event), (user, host, tuple(sections))))
+
+    def add_alert(self, alert):
+        # Inserts a new incident or replaces the stored copy of an existing one.
+        recent = self.recent["alerts"]
+        with self.recent_lock:
+            recent[alert["id"]] = alert
+            recent.move_to_end(alert["id"])
+            while len(recent) > self.recent_size:
+                recent.popitem(last=False)
+        entity = alert.get("entity") or {}
+        extra = (alert["id"], alert.get("rule"), alert.get("section"), entity.get("UserID"), entity.get("MachineName"))
+        self.pending.put(("alerts", alert["last_seen"], json.dumps(alert), extra))
+
+    def recent_events(self, limit=10):
+        with self.recent_lock:
+            return list(self.recent["events"])[-limit:]
+
+    def recent_alerts(self, limit=10):
+        with self.recent_lock:
+            return list(self.recent["alerts"].values())[-limit:]
+
+    def alerts_since(self, ts):
+        # Incidents seen at or after ts, oldest first.
+        with self.read_lock:
+            rows = self.reader.execute(
+                "SELECT body FROM alerts WHERE incident IS NOT NULL AND ts >= ? ORDER BY ts", (ts,)
+            ).fetchall()
+        return [json.loads(body) for (body,) in rows]
+
+    def size_bytes(self):
+        # Database, WAL and shared-memory files together.
+        total = 0
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                total += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return total
+
+    def count(self, table):
+        with self.read_lock:
+            return self.reader.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def _page(self, sql, where, args, cursor, limit, key="id"):
+        # Newest first. Returns ([(id, body)], next cursor or None); bodies are
+        # left as JSON text for the caller to splice into its response.
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        limit = min(limit, QUERY_MAX_LIMIT)
+        if cursor is not None:
+            where.append(f"{key} < ?")
+            args.append(int(cursor))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {key} DESC LIMIT ?"
+        args.append(limit + 1)
+        with self.read_lock:
+            rows = self.reader.execute(sql, args).fetchall()
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1][0]
+        return rows, None
+
+    def query_events(self, user=None, host=None, section=None, since=None, until=None,
+                     cursor=None, limit=100):
+        where, args = [], []
+        sql, key = "SELECT id, body FROM events", "id"
+        for column, value in (("user", user), ("host", host)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if section is not None and where:
+            # Walk the user/host index and probe the section per row.
+            where.append("EXISTS (SELECT 1 FROM event_sections WHERE section = ? AND event_id = events.id)")
+            args.append(section)
+        elif section is not None:
+            # Section alone: walk the section's postings newest first.
+            sql = "SELECT e.id, e.body FROM event_sections s JOIN events e ON e.id = s.event_id"
+            key = "s.event_id"
+            where.append("s.section = ?")
+            args.append(section)
+        # Event ids grow with ts, so a time range becomes an id range that the
+        # indexes above can seek on directly.
+        for op, order, value in ((">=", "ASC", since), ("<=", "DESC", until)):
+            if value is None:
+                continue
+            with self.read_lock:
+                row = self.reader.execute(
+                    f"SELECT id FROM events WHERE ts {op} ? ORDER BY ts {order} LIMIT 1", (value,)
+                ).fetchone()
+            if row is None:
+                return [], None
+            where.append(f"{key} {op} ?")
+            args.append(row[0])
+        return self._page(sql, where, args, cursor, limit, key)
+
+    def query_alerts(self, user=None, host=None, section=None, rule=None, since=None, until=None,
+                     cursor=None, limit=100):
+        # Incidents ordered by when they opened; the time range applies to
+        # last_seen.
+        where, args = ["incident IS NOT NULL"], []
+        for column, value in (("user", user), ("host", host), ("section", section), ("rule", rule)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if since is not None:
+            where.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("ts <= ?")
+            args.append(until)
+        return self._page("SELECT id, body FROM alerts", where, args, cursor, limit)
+
+    def _drain(self):
+        try:
+            batch = [self.pending.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        events = []
+        alerts = {}
+        for table, ts, body, extra in batch:
+            if table == "alerts":
+                # Only the latest state of an incident in a batch is written.
+                alerts[extra[0]] = (ts, body) + extra
+            else:
+                events.append((ts, body, extra))
+        with self.lock, self.db:
+            if events:
+                # Ids are assigned here (this is the only writer) so the
+                # section rows can be inserted with executemany too.
+                rows, sections = [], []
+                for event_id, (ts, body, (user, host, names)) in enumerate(events, self.next_event_id):
+                    rows.append((event_id, ts, body, user, host))
+                    sections.extend((name, event_id) for name in names)
+                self.db.executemany("INSERT INTO events (id, ts, body, user, host) VALUES (?, ?, ?, ?, ?)", rows)
+                self.db.executemany("INSERT INTO event_sections (section, event_id) VALUES (?, ?)", sections)
+                self.db.execute(
+                    "INSERT INTO meta (key, value) VALUES ('next_event_id', ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    (self.next_event_id + len(rows),),
+                )
+            if alerts:
+                self.db.executemany(
+                    "INSERT INTO alerts (ts, body, incident, rule, section, user, host) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (incident) DO UPDATE SET ts = excluded.ts, body = excluded.body",
+                    alerts.values(),
+                )
+        # Only moved once the transaction has committed.
+        self.next_event_id += len(events)
+
+    def prune(self):
+        cutoff = time.time() - self.max_age
+        with self.lock, self.db:
+            for table in TABLES:
+                self.db.execute(f"DELETE FROM {table} WHERE ts < ?", (cutoff,))
+                self.db.execute(
+                    f"DELETE FROM {table} WHERE id <= (SELECT MAX(id) FROM {table}) - ?",
+                    (self.max_rows,),
+                )
+            # Ids only grow, so postings of pruned events are all below the
+            # oldest event left, or below the next id once none are left.
+            self.db.execute(
+                "DELETE FROM event_sections WHERE event_id < COALESCE((SELECT MIN(id) FROM events), ?)",
+                (self.next_event_id,),
+            )
+
+    def _run(self):
+        next_prune = time.monotonic() + self.prune_interval
+        while not (self.stopped.is_set() and self.pending.empty()):
+            batch = self._drain()
+            if batch:
+                try:
+                    self._commit(batch)
+                except sqlite3.Error as e:
+                    print(f"[-] Failed to persist {len(batch)} records: {e}")
+            if time.monotonic() >= next_prune:
+                next_prune = time.monotonic() + self.prune_interval
+                try:
+                    self.prune()
+                except sqlite3.Error as e:
+                    print(f"[-] Failed to apply retention: {e}")
+
+    def close(self):
+        self.stopped.set()
+        self.writer.join()
+        self.db.close()
+        self.reader.close()
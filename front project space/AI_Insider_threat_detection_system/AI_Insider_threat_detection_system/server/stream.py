@@ -0,0 +1,146 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+# Server-Sent Events fan-out. Every published event is formatted once and put
+# on each subscriber's bounded queue; a subscriber whose queue is full is
+# dropped rather than slowing ingest down, and reconnects with Last-Event-ID
+# to replay what it missed from a bounded backlog. Ids start from the boot
+# time in milliseconds so they keep increasing across restarts.
+CLIENT_QUEUE_SIZE = 256
+REPLAY_SIZE = 1000
+MAX_CLIENTS = 100
+KEEPALIVE_SECONDS = 15.0
+RETRY_MS = 3000
+
+
+class TooManyClients(Exception):
+    pass
+
+
+class Client:
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.closed = False
+
+
+class Broadcaster:
+    def __init__(self, client_queue_size=CLIENT_QUEUE_SIZE, replay_size=REPLAY_SIZE,
+                 max_clients=MAX_CLIENTS):
+        self.client_queue_size = client_queue_size
+        self.max_clients = max_clients
+        self.clients = set()
+        self.replay = deque(maxlen=replay_size)
+        self.lock = threading.Lock()
+        self.next_id = int(time.time() * 1000)
+        self.dropped = 0
+
+    def publish(self, event, data):
+        body = json.dumps(data, default=str)
+        with self.lock:
+            event_id = self.next_id
+            self.next_id += 1
+            message = f"id: {event_id}\nevent: {event}\ndata: {body}\n\n"
+            self.replay.append((event_id, message))
+            for client in list(self.clients):
+                try:
+                    client.queue.put_nowait(message)
+                except queue.Full:
+                    client.closed = True
+                    self.clients.discard(client)
+                    self.dropped += 1
+        return event_id
+
+    def subscribe(self, last_event_id=None):
+        # Returns (client, backlog). The backlog holds the events after
+        # last_event_id; when those have already left the replay buffer it
+        # starts with a "reset" event telling the client to reload instead.
+        with self.lock:
+            if len(self.clients) >= self.max_clients:
+                raise TooManyClients()
+            backlog = []
+            if last_event_id is not None:
+                oldest = self.replay[0][0] if self.replay else self.next_id
+                if last_event_id + 1 < oldest or last_event_id >= self.next_id:
+                    backlog.append("event: reset\ndata: {}\n\n")
+                else:
+                    backlog.extend(message for event_id, message in self.replay if event_id > last_event_id)
+            client = Client(self.client_queue_size)
+            self.clients.add(client)
+            return client, backlog
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def stream(self, last_event_id=None, keepalive=KEEPALIVE_SECONDS):
+        # Generator of SSE text for one response. Subscribes immediately so
+        # nothing published between the request and the first read is lost.
+        client, backlog = self.subscribe(last_event_id)
+
+        def run():
+            try:
+                yield f"retry: {RETRY_MS}\n\n"
+                yield from backlog
+                while not client.closed:
+                    try:
+                        yield client.queue.get(timeout=keepalive)
+                    except queue.Empty:
+                        yield ": keepalive\n\n"
+            finally:
+                self.unsubscribe(client)
+
+        return run()
+
+
+class SummaryPublisher:
+    # Per-section record counts, alert counts and the latest state of every
+    # incident that repeated are accumulated and published as one "summary"
+    # delta per interval, so the stream rate does not grow with the number of
+    # agents. New incidents are published straight away as "alert" events.
+    def __init__(self, broadcaster, interval=1.0):
+        self.broadcaster = broadcaster
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.sections = {}
+        self.events = 0
+        self.alerts = 0
+        self.updated = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stream-summary", daemon=True)
+        self.thread.start()
+
+    def add(self, sections, alerts=0, updated=(), events=1):
+        # sections maps section name to its record count in one payload;
+        # updated holds incidents that were repeated rather than opened.
+        # Alerts raised outside ingest (baselines) are added with events=0.
+        with self.lock:
+            for name, count in sections.items():
+                self.sections[name] = self.sections.get(name, 0) + count
+            self.events += events
+            self.alerts += alerts
+            for alert in updated:
+                self.updated[alert["id"]] = alert
+
+    def flush(self):
+        with self.lock:
+            if not (self.events or self.alerts):
+                return
+            delta = {"interval": self.interval, "events": self.events, "alerts": self.alerts,
+                     "sections": self.sections, "updated": list(self.updated.values())}
+            self.sections = {}
+            self.events = 0
+            self.alerts = 0
+            self.updated = {}
+        self.broadcaster.publish("summary", delta)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
@@ -1,4 +1,3 @@
-import requests
 import json
 from datetime import datetime
 
@@ -103,9 +102,12 @@ data = {
 }
 
 # Send data to server
-try:
-    print("[+] Sending data to server...")
-    response = requests.post("http://localhost:5000/agent", json=data)
-    print("[+] Server response:", response.status_code, response.text)
-except Exception as e:
-    print("[!] Error sending data:", e)
+if __name__ == "__main__":
+    import requests
+
+    try:
+        print("[+] Sending data to server...")
+        response = requests.post("http://localhost:5000/agent", json=data)
+        print("[+] Server response:", response.status_code, response.text)
+    except Exception as e:
+        print("[!] Error sending data:", e)
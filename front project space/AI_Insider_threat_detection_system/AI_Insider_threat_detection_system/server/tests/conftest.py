@@ -0,0 +1,38 @@
+import os, sys, tempfile, time
+
+import pytest
+
+# The server runs from its own directory and imports `common` from one level
+# up; tests get the same view of the tree. The app opens its store and loads
+# windows and baselines at import time, so every state path is pointed at a
+# scratch directory before anything imports it.
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(SERVER_DIR))
+sys.path.insert(0, SERVER_DIR)
+
+SCRATCH = tempfile.mkdtemp(prefix="insider_tests_")
+os.environ["INSIDER_STORE_PATH"] = os.path.join(SCRATCH, "insider.db")
+os.environ["INSIDER_WINDOWS_PATH"] = os.path.join(SCRATCH, "windows.json")
+os.environ["INSIDER_BASELINE_PATH"] = os.path.join(SCRATCH, "baseline.npz")
+
+@pytest.fixture(scope="session")
+def server():
+    import app
+    return app
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+@pytest.fixture
+def wait_for():
+    # Polls until condition() is truthy; the store writer and ingest pool
+    # finish their work on their own threads.
+    def wait(condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            result = condition()
+            if result or time.monotonic() > deadline:
+                return result
+            time.sleep(0.02)
+    return wait
@@ -0,0 +1,66 @@
+from alerts import AlertCache
+
+def hit(fingerprint="identity.failed_login|alice", suppress=600, rule="identity.failed_login", message="m"):
+    return {"fingerprint": fingerprint, "rule": rule, "section": "identity", "entity": {"UserID": "alice"},
+            "message": message, "suppress_seconds": suppress}
+
+def test_repeats_within_the_window_join_one_incident():
+    cache = AlertCache()
+    first, new = cache.observe(hit(message="first"), now=1000.0)
+    assert new
+    again, new = cache.observe(hit(message="again"), now=1500.0)
+    assert not new
+    assert again["id"] == first["id"]
+    assert (again["count"], again["first_seen"], again["last_seen"]) == (2, 1000.0, 1500.0)
+    assert again["message"] == "again"
+    assert cache.suppressed == 1
+
+def test_window_runs_from_the_last_hit():
+    cache = AlertCache()
+    first, _ = cache.observe(hit(), now=1000.0)
+    cache.observe(hit(), now=1550.0)
+    _, new = cache.observe(hit(), now=2100.0)  # 1100s after the first, 550s after the last
+    assert not new
+    reopened, new = cache.observe(hit(), now=2701.0)
+    assert new
+    assert reopened["id"] != first["id"] and reopened["count"] == 1
+
+def test_fingerprints_and_rule_windows_are_independent():
+    cache = AlertCache()
+    cache.observe(hit("a", suppress=60), now=0.0)
+    cache.observe(hit("b", suppress=3600), now=0.0)
+    assert cache.observe(hit("a", suppress=60), now=120.0)[1]
+    assert not cache.observe(hit("b", suppress=3600), now=120.0)[1]
+
+def test_cache_is_bounded_and_drops_lapsed_windows():
+    cache = AlertCache(max_incidents=2)
+    for key in ("a", "b", "c"):
+        cache.observe(hit(key), now=0.0)
+    assert list(cache.incidents) == ["b", "c"] and cache.evicted == 1
+    # A new incident after c's window has lapsed clears the lapsed entries.
+    cache.observe(hit("d", suppress=10_000), now=700.0)
+    assert list(cache.incidents) == ["d"]
+
+def test_load_keeps_restored_incidents_open():
+    cache = AlertCache()
+    incident, _ = AlertCache().observe(hit(), now=0.0)
+    incident.update(first_seen=1.0e12, last_seen=1.0e12)  # Still inside its window
+    cache.load([incident])
+    again, new = cache.observe(hit(), now=1.0e12 + 10)
+    assert not new and again["id"] == incident["id"] and again["count"] == 2
+
+def failed_login(agent_id):
+    return {"agent_id": agent_id, "identity": [{"UserID": "mallory", "MachineName": agent_id,
+                                                "AuthResult": "failure"}]}
+
+def test_repeated_posts_are_stored_as_one_incident(client, wait_for):
+    for _ in range(3):
+        assert client.post("/agent", json=failed_login("ALERTS-01")).status_code == 200
+
+    def incidents():
+        items = client.get("/api/alerts?host=ALERTS-01&rule=identity.failed_login").get_json()["items"]
+        return items if items and items[0]["count"] == 3 else None
+
+    items = wait_for(incidents)
+    assert items is not None and len(items) == 1
+    assert items[0]["entity"]["MachineName"] == "ALERTS-01"
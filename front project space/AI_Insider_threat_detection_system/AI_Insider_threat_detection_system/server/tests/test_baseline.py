@@ -0,0 +1,80 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from baseline import FEATURE_NAMES, Baseline, BaselineScorer
+
+USB = FEATURE_NAMES.index("usb_volume")
+
+def usb_rows(volumes):
+    values = np.full((len(volumes), len(FEATURE_NAMES)), np.nan)
+    values[:, USB] = volumes
+    return values
+
+def test_update_matches_the_sample_mean_and_variance():
+    baseline = Baseline()
+    history = [100.0 + (i % 7) * 3 for i in range(40)]
+    rows = baseline.lookup(["host:WS-01"] * len(history))
+    # Two batches, so the parallel merge is exercised too.
+    baseline.update(rows[:15], usb_rows(history[:15]))
+    baseline.update(rows[15:], usb_rows(history[15:]))
+    row = baseline.rows["host:WS-01"]
+    assert baseline.count[row, USB] == 40
+    assert baseline.mean[row, USB] == pytest.approx(np.mean(history))
+    assert baseline.m2[row, USB] / 39 == pytest.approx(np.var(history, ddof=1))
+
+def test_outlier_is_flagged_and_usual_value_is_not():
+    baseline = Baseline()
+    history = [100.0 + (i % 7) * 3 for i in range(40)]
+    baseline.update(baseline.lookup(["host:WS-01"] * 40), usb_rows(history))
+    anomalous, score, z = baseline.score(baseline.lookup(["host:WS-01"] * 2), usb_rows([109.0, 50_000.0]))
+    assert not anomalous[0, USB]
+    assert anomalous[1, USB]
+    assert z[1, USB] > 4
+
+def test_no_score_before_min_samples():
+    baseline = Baseline(min_samples=20)
+    baseline.update(baseline.lookup(["host:WS-01"] * 5), usb_rows([100.0] * 5))
+    anomalous, _, _ = baseline.score(baseline.lookup(["host:WS-01"]), usb_rows([50_000.0]))
+    assert not anomalous.any()
+
+@pytest.fixture
+def scorer():
+    scorer = BaselineScorer(lambda hits: None, interval=3600)
+    yield scorer
+    scorer.close()
+
+def usb_payload(volume, user=None):
+    payload = {"agent_id": "WS-01", "usb": [{"DataTransferVolume": volume}]}
+    if user:
+        payload["identity"] = [{"UserID": user, "Timestamp": "2026-01-05T09:00:00"}]
+    return payload
+
+def test_users_and_hosts_have_separate_baselines(scorer):
+    for i in range(30):
+        user = "alice" if i % 3 == 0 else None
+        scorer.add({"UserID": user, "MachineName": "WS-01"}, usb_payload(100.0, user))
+    scorer.flush()
+    rows = scorer.baseline.rows
+    assert set(rows) == {"host:WS-01", "user:alice"}
+    assert scorer.baseline.count[rows["host:WS-01"], USB] == 30
+    assert scorer.baseline.count[rows["user:alice"], USB] == 10
+
+def test_host_outlier_becomes_a_hit(scorer):
+    for i in range(30):
+        scorer.add({"UserID": None, "MachineName": "WS-01"}, usb_payload(100.0 + i % 5))
+    scorer.flush()
+    scorer.add({"UserID": None, "MachineName": "WS-01"}, usb_payload(80_000.0))
+    [hit] = scorer.flush()
+    assert hit["rule"] == "baseline.usb_volume"
+    assert hit["entity"] == {"MachineName": "WS-01"}
+    assert "for host WS-01" in hit["message"]
+
+def test_old_mixed_key_files_are_ignored(tmp_path, scorer):
+    old = Baseline()
+    old.lookup(["alice", "WS-01"])
+    path = tmp_path / "baseline.npz"
+    with open(path, "wb") as f:
+        old.save(f)
+    scorer.load(str(path))
+    assert scorer.baseline.rows == {}
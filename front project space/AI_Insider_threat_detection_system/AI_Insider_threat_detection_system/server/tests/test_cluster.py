@@ -0,0 +1,86 @@
+import gzip, json
+
+import pytest
+
+import cluster as router
+from ingest import encode_ndjson
+
+class Shards:
+    # Stands in for the shard processes: records the payloads each shard was
+    # sent and answers with that shard's status.
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.received = {shard: [] for shard in statuses}
+
+    def request(self, worker, method, path, body=None, headers=None, timeout=None):
+        payloads = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+        status = self.statuses[worker.shard]
+        if status != 202:
+            return status, {"Retry-After": "5"}, b'{"status": "busy"}'
+        self.received[worker.shard].extend(payloads)
+        bad = sum(1 for p in payloads if p.get("bad"))
+        result = {"status": "accepted", "count": len(payloads) - bad}
+        if bad:
+            result["rejected"] = bad
+        return 202, {"Content-Type": "application/json"}, json.dumps(result).encode()
+
+@pytest.fixture
+def shards(monkeypatch):
+    def start(statuses):
+        c = router.Cluster(base_port=19000)
+        for shard in statuses:
+            worker = c.workers[shard] = router.Worker(shard, 19001 + int(shard))
+            worker.healthy = True
+            c.ring.add(shard)
+        fake = Shards(statuses)
+        monkeypatch.setattr(c, "request", fake.request)
+        monkeypatch.setattr(router, "cluster", c)
+        clusters.append(c)
+        return c, fake
+
+    clusters = []
+    yield start
+    for c in clusters:
+        c.summaries.close()
+
+def agents_on(c, shard, count):
+    found = (f"WS-{n:03d}" for n in range(1000))
+    return [a for a in found if c.ring.owner(a) == shard][:count]
+
+def post_batch(payloads):
+    return router.router.test_client().post("/agent/batch", data=encode_ndjson(payloads),
+                                            headers={"Content-Type": "application/x-ndjson",
+                                                     "Content-Encoding": "gzip"})
+
+def test_batch_split_over_shards_reports_only_the_failed_group(shards):
+    c, fake = shards({"0": 202, "1": 503})
+    up, down = agents_on(c, "0", 2), agents_on(c, "1", 2)
+    payloads = [{"agent_id": up[0]}, {"agent_id": down[0]}, {"agent_id": up[1], "bad": True}, {"agent_id": down[1]}]
+    response = post_batch(payloads)
+    assert response.status_code == 202
+    body = response.get_json()
+    # Shard 0 ingested its two payloads (one of them rejected); the agent
+    # resends only positions 1 and 3, which belong to the shard that is down.
+    assert body["count"] == 1 and body["rejected"] == 1
+    assert body["failed"] == [1, 3]
+    assert response.headers["Retry-After"] == "5"
+    assert [p["agent_id"] for p in fake.received["0"]] == up
+
+def test_batch_that_no_shard_takes_is_passed_back_whole(shards):
+    c, fake = shards({"0": 429, "1": 503})
+    payloads = [{"agent_id": agents_on(c, "0", 1)[0]}, {"agent_id": agents_on(c, "1", 1)[0]}]
+    response = post_batch(payloads)
+    assert response.status_code in (429, 503)
+    assert not fake.received["0"] and not fake.received["1"]
+
+def test_batch_accepted_by_every_shard(shards):
+    c, fake = shards({"0": 202, "1": 202})
+    payloads = [{"agent_id": a} for a in agents_on(c, "0", 1) + agents_on(c, "1", 1)]
+    response = post_batch(payloads)
+    assert response.status_code == 202
+    assert response.get_json() == {"status": "accepted", "count": 2}
+
+def test_merged_query_rejects_a_zero_limit(shards):
+    shards({"0": 202})
+    response = router.router.test_client().get("/api/events?limit=0")
+    assert response.status_code == 400
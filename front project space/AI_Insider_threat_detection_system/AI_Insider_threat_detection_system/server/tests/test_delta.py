@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from delta import DeltaDecoder, ResyncRequired
+
+def keyframe(agent_id="WS-01", seq=1, files=()):
+    return {"agent_id": agent_id, "delta": {"seq": seq, "keyframe": True},
+            "changes": {"files": {"added": [[f"k{i}", f] for i, f in enumerate(files)]}}}
+
+def delta(agent_id="WS-01", seq=2, **diff):
+    return {"agent_id": agent_id, "delta": {"seq": seq, "keyframe": False}, "changes": {"files": diff}}
+
+def test_keyframe_then_delta_rebuilds_the_payload():
+    decoder = DeltaDecoder()
+    assert decoder.apply(keyframe(files=[{"n": 0}, {"n": 1}]))["files"] == [{"n": 0}, {"n": 1}]
+    payload = decoder.apply(delta(removed=["k0"], changed=[["k1", {"n": 11}]], added=[["k2", {"n": 2}]]))
+    assert payload == {"agent_id": "WS-01", "files": [{"n": 11}, {"n": 2}]}
+
+def test_gap_in_sequence_requires_resync():
+    decoder = DeltaDecoder()
+    decoder.apply(keyframe())
+    with pytest.raises(ResyncRequired):
+        decoder.apply(delta(seq=3))
+    with pytest.raises(ResyncRequired):
+        decoder.apply(delta(seq=4))
+
+def test_removing_an_unknown_record_requires_resync():
+    decoder = DeltaDecoder()
+    decoder.apply(keyframe(files=[{"n": 0}]))
+    with pytest.raises(ResyncRequired):
+        decoder.apply(delta(removed=["missing"]))
+    assert "WS-01" not in decoder.agents
+    assert decoder.apply(keyframe(seq=3, files=[{"n": 5}]))["files"] == [{"n": 5}]
+
+@pytest.mark.parametrize("message", [
+    {"agent_id": "x", "delta": 1},
+    {"agent_id": "x", "delta": {"seq": "1"}},
+    {"agent_id": "x", "delta": {"seq": 1, "keyframe": "yes"}},
+    {"agent_id": 7, "delta": {"seq": 1, "keyframe": True}},
+    {"agent_id": "x", "delta": {"seq": 1, "keyframe": True}, "changes": []},
+    {"agent_id": "x", "delta": {"seq": 1, "keyframe": True}, "changes": {"files": []}},
+    {"agent_id": "x", "delta": {"seq": 1, "keyframe": True}, "changes": {"files": {"added": [["k"]]}}},
+    {"agent_id": "x", "delta": {"seq": 1, "keyframe": True}, "changes": {"files": {"removed": [1]}}},
+])
+def test_malformed_messages_are_value_errors(message):
+    with pytest.raises(ValueError):
+        DeltaDecoder().apply(message)
+
+def test_malformed_delta_post_is_a_400(client):
+    response = client.post("/agent", json={"agent_id": "x", "delta": 1})
+    assert response.status_code == 400
+
+def test_batch_takes_a_keyframe_after_a_resync(client):
+    lines = [keyframe("WS-B1"), delta("WS-B1", seq=5), delta("WS-B1", seq=6), keyframe("WS-B1", seq=7),
+             {"agent_id": "WS-B1", "delta": "bad"}]
+    response = client.post("/agent/batch", data="".join(json.dumps(m) + "\n" for m in lines),
+                           content_type="application/x-ndjson")
+    assert response.status_code == 202
+    assert response.get_json() == {"status": "accepted", "count": 2, "rejected": 1}
@@ -0,0 +1,93 @@
+import gzip
+import json
+import threading
+
+import pytest
+
+from ingest import IngestPool, PayloadTooLarge, QueueFull, decode_ndjson, inflate
+
+MAX_BYTES = 1024 * 1024
+
+def bomb(size=16 * MAX_BYTES):
+    # A few KB on the wire that inflate to `size` bytes of whitespace JSON.
+    return gzip.compress(b'{"agent_id": "BOMB-01"' + b" " * size + b"}")
+
+def test_inflate_stops_at_the_limit():
+    body = bomb()
+    assert len(body) < 64 * 1024
+    with pytest.raises(PayloadTooLarge):
+        inflate(body, "gzip", MAX_BYTES)
+    assert inflate(gzip.compress(b"{}"), "gzip", MAX_BYTES) == b"{}"
+
+def test_bad_bodies_are_value_errors():
+    with pytest.raises(ValueError):
+        inflate(b"not gzip", "gzip")
+    with pytest.raises(ValueError):
+        inflate(b"{}", "br")
+    with pytest.raises(PayloadTooLarge):
+        inflate(b"x" * 11, None, 10)
+    with pytest.raises(PayloadTooLarge):
+        decode_ndjson(b"{}\n{}\n{}", max_items=2)
+    with pytest.raises(ValueError):
+        decode_ndjson(b"{}\n[1]")
+
+@pytest.fixture
+def small_limit(server, monkeypatch):
+    monkeypatch.setattr(server, "BATCH_MAX_BYTES", MAX_BYTES)
+
+@pytest.mark.parametrize("path", ["/agent", "/agent/batch"])
+def test_gzip_bomb_is_refused_with_413(client, small_limit, path):
+    response = client.post(path, data=bomb(), headers={"Content-Type": "application/json",
+                                                       "Content-Encoding": "gzip"})
+    assert response.status_code == 413
+    assert response.get_json()["status"] == "rejected"
+
+@pytest.mark.parametrize("path", ["/agent", "/agent/batch"])
+def test_corrupt_gzip_is_refused_with_400(client, path):
+    response = client.post(path, data=b"\x1f\x8b garbage", headers={"Content-Type": "application/json",
+                                                                   "Content-Encoding": "gzip"})
+    assert response.status_code == 400
+
+class FullPool:
+    def full(self):
+        return True
+
+def test_full_ingest_queue_answers_429(client, server, monkeypatch):
+    monkeypatch.setattr(server, "ingest", FullPool())
+    body = gzip.compress(json.dumps({"agent_id": "BUSY-01", "files": []}).encode())
+    response = client.post("/agent/batch", data=body, headers={"Content-Type": "application/x-ndjson",
+                                                               "Content-Encoding": "gzip"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(server.RETRY_AFTER)
+
+def test_pool_pushes_back_when_its_queue_is_full(wait_for):
+    release, processed = threading.Event(), []
+
+    def process(payload):
+        release.wait(5)
+        processed.append(payload)
+
+    pool = IngestPool(process, workers=1, max_batches=1)
+    pool.submit([1])
+    # The worker holds the first batch; one more fits in the queue.
+    assert wait_for(lambda: pool.depth() == 0)
+    pool.submit([2])
+    assert pool.full()
+    with pytest.raises(QueueFull):
+        pool.submit([3])
+    release.set()
+    pool.close()
+    assert processed == [1, 2]
+
+def test_pool_keeps_going_after_a_bad_payload():
+    processed = []
+
+    def process(payload):
+        if payload == "bad":
+            raise KeyError(payload)
+        processed.append(payload)
+
+    pool = IngestPool(process, workers=1)
+    pool.submit(["a", "bad", "b"])
+    pool.close()
+    assert processed == ["a", "b"]
@@ -0,0 +1,16 @@
+import pytest
+
+@pytest.mark.parametrize("seconds", ["-1", "0", "nan", "inf", "61", "soon"])
+def test_profile_rejects_seconds_out_of_range(client, seconds):
+    response = client.get(f"/debug/profile?seconds={seconds}")
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "rejected"
+
+def test_profile_samples_for_the_given_time(client):
+    response = client.get("/debug/profile?seconds=0.05")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+def test_profile_is_loopback_only(client):
+    response = client.get("/debug/profile?seconds=1", environ_base={"REMOTE_ADDR": "10.0.0.5"})
+    assert response.status_code == 403
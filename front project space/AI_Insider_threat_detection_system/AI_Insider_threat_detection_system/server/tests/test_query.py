@@ -0,0 +1,93 @@
+import json
+import time
+
+import pytest
+
+from storage import Store
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / "insider.db"), flush_interval=0.01)
+    yield store
+    store.close()
+
+def fill(store, wait_for, events):
+    # events: (n, user, host, sections); returns once they are all written.
+    expected = store.count("events") + len(events)
+    for n, user, host, sections in events:
+        store.add_event({"n": n}, user=user, host=host, sections=sections)
+    assert wait_for(lambda: store.count("events") == expected)
+
+def pages(query, limit, **filters):
+    ns, cursor = [], None
+    while True:
+        rows, cursor = query(cursor=cursor, limit=limit, **filters)
+        ns.append([json.loads(body)["n"] for _, body in rows])
+        if cursor is None:
+            return ns
+
+def test_pages_walk_newest_first_without_gaps(store, wait_for):
+    fill(store, wait_for, [(n, "alice", "WS-01", ("files",)) for n in range(7)])
+    assert pages(store.query_events, 3) == [[6, 5, 4], [3, 2, 1], [0]]
+    assert pages(store.query_events, 7) == [[6, 5, 4, 3, 2, 1, 0]]
+
+def test_new_events_do_not_shift_a_page_in_progress(store, wait_for):
+    fill(store, wait_for, [(n, "alice", "WS-01", ()) for n in range(5)])
+    rows, cursor = store.query_events(limit=2)
+    fill(store, wait_for, [(n, "alice", "WS-01", ()) for n in range(5, 8)])
+    rows, cursor = store.query_events(cursor=cursor, limit=2)
+    assert [json.loads(body)["n"] for _, body in rows] == [2, 1]
+
+def test_filters_page_through_their_own_rows(store, wait_for):
+    fill(store, wait_for, [
+        (0, "alice", "WS-01", ("files", "usb")),
+        (1, "bob", "WS-02", ("files",)),
+        (2, "alice", "WS-02", ("usb",)),
+        (3, "alice", "WS-01", ("files",)),
+        (4, "bob", "WS-01", ("usb",)),
+    ])
+    assert pages(store.query_events, 1, user="alice") == [[3], [2], [0]]
+    assert pages(store.query_events, 2, host="WS-01") == [[4, 3], [0]]
+    assert pages(store.query_events, 2, section="usb") == [[4, 2], [0]]
+    assert pages(store.query_events, 1, user="alice", section="files") == [[3], [0]]
+    assert store.query_events(section="email") == ([], None)
+
+def test_time_range_bounds_the_pages(store, wait_for):
+    fill(store, wait_for, [(n, "alice", "WS-01", ()) for n in range(3)])
+    time.sleep(0.01)
+    since = time.time()
+    fill(store, wait_for, [(n, "alice", "WS-01", ()) for n in range(3, 6)])
+    until = time.time()
+    time.sleep(0.01)
+    fill(store, wait_for, [(n, "alice", "WS-01", ()) for n in range(6, 8)])
+    assert pages(store.query_events, 2, since=since, until=until) == [[5, 4], [3]]
+    assert pages(store.query_events, 10, since=time.time() + 60) == [[]]
+
+def test_alert_pages_follow_when_incidents_opened(store, wait_for):
+    for n in range(4):
+        store.add_alert({"id": f"i{n}", "rule": "usb.mass_storage" if n % 2 else "identity.failed_login",
+                         "section": "usb", "entity": {"UserID": "alice", "MachineName": "WS-01"},
+                         "first_seen": n, "last_seen": time.time(), "n": n})
+    assert wait_for(lambda: store.count("alerts") == 4)
+    assert pages(store.query_alerts, 1, rule="usb.mass_storage") == [[3], [1]]
+    # Repeating an incident updates its row in place; its place in the
+    # paging order stays where it opened.
+    store.add_alert({"id": "i0", "rule": "identity.failed_login", "section": "usb", "entity": {},
+                     "first_seen": 0, "last_seen": time.time(), "n": 0, "count": 2})
+    assert wait_for(lambda: json.loads(store.query_alerts(limit=4)[0][-1][1]).get("count") == 2)
+    assert pages(store.query_alerts, 3) == [[3, 2, 1], [0]]
+
+def test_api_pages_with_cursors(client, server, wait_for):
+    for n in range(5):
+        assert client.post("/agent", json={"agent_id": "PAGING-01", "files": [{"n": n}]}).status_code == 200
+    assert wait_for(lambda: len(client.get("/api/events?host=PAGING-01").get_json()["items"]) == 5)
+    seen, url = [], "/api/events?host=PAGING-01&limit=2"
+    while True:
+        page = client.get(url).get_json()
+        assert page["ids"] == sorted(page["ids"], reverse=True)
+        seen += [item["files"][0]["n"] for item in page["items"]]
+        if page["next_cursor"] is None:
+            break
+        url = f"/api/events?host=PAGING-01&limit=2&cursor={page['next_cursor']}"
+    assert seen == [4, 3, 2, 1, 0]
+    assert client.get("/api/events?cursor=soon").status_code == 400
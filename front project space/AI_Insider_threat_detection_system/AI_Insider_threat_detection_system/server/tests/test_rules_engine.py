@@ -0,0 +1,22 @@
+from rules_engine import RuleEngine, payload_entity
+from windows import WindowStore
+
+def remote_logon(user, client):
+    return {"UserID": user, "MachineName": client, "LogonType": "remote", "AuthResult": "success"}
+
+def test_host_is_the_reporting_agent():
+    payload = {"agent_id": "WS-01", "identity": [remote_logon("alice", "LAPTOP-7")]}
+    assert payload_entity(payload) == {"UserID": "alice", "MachineName": "WS-01"}
+
+def test_identity_host_only_without_agent_id():
+    assert payload_entity({"identity": remote_logon("alice", "LAPTOP-7")})["MachineName"] == "LAPTOP-7"
+    assert payload_entity({}) == {"UserID": None, "MachineName": None}
+
+def test_per_host_window_stays_on_the_agent_across_logons():
+    engine = RuleEngine(windows=WindowStore())
+    for client in ("LAPTOP-7", "LAPTOP-8", None):
+        payload = {"agent_id": "WS-01", "usb": [{"MountPoint": "E:", "DataTransferVolume": 100}]}
+        if client:
+            payload["identity"] = [remote_logon("alice", client)]
+        engine.match(payload, now=1000.0)
+    assert set(engine.windows.counters) == {"usb.volume_above_norm|WS-01", "usb.volume_above_norm#baseline|WS-01"}
@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from storage import Store
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / "insider.db"), recent_size=50, flush_interval=0.01)
+    yield store
+    store.close()
+
+def test_recent_events_can_be_read_while_events_arrive(store):
+    stop, errors = threading.Event(), []
+
+    def write():
+        n = 0
+        while not stop.is_set():
+            store.add_event({"n": n})
+            n += 1
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(2000):
+            try:
+                store.recent_events(50)
+            except RuntimeError as e:  # deque mutated during iteration
+                errors.append(e)
+                break
+    finally:
+        stop.set()
+        writer.join()
+    assert errors == []
+
+@pytest.mark.parametrize("path", ["/api/events?limit=0", "/api/alerts?limit=0", "/api/events?limit=-5"])
+def test_limit_below_one_is_rejected(client, path):
+    response = client.get(path)
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "limit must be at least 1"
+
+def test_query_limit_is_capped(store):
+    with pytest.raises(ValueError):
+        store.query_events(limit=0)
+    rows, cursor = store.query_events(limit=10_000)
+    assert rows == [] and cursor is None
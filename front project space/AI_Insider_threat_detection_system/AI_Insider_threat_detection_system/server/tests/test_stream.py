@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from stream import Broadcaster, TooManyClients
+
+def events(messages):
+    # (id, event, data) of each SSE message.
+    parsed = []
+    for message in messages:
+        fields = dict(line.split(": ", 1) for line in message.strip().splitlines() if ": " in line)
+        if "event" in fields:
+            parsed.append((int(fields["id"]) if "id" in fields else None, fields["event"], json.loads(fields["data"])))
+    return parsed
+
+def test_reconnect_replays_what_was_missed():
+    broadcaster = Broadcaster()
+    ids = [broadcaster.publish("alert", {"n": n}) for n in range(5)]
+    client, backlog = broadcaster.subscribe(last_event_id=ids[2])
+    assert events(backlog) == [(ids[3], "alert", {"n": 3}), (ids[4], "alert", {"n": 4})]
+    # Up to date: nothing to replay, and new events arrive live.
+    _, backlog = broadcaster.subscribe(last_event_id=ids[4])
+    assert backlog == []
+    broadcaster.publish("alert", {"n": 5})
+    assert events([client.queue.get_nowait()]) == [(ids[4] + 1, "alert", {"n": 5})]
+
+def test_reset_when_the_gap_left_the_replay_buffer():
+    broadcaster = Broadcaster(replay_size=3)
+    ids = [broadcaster.publish("alert", {"n": n}) for n in range(6)]
+    _, backlog = broadcaster.subscribe(last_event_id=ids[1])
+    assert [event for _, event, _ in events(backlog)] == ["reset"]
+    # The oldest event still held can be replayed from the one before it.
+    _, backlog = broadcaster.subscribe(last_event_id=ids[2])
+    assert [data["n"] for _, _, data in events(backlog)] == [3, 4, 5]
+    # An id from the future (another server, or a clock jump) also resets.
+    _, backlog = broadcaster.subscribe(last_event_id=ids[5] + 100)
+    assert [event for _, event, _ in events(backlog)] == ["reset"]
+
+def test_slow_client_is_dropped_and_counted():
+    broadcaster = Broadcaster(client_queue_size=2)
+    client, _ = broadcaster.subscribe()
+    for n in range(3):
+        broadcaster.publish("alert", {"n": n})
+    assert client.closed and client not in broadcaster.clients
+    assert broadcaster.dropped == 1
+
+def test_client_limit():
+    broadcaster = Broadcaster(max_clients=1)
+    broadcaster.subscribe()
+    with pytest.raises(TooManyClients):
+        broadcaster.subscribe()
+
+def read(response, count):
+    # The first `count` messages of a streaming response, skipping summaries.
+    messages = []
+    for chunk in response.response:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if "event: summary" not in chunk:
+            messages.append(chunk)
+        if len(messages) == count:
+            return messages
+    return messages
+
+def test_stream_endpoint_replays_after_last_event_id(client, server):
+    ids = [server.broadcaster.publish("alert", {"stream_test": n}) for n in range(3)]
+    response = client.get("/api/stream", headers={"Last-Event-ID": str(ids[0])}, buffered=False)
+    try:
+        assert response.status_code == 200 and response.mimetype == "text/event-stream"
+        retry, *backlog = read(response, 3)
+        assert retry.startswith("retry:")
+        assert events(backlog) == [(ids[1], "alert", {"stream_test": 1}), (ids[2], "alert", {"stream_test": 2})]
+    finally:
+        response.close()
+
+def test_stream_endpoint_rejects_a_bad_last_event_id(client):
+    assert client.get("/api/stream", headers={"Last-Event-ID": "latest"}).status_code == 400
@@ -0,0 +1,76 @@
+from views import SUMMARY_CACHE_SECONDS, Views
+
+T0 = 1_800_000_000.0  # On a minute boundary
+
+def hit(section):
+    return {"section": section}
+
+def process(name, cpu, memory):
+    return {"ProcessName": name, "PID": 1, "CPUUsage": cpu, "MemoryUsage": memory}
+
+def test_per_minute_series_keep_the_last_hour():
+    views = Views()
+    views.add({}, "WS-01", {"files": 3, "usb": 1}, [hit("usb")], now=T0)
+    views.add({}, "WS-01", {"files": 2}, [], now=T0 + 30)
+    views.add({}, "WS-01", {"files": 1}, [hit("files"), hit("usb")], now=T0 + 60)
+    summary = views.summary(now=T0 + 61)
+    assert [m["counts"] for m in summary["events_per_minute"]] == [{"files": 5, "usb": 1}, {"files": 1}]
+    assert [m["counts"] for m in summary["alerts_per_minute"]] == [{"usb": 1}, {"files": 1, "usb": 1}]
+    assert summary["totals"]["events"] == 3 and summary["totals"]["alerts"] == 3
+
+    later = views.summary(now=T0 + 3600 + 30)
+    assert [m["counts"] for m in later["events_per_minute"]] == [{"files": 1}]
+
+def test_top_talkers_and_usb_volume_slide_out_of_their_windows():
+    views = Views()
+    network = [{"DestIP": "1.1.1.1", "BytesSent": 100, "BytesReceived": 50},
+               {"DestIP": "2.2.2.2", "BytesSent": 10, "BytesReceived": 0},
+               {"DestIP": "3.3.3.3", "BytesSent": 0, "BytesReceived": 0}]
+    views.add({"network": network, "usb": {"DataTransferVolume": 500}}, "WS-01", {}, [], now=T0)
+    views.add({"network": network[:1]}, "WS-02", {}, [], now=T0 + 600)
+    summary = views.summary(now=T0 + 600)
+    assert summary["top_talkers"] == [{"key": "1.1.1.1", "total": 300.0}, {"key": "2.2.2.2", "total": 10.0}]
+    assert summary["usb_volume"] == [{"key": "WS-01", "total": 500.0}]
+
+    summary = views.summary(now=T0 + 3900)
+    assert summary["top_talkers"] == [{"key": "1.1.1.1", "total": 150.0}]
+    assert summary["usb_volume"] == [{"key": "WS-01", "total": 500.0}]
+
+def test_top_processes_use_each_host_latest_snapshot():
+    views = Views(top_n=2)
+    views.add({"processes": [process("a", 90, 10), process("b", 5, 900)]}, "WS-01", {}, [], now=T0)
+    views.add({"processes": [process("c", 50, 500)]}, "WS-02", {}, [], now=T0 + 100)
+    views.add({"processes": [process("d", 10, 10)]}, "WS-01", {}, [], now=T0 + 200)
+    summary = views.summary(now=T0 + 200)
+    assert [(p["host"], p["ProcessName"]) for p in summary["top_cpu"]] == [("WS-02", "c"), ("WS-01", "d")]
+    assert summary["totals"]["active_hosts"] == 2
+
+    # WS-02 has not reported for longer than the staleness limit.
+    summary = views.summary(now=T0 + 450)
+    assert [p["ProcessName"] for p in summary["top_memory"]] == ["d"]
+    assert summary["totals"]["active_hosts"] == 1
+
+def test_keyed_views_are_bounded():
+    views = Views(max_keys=2)
+    for n in range(4):
+        views.add({"usb": [{"DataTransferVolume": 10 + n}], "processes": []}, f"WS-{n}", {}, [], now=T0 + n)
+    assert list(views.usb.counters) == ["WS-2", "WS-3"]
+    assert list(views.processes) == ["WS-2", "WS-3"]
+
+def test_summary_is_cached_briefly():
+    views = Views()
+    first = views.summary(now=T0)
+    views.add({}, "WS-01", {"files": 1}, [], now=T0)
+    assert views.summary(now=T0 + SUMMARY_CACHE_SECONDS / 2) is first
+    assert views.summary(now=T0 + SUMMARY_CACHE_SECONDS)["totals"]["events"] == 1
+
+def test_baseline_alerts_count_without_an_event():
+    views = Views()
+    views.add_alerts([hit("usb")], now=T0)
+    summary = views.summary(now=T0)
+    assert summary["totals"] == {"events": 0, "alerts": 1, "active_hosts": 0}
+
+def test_summary_endpoint_reflects_ingest(client, server, wait_for):
+    before = client.get("/api/summary").get_json()["totals"]["events"]
+    assert client.post("/agent", json={"agent_id": "VIEWS-01", "files": [{"FilePath": "a.docx"}]}).status_code == 200
+    assert wait_for(lambda: client.get("/api/summary").get_json()["totals"]["events"] == before + 1)
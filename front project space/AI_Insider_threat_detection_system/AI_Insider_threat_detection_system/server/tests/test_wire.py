@@ -0,0 +1,41 @@
+import pytest
+
+from common import wire
+from common.schema import from_columns, to_columns
+from ingest import decode_payload
+
+msgpack = pytest.importorskip("msgpack")
+
+def test_columns_keep_none_apart_from_missing_fields():
+    records = [{"FilePath": "a.docx", "Hash": None}, {"FilePath": "b.docx"}, {"Hash": "ab12", "Extra": 1}]
+    packed = to_columns("files", records)
+    assert from_columns(packed) == records
+    assert "absent" not in to_columns("files", [{"FilePath": "a", "Hash": None}])
+
+def test_msgpack_round_trip_of_payloads_and_deltas():
+    payload = {"agent_id": "WS-01", "files": [{"FilePath": "a.docx", "Hash": None}, {"FilePath": "b.docx"}],
+               "changes": {"usb": {"added": [["k1", {"MountPoint": "E:", "Serial": None}]], "removed": ["k0"]}}}
+    body, content_type = wire.encode(payload)
+    assert content_type == wire.MSGPACK
+    assert wire.decode(body, content_type) == payload
+
+@pytest.mark.parametrize("packed", [
+    {"files": {"$columns": {"rows": [[1]]}}},
+    {"files": {"$columns": {"columns": ["a"], "rows": [[1, 2]]}}},
+    {"files": {"$columns": {"columns": ["a"], "rows": "x"}}},
+    {"files": {"$columns": {"columns": [["a"]], "rows": [[1]]}}},
+    {"files": {"$columns": {"columns": ["a"], "rows": [[1]], "absent": [[3, 0]]}}},
+    {"files": {"$columns": ["a"]}},
+    {"changes": {"files": {"added": {"records": {"$columns": {"columns": [], "rows": []}}}}}},
+    {"changes": {"files": 7}},
+])
+def test_malformed_packed_records_are_value_errors(packed):
+    body = msgpack.packb(dict(packed, agent_id="WS-01"), use_bin_type=True)
+    with pytest.raises(ValueError):
+        decode_payload(body, content_type=wire.MSGPACK)
+
+def test_malformed_msgpack_payload_is_a_400(client):
+    body = msgpack.packb({"agent_id": "WIRE-01", "files": {"$columns": {"rows": [[1]]}}}, use_bin_type=True)
+    response = client.post("/agent", data=body, headers={"Content-Type": wire.MSGPACK})
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "rejected"
@@ -0,0 +1,173 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from windows import RingCounter
+
+# Dashboard aggregates maintained as payloads are ingested, so reading them
+# never touches stored history. Every structure is bounded: the per-minute
+# series by its length, keyed counters and per-host snapshots by LRU eviction.
+# summary() is cached briefly so a burst of dashboard requests costs one build.
+SERIES_MINUTES = 60
+TOP_N = 10
+MAX_KEYS = 10_000
+TALKER_SECONDS = 3600
+USB_SECONDS = 24 * 3600
+PROCESS_STALE_SECONDS = 300
+SUMMARY_CACHE_SECONDS = 1.0
+
+
+class MinuteSeries:
+    # Per-key counts for each of the last `minutes` minutes.
+    def __init__(self, minutes=SERIES_MINUTES):
+        self.minutes = minutes
+        self.buckets = deque()
+
+    def _trim(self, minute):
+        while self.buckets and self.buckets[0][0] <= minute - self.minutes:
+            self.buckets.popleft()
+
+    def add(self, key, count, now):
+        minute = int(now // 60)
+        if not self.buckets or self.buckets[-1][0] < minute:
+            self.buckets.append((minute, {}))
+            self._trim(minute)
+        counts = self.buckets[-1][1]
+        counts[key] = counts.get(key, 0) + count
+
+    def to_json(self, now):
+        self._trim(int(now // 60))
+        return [
+            {"minute": datetime.fromtimestamp(minute * 60, timezone.utc).isoformat(), "counts": dict(counts)}
+            for minute, counts in self.buckets
+        ]
+
+
+class TopCounter:
+    # Sliding-window sums per key; the least recently updated keys are
+    # evicted past max_keys.
+    def __init__(self, seconds, buckets=60, max_keys=MAX_KEYS):
+        self.seconds = seconds
+        self.buckets = buckets
+        self.max_keys = max_keys
+        self.counters = OrderedDict()
+
+    def add(self, key, value, now):
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = RingCounter(self.seconds, self.buckets)
+            if len(self.counters) > self.max_keys:
+                self.counters.popitem(last=False)
+        else:
+            self.counters.move_to_end(key)
+        counter.add(value, now)
+
+    def top(self, n, now):
+        totals = ((key, counter.current(now)) for key, counter in self.counters.items())
+        return [
+            {"key": key, "total": total}
+            for key, total in heapq.nlargest(n, totals, key=lambda item: item[1]) if total > 0
+        ]
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _records(payload, section):
+    records = payload.get(section) or ()
+    return (records,) if isinstance(records, dict) else records
+
+
+class Views:
+    def __init__(self, top_n=TOP_N, max_keys=MAX_KEYS):
+        self.top_n = top_n
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.events = MinuteSeries()
+        self.alerts = MinuteSeries()
+        self.talkers = TopCounter(TALKER_SECONDS, 60, max_keys)
+        self.usb = TopCounter(USB_SECONDS, 24, max_keys)
+        # host -> (updated, top by CPU, top by memory)
+        self.processes = OrderedDict()
+        self.totals = {"events": 0, "alerts": 0}
+        self.cached = None
+        self.cached_at = 0.0
+
+    def add(self, payload, host, sections, hits, now=None):
+        # sections maps section name to record count; hits are the
+        # structured rule hits for the payload.
+        now = time.time() if now is None else now
+        by_cpu = heapq.nlargest(self.top_n, self._process_rows(payload, host), key=lambda p: p["CPUUsage"])
+        by_memory = heapq.nlargest(self.top_n, self._process_rows(payload, host), key=lambda p: p["MemoryUsage"])
+        with self.lock:
+            self.totals["events"] += 1
+            self._add_alerts(hits, now)
+            for section, count in sections.items():
+                self.events.add(section, count, now)
+            for record in _records(payload, "network"):
+                sent = _number(record.get("BytesSent")) + _number(record.get("BytesReceived"))
+                if sent:
+                    self.talkers.add(record.get("DestIP"), sent, now)
+            for record in _records(payload, "usb"):
+                volume = _number(record.get("DataTransferVolume"))
+                if volume:
+                    self.usb.add(host, volume, now)
+            if "processes" in payload:
+                self.processes[host] = (now, by_cpu, by_memory)
+                self.processes.move_to_end(host)
+                if len(self.processes) > self.max_keys:
+                    self.processes.popitem(last=False)
+
+    def add_alerts(self, hits, now=None):
+        # For hits raised outside ingest, such as baseline anomalies.
+        now = time.time() if now is None else now
+        with self.lock:
+            self._add_alerts(hits, now)
+
+    def _add_alerts(self, hits, now):
+        self.totals["alerts"] += len(hits)
+        for hit in hits:
+            self.alerts.add(hit["section"], 1, now)
+
+    def _process_rows(self, payload, host):
+        for record in _records(payload, "processes"):
+            yield {
+                "host": host,
+                "ProcessName": record.get("ProcessName"),
+                "PID": record.get("PID"),
+                "CPUUsage": _number(record.get("CPUUsage")),
+                "MemoryUsage": _number(record.get("MemoryUsage")),
+            }
+
+    def summary(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.cached is not None and now - self.cached_at < SUMMARY_CACHE_SECONDS:
+                return self.cached
+            # Hosts that stopped reporting no longer count towards top processes.
+            while self.processes:
+                host, (updated, _, _) = next(iter(self.processes.items()))
+                if now - updated <= PROCESS_STALE_SECONDS:
+                    break
+                del self.processes[host]
+            snapshots = list(self.processes.values())
+            self.cached = {
+                "generated": now,
+                "totals": dict(self.totals, active_hosts=len(snapshots)),
+                "events_per_minute": self.events.to_json(now),
+                "alerts_per_minute": self.alerts.to_json(now),
+                "top_talkers": self.talkers.top(self.top_n, now),
+                "top_cpu": heapq.nlargest(
+                    self.top_n, (p for _, cpu, _ in snapshots for p in cpu), key=lambda p: p["CPUUsage"]),
+                "top_memory": heapq.nlargest(
+                    self.top_n, (p for _, _, mem in snapshots for p in mem), key=lambda p: p["MemoryUsage"]),
+                "usb_volume": self.usb.top(self.top_n, now),
+            }
+            self.cached_at = now
+            return self.cached
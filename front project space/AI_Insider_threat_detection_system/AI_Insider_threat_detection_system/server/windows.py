@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_BUCKETS = 60
+
+
+class RingCounter:
+    # Sliding-window sum over `buckets` fixed-width time buckets. Adding is
+    # amortised O(1): expired buckets are subtracted from the running total
+    # as the window advances, so reading the total never rescans the ring.
+    __slots__ = ("seconds", "width", "values", "head", "total")
+
+    def __init__(self, seconds, buckets=DEFAULT_BUCKETS):
+        self.seconds = seconds
+        self.width = seconds / buckets
+        self.values = [0.0] * buckets
+        self.head = None
+        self.total = 0.0
+
+    def _advance(self, now):
+        index = int(now // self.width)
+        if self.head is None:
+            self.head = index
+            return index
+        if index <= self.head:
+            return index
+        n = len(self.values)
+        if index - self.head >= n:
+            self.values = [0.0] * n
+            self.total = 0.0
+        else:
+            for i in range(self.head + 1, index + 1):
+                slot = i % n
+                self.total -= self.values[slot]
+                self.values[slot] = 0.0
+        self.head = index
+        return index
+
+    def add(self, value, now):
+        index = self._advance(now)
+        if index <= self.head - len(self.values):
+            return self.total  # Older than the window; ignore
+        self.values[index % len(self.values)] += value
+        self.total += value
+        return self.total
+
+    def current(self, now):
+        self._advance(now)
+        return self.total
+
+    def to_json(self):
+        return [self.seconds, self.head, self.values]
+
+    @classmethod
+    def from_json(cls, data):
+        seconds, head, values = data
+        counter = cls.__new__(cls)
+        counter.seconds = seconds
+        counter.width = seconds / len(values)
+        counter.head = head
+        counter.values = list(values)
+        counter.total = sum(counter.values)
+        return counter
+
+
+class WindowStore:
+    # Counters keyed by (rule id, entity). Memory per key is fixed by the
+    # bucket count, and the least recently used keys are evicted past
+    # max_keys. State is checkpointed to a JSON file so windows survive a
+    # restart.
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self.counters = OrderedDict()
+        self.lock = threading.Lock()
+        self.evicted = 0
+        self.path = None
+        self.timer = None
+
+    def add(self, name, key, value, seconds, buckets=DEFAULT_BUCKETS, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            counter = self._get(name, key, seconds, buckets)
+            before = counter.current(now)
+            return before, counter.add(value, now)
+
+    def current(self, name, key, seconds, buckets=DEFAULT_BUCKETS, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            return self._get(name, key, seconds, buckets).current(now)
+
+    def _get(self, name, key, seconds, buckets):
+        full_key = f"{name}|{key}"
+        counter = self.counters.get(full_key)
+        if counter is None or counter.seconds != seconds or len(counter.values) != buckets:
+            counter = RingCounter(seconds, buckets)
+            self.counters[full_key] = counter
+            if len(self.counters) > self.max_keys:
+                self.counters.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.counters.move_to_end(full_key)
+        return counter
+
+    def load(self, path):
+        self.path = path
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            for key, value in data.items():
+                self.counters[key] = RingCounter.from_json(value)
+
+    def checkpoint(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = {key: counter.to_json() for key, counter in self.counters.items()}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def checkpoint_every(self, interval):
+        def run():
+            try:
+                self.checkpoint()
+            except OSError as e:
+                print(f"[-] Failed to checkpoint windows: {e}")
+            self.checkpoint_every(interval)
+
+        self.timer = threading.Timer(interval, run)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.checkpoint()